@@ -250,6 +250,7 @@ class Turma(Base):
     __tablename__ = 'turmas'
     
     id = Column(Integer, primary_key=True, autoincrement=True)
+    instituicao_id = Column(Integer, ForeignKey('instituicoes.id', ondelete='CASCADE'), nullable=False)
     ano_letivo_id = Column(Integer, ForeignKey('anos_letivos.id', ondelete='CASCADE'), nullable=False)
     classe_id = Column(Integer, ForeignKey('classes.id', ondelete='CASCADE'), nullable=False)
     sala_id = Column(Integer, ForeignKey('salas.id'))
@@ -284,6 +285,7 @@ class Turma(Base):
     horarios = relationship("HorarioAula", back_populates="turma", cascade="all, delete-orphan")
     
     __table_args__ = (
+        Index('idx_turma_instituicao_ano', 'instituicao_id', 'ano_letivo_id'),
         UniqueConstraint('ano_letivo_id', 'classe_id', 'codigo', name='uq_turma_codigo'),
         Index('idx_turma_ano_letivo', 'ano_letivo_id'),
         Index('idx_turma_classe', 'classe_id'),
@@ -360,3 +362,94 @@ class HorarioAula(Base):
         fim = datetime.combine(date.today(), self.hora_fim)
         diferenca = fim - inicio
         return int(diferenca.total_seconds() / 60)
+
+# Restrições de exclusão (PostgreSQL): impedem que um professor ou uma sala
+# tenham duas aulas semanais sobrepostas no mesmo dia. Abrangem as aulas
+# activas de todos os anos: a transição de ano desactiva as do ano encerrado.
+RESTRICOES_EXCLUSAO_HORARIO = [
+    DDL("CREATE EXTENSION IF NOT EXISTS btree_gist"),
+    DDL("""
+        ALTER TABLE horarios_aula ADD CONSTRAINT ex_horario_professor
+        EXCLUDE USING gist (
+            professor_id WITH =,
+            dia_semana WITH =,
+            tsrange(DATE '2000-01-01' + hora_inicio, DATE '2000-01-01' + hora_fim) WITH &&
+        ) WHERE (ativo AND data_especifica IS NULL)
+    """),
+    DDL("""
+        ALTER TABLE horarios_aula ADD CONSTRAINT ex_horario_sala
+        EXCLUDE USING gist (
+            sala_id WITH =,
+            dia_semana WITH =,
+            tsrange(DATE '2000-01-01' + hora_inicio, DATE '2000-01-01' + hora_fim) WITH &&
+        ) WHERE (ativo AND data_especifica IS NULL AND sala_id IS NOT NULL)
+    """),
+]
+
+for _ddl in RESTRICOES_EXCLUSAO_HORARIO:
+    event.listen(HorarioAula.__table__, 'after_create', _ddl.execute_if(dialect='postgresql'))
+
+class PresencaAula(Base):
+    """Presença dos alunos em cada aula"""
+    __tablename__ = 'presencas_aula'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    horario_id = Column(Integer, ForeignKey('horarios_aula.id', ondelete='CASCADE'), nullable=False)
+    aluno_id = Column(Integer, ForeignKey('alunos.id', ondelete='CASCADE'), nullable=False)
+    
+    # Aula
+    data_aula = Column(Date, nullable=False)
+    
+    # Presença
+    presente = Column(Boolean, default=True, nullable=False)
+    justificada = Column(Boolean, default=False, nullable=False)
+    motivo_justificacao = Column(String(500))
+    atraso_minutos = Column(Integer, default=0)
+    
+    # Registo
+    registrado_por_id = Column(Integer, ForeignKey('usuarios.id'))
+    data_registro = Column(DateTime, default=datetime.utcnow, nullable=False)
+    
+    # Observações
+    observacoes = Column(String(500))
+    
+    # Relacionamentos
+    horario = relationship("HorarioAula", back_populates="presencas")
+    aluno = relationship("Aluno", back_populates="presencas")
+    registrado_por = relationship("Usuario")
+    
+    __table_args__ = (
+        UniqueConstraint('horario_id', 'aluno_id', 'data_aula', name='uq_presenca_aula'),
+        Index('idx_presenca_aluno_data', 'aluno_id', 'data_aula'),
+        Index('idx_presenca_horario_data', 'horario_id', 'data_aula'),
+        CheckConstraint('NOT (presente AND justificada)', name='ck_presenca_justificada'),
+    )
+
+class MapaFrequencia(Base):
+    """Mapa compacto (bitmaps) das presenças de um aluno num período letivo"""
+    __tablename__ = 'mapas_frequencia'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    aluno_id = Column(Integer, ForeignKey('alunos.id', ondelete='CASCADE'), nullable=False)
+    ano_letivo_id = Column(Integer, ForeignKey('anos_letivos.id', ondelete='CASCADE'), nullable=False)
+    
+    # Período (trimestre 1-3; 0 = ano letivo inteiro)
+    trimestre = Column(Integer, nullable=False)
+    data_inicio = Column(Date, nullable=False)  # Dia 0 dos bitmaps
+    
+    # Um bit por (dia, tempo de 30 min) a partir de data_inicio
+    aulas = Column(LargeBinary, nullable=False, default=b'')         # Aula registada
+    faltas = Column(LargeBinary, nullable=False, default=b'')        # Ausente
+    justificadas = Column(LargeBinary, nullable=False, default=b'')  # Falta justificada
+    
+    data_atualizacao = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Relacionamentos
+    aluno = relationship("Aluno")
+    ano_letivo = relationship("AnoLetivo")
+    
+    __table_args__ = (
+        UniqueConstraint('aluno_id', 'ano_letivo_id', 'trimestre', name='uq_mapa_frequencia'),
+        Index('idx_mapa_frequencia_periodo', 'ano_letivo_id', 'trimestre'),
+        CheckConstraint('trimestre BETWEEN 0 AND 3', name='ck_mapa_trimestre'),
+    )
@@ -13,6 +13,7 @@ class Aluno(Base):
     __tablename__ = 'alunos'
     
     id = Column(Integer, primary_key=True, autoincrement=True)
+    instituicao_id = Column(Integer, ForeignKey('instituicoes.id', ondelete='CASCADE'), nullable=False)
     pessoa_id = Column(Integer, ForeignKey('pessoas.id', ondelete='CASCADE'), nullable=False)
     codigo_aluno = Column(String(50), unique=True, nullable=False)  # Código interno
     
@@ -57,6 +58,8 @@ class Aluno(Base):
     presencas = relationship("PresencaAula", back_populates="aluno", cascade="all, delete-orphan")
     
     __table_args__ = (
+        Index('idx_aluno_instituicao_status', 'instituicao_id', 'status'),
+        Index('idx_aluno_instituicao_codigo', 'instituicao_id', 'codigo_aluno'),
         Index('idx_aluno_codigo', 'codigo_aluno'),
         Index('idx_aluno_status', 'status'),
         Index('idx_aluno_codigo_med', 'codigo_med_aluno'),
@@ -70,11 +73,21 @@ class Aluno(Base):
                 return enc
         return None
 
+# Índices de pesquisa por prefixo dos códigos (PostgreSQL)
+INDICES_PESQUISA_ALUNO = [
+    DDL("CREATE INDEX IF NOT EXISTS idx_aluno_codigo_prefixo ON alunos (codigo_aluno text_pattern_ops)"),
+    DDL("CREATE INDEX IF NOT EXISTS idx_aluno_codigo_med_prefixo ON alunos (codigo_med_aluno text_pattern_ops)"),
+]
+
+for _ddl in INDICES_PESQUISA_ALUNO:
+    event.listen(Aluno.__table__, 'after_create', _ddl.execute_if(dialect='postgresql'))
+
 class Matricula(Base):
     """Matrícula do aluno em um ano letivo e turma"""
     __tablename__ = 'matriculas'
     
     id = Column(Integer, primary_key=True, autoincrement=True)
+    instituicao_id = Column(Integer, ForeignKey('instituicoes.id', ondelete='CASCADE'), nullable=False)
     aluno_id = Column(Integer, ForeignKey('alunos.id', ondelete='CASCADE'), nullable=False)
     ano_letivo_id = Column(Integer, ForeignKey('anos_letivos.id', ondelete='CASCADE'), nullable=False)
     turma_id = Column(Integer, ForeignKey('turmas.id'), nullable=False)
@@ -89,6 +102,10 @@ class Matricula(Base):
     transferencia = Column(Boolean, default=False)
     repetente = Column(Boolean, default=False)
     
+    # Contadores de faltas (mantidos pelo registo de presenças)
+    faltas_injustificadas = Column(Integer, default=0, nullable=False)
+    faltas_justificadas = Column(Integer, default=0, nullable=False)
+    
     # Processo
     processo_matricula = Column(String(50))
     tipo_ingresso = Column(String(50), default='normal')  # normal, transferencia, recurso
@@ -109,9 +126,12 @@ class Matricula(Base):
     notas = relationship("Nota", back_populates="matricula", cascade="all, delete-orphan")
     
     __table_args__ = (
+        Index('idx_matricula_instituicao_ano', 'instituicao_id', 'ano_letivo_id', 'ativa'),
         UniqueConstraint('aluno_id', 'ano_letivo_id', name='uq_matricula_ano'),
         Index('idx_matricula_ativa', 'ativa'),
         Index('idx_matricula_numero', 'numero_matricula'),
+        # Parcial: matrícula activa de cada aluno
+        Index('idx_matricula_aluno_ativa', 'aluno_id', postgresql_where=text('ativa'), sqlite_where=text('ativa')),
     )
     
     @property
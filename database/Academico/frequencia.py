@@ -0,0 +1,258 @@
+"""
+Frequência em bitmaps.
+
+Para cada aluno e período letivo (`MapaFrequencia`) guardam-se três bitmaps
+com um bit por (dia, tempo de 30 minutos) contado a partir do início do
+período: aula registada, falta e falta justificada. Os mapas são mantidos
+por `registrar_chamada` ao lado de `PresencaAula` e podem ser reconstruídos
+a partir dela.
+
+Com os mapas de uma escola inteira carregados numa matriz NumPy, a
+percentagem de frequência, as sequências de faltas e o ranking de
+absentismo calculam-se com operações vectorizadas sobre bits.
+"""
+
+from datetime import date, time
+from typing import Dict, Tuple, Optional, Iterable, List
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, insert, update
+from sqlalchemy.orm import Session
+
+from .academico import AnoLetivo, PresencaAula, HorarioAula, MapaFrequencia
+from ..instituicao.instituicao import ConfiguracaoSistema
+
+
+HORA_BASE_MINUTOS = 6 * 60   # Primeiro tempo às 06:00
+MINUTOS_TEMPO = 30
+TEMPOS_DIA = 32              # 06:00 - 22:00
+BYTES_DIA = TEMPOS_DIA // 8
+
+BITMAPS = ('aulas', 'faltas', 'justificadas')
+
+# Número de bits a 1 em cada byte
+CONTAGEM_BITS = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+
+def indice_bit(inicio_periodo: date, data_aula: date, hora_inicio: time) -> int:
+    """Posição do bit de uma aula no bitmap do período"""
+    minutos = hora_inicio.hour * 60 + hora_inicio.minute - HORA_BASE_MINUTOS
+    tempo = min(max(minutos // MINUTOS_TEMPO, 0), TEMPOS_DIA - 1)
+    return (data_aula - inicio_periodo).days * TEMPOS_DIA + tempo
+
+
+def _marcar(bitmap: bytearray, indice: int, valor: bool) -> bytearray:
+    """Liga/desliga um bit, alargando o bitmap a dias completos se necessário"""
+    byte = indice // 8
+    if byte >= len(bitmap):
+        dias = byte // BYTES_DIA + 1
+        bitmap.extend(b'\x00' * (dias * BYTES_DIA - len(bitmap)))
+    if valor:
+        bitmap[byte] |= 1 << (indice % 8)
+    else:
+        bitmap[byte] &= ~(1 << (indice % 8)) & 0xFF
+    return bitmap
+
+
+# ============================================================================
+# PERÍODOS
+# ============================================================================
+
+def periodos_letivos(session: Session, ano_letivo_id: int) -> Dict[int, Tuple[date, date]]:
+    """Trimestres configurados da instituição (ou o ano letivo inteiro como período 0)"""
+    linha = session.execute(
+        select(
+            AnoLetivo.data_inicio, AnoLetivo.data_fim,
+            ConfiguracaoSistema.trimestre1_inicio, ConfiguracaoSistema.trimestre1_fim,
+            ConfiguracaoSistema.trimestre2_inicio, ConfiguracaoSistema.trimestre2_fim,
+            ConfiguracaoSistema.trimestre3_inicio, ConfiguracaoSistema.trimestre3_fim,
+        )
+        .outerjoin(ConfiguracaoSistema, ConfiguracaoSistema.instituicao_id == AnoLetivo.instituicao_id)
+        .where(AnoLetivo.id == ano_letivo_id)
+    ).one()
+    periodos = {
+        n: (linha[2 * n], linha[2 * n + 1])
+        for n in (1, 2, 3)
+        if linha[2 * n] is not None and linha[2 * n + 1] is not None
+    }
+    return periodos or {0: (linha[0], linha[1])}
+
+
+def periodo_da_data(periodos: Dict[int, Tuple[date, date]], data: date) -> Optional[Tuple[int, date]]:
+    """(trimestre, início) do período que contém a data"""
+    for trimestre, (inicio, fim) in periodos.items():
+        if inicio <= data <= fim:
+            return trimestre, inicio
+    return None
+
+
+# ============================================================================
+# MANUTENÇÃO DOS MAPAS
+# ============================================================================
+
+def atualizar_mapas(session: Session, ano_letivo_id: int, data_aula: date, hora_inicio: time,
+                    marcas: Iterable[Tuple[int, bool, bool]],
+                    periodos: Optional[Dict[int, Tuple[date, date]]] = None) -> int:
+    """Actualiza os bits de uma aula para os alunos dados em (aluno_id, presente, justificada).
+
+    Não faz commit: corre na transacção da chamada.
+    """
+    periodos = periodos or periodos_letivos(session, ano_letivo_id)
+    periodo = periodo_da_data(periodos, data_aula)
+    if periodo is None:
+        return 0
+    trimestre, inicio = periodo
+    indice = indice_bit(inicio, data_aula, hora_inicio)
+    marcas = list(marcas)
+
+    existentes = {
+        mapa.aluno_id: mapa
+        for mapa in session.execute(
+            select(MapaFrequencia.id, MapaFrequencia.aluno_id, *[getattr(MapaFrequencia, b) for b in BITMAPS])
+            .where(
+                MapaFrequencia.ano_letivo_id == ano_letivo_id,
+                MapaFrequencia.trimestre == trimestre,
+                MapaFrequencia.aluno_id.in_([m[0] for m in marcas]),
+            )
+            .with_for_update()
+        )
+    }
+
+    novos, alterados = [], []
+    for aluno_id, presente, justificada in marcas:
+        mapa = existentes.get(aluno_id)
+        bitmaps = {b: bytearray(getattr(mapa, b) or b'') if mapa else bytearray() for b in BITMAPS}
+        _marcar(bitmaps['aulas'], indice, True)
+        _marcar(bitmaps['faltas'], indice, not presente)
+        _marcar(bitmaps['justificadas'], indice, (not presente) and justificada)
+        valores = {b: bytes(v) for b, v in bitmaps.items()}
+        if mapa is None:
+            novos.append({'aluno_id': aluno_id, 'ano_letivo_id': ano_letivo_id,
+                          'trimestre': trimestre, 'data_inicio': inicio, **valores})
+        else:
+            alterados.append({'id': mapa.id, **valores})
+
+    if novos:
+        session.execute(insert(MapaFrequencia), novos)
+    if alterados:
+        session.execute(update(MapaFrequencia), alterados)
+    return len(novos) + len(alterados)
+
+
+def reconstruir_mapas(session: Session, ano_letivo_id: int, lote: int = 10000) -> int:
+    """Reconstrói todos os mapas do ano a partir de PresencaAula numa passagem"""
+    periodos = periodos_letivos(session, ano_letivo_id)
+    inicio_ano = min(i for i, _ in periodos.values())
+    fim_ano = max(f for _, f in periodos.values())
+
+    mapas: Dict[Tuple[int, int], Dict[str, bytearray]] = {}
+    presencas = session.execute(
+        select(PresencaAula.aluno_id, PresencaAula.data_aula, HorarioAula.hora_inicio,
+               PresencaAula.presente, PresencaAula.justificada)
+        .join(HorarioAula, HorarioAula.id == PresencaAula.horario_id)
+        .where(PresencaAula.data_aula.between(inicio_ano, fim_ano))
+        .execution_options(yield_per=lote)
+    )
+    for aluno_id, data_aula, hora_inicio, presente, justificada in presencas:
+        periodo = periodo_da_data(periodos, data_aula)
+        if periodo is None:
+            continue
+        trimestre, inicio = periodo
+        indice = indice_bit(inicio, data_aula, hora_inicio)
+        bitmaps = mapas.setdefault((aluno_id, trimestre), {b: bytearray() for b in BITMAPS})
+        _marcar(bitmaps['aulas'], indice, True)
+        _marcar(bitmaps['faltas'], indice, not presente)
+        _marcar(bitmaps['justificadas'], indice, (not presente) and justificada)
+
+    try:
+        session.execute(
+            MapaFrequencia.__table__.delete().where(MapaFrequencia.ano_letivo_id == ano_letivo_id)
+        )
+        linhas = [
+            {'aluno_id': aluno_id, 'ano_letivo_id': ano_letivo_id, 'trimestre': trimestre,
+             'data_inicio': periodos[trimestre][0], **{b: bytes(v) for b, v in bitmaps.items()}}
+            for (aluno_id, trimestre), bitmaps in mapas.items()
+        ]
+        for i in range(0, len(linhas), lote):
+            session.execute(insert(MapaFrequencia), linhas[i:i + lote])
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    return len(mapas)
+
+
+# ============================================================================
+# ANÁLISE VECTORIZADA
+# ============================================================================
+
+def _matriz(bitmaps: List[bytes], largura: int) -> np.ndarray:
+    """Empilha bitmaps de tamanhos diferentes numa matriz uint8 (n x largura)"""
+    matriz = np.zeros((len(bitmaps), largura), dtype=np.uint8)
+    for i, bitmap in enumerate(bitmaps):
+        if bitmap:
+            matriz[i, :len(bitmap)] = np.frombuffer(bitmap, dtype=np.uint8)
+    return matriz
+
+
+def _maior_sequencia(matriz: np.ndarray, considerar: Optional[np.ndarray] = None) -> np.ndarray:
+    """Maior sequência de True consecutivos em cada linha.
+
+    Com `considerar`, as colunas a False são saltadas: não contam nem
+    interrompem a sequência.
+    """
+    if matriz.size == 0:
+        return np.zeros(matriz.shape[0], dtype=np.int64)
+    if considerar is not None:
+        matriz = matriz & considerar
+        quebras = considerar & ~matriz
+    else:
+        quebras = ~matriz
+    # True acumulados; em cada quebra a contagem recomeça a partir desse valor
+    contagem = np.cumsum(matriz, axis=1, dtype=np.int64)
+    base = np.where(quebras, contagem, 0)
+    np.maximum.accumulate(base, axis=1, out=base)
+    return (contagem - base).max(axis=1)
+
+
+def analisar_frequencia(session: Session, ano_letivo_id: int, trimestre: int) -> pd.DataFrame:
+    """Frequência, faltas e maior sequência de dias com falta de todos os alunos do período"""
+    linhas = session.execute(
+        select(MapaFrequencia.aluno_id, *[getattr(MapaFrequencia, b) for b in BITMAPS])
+        .where(MapaFrequencia.ano_letivo_id == ano_letivo_id, MapaFrequencia.trimestre == trimestre)
+    ).all()
+    colunas = ['aulas', 'faltas', 'faltas_justificadas', 'frequencia_percentual', 'maior_sequencia_dias']
+    if not linhas:
+        return pd.DataFrame(columns=colunas)
+
+    largura = max(len(bitmap or b'') for linha in linhas for bitmap in linha[1:])
+    largura += -largura % BYTES_DIA
+    aulas, faltas, justificadas = (_matriz([linha[n] for linha in linhas], largura) for n in (1, 2, 3))
+
+    total_aulas = CONTAGEM_BITS[aulas].sum(axis=1)
+    total_faltas = CONTAGEM_BITS[faltas].sum(axis=1)
+    total_justificadas = CONTAGEM_BITS[justificadas].sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        frequencia = np.where(total_aulas > 0, 100.0 * (1 - total_faltas / total_aulas), 100.0)
+
+    # Fins de semana e feriados (dias sem aulas) não interrompem a sequência
+    dias_com_aula = aulas.reshape(len(linhas), -1, BYTES_DIA).any(axis=2)
+    dias_com_falta = faltas.reshape(len(linhas), -1, BYTES_DIA).any(axis=2)
+
+    return pd.DataFrame({
+        'aulas': total_aulas,
+        'faltas': total_faltas,
+        'faltas_justificadas': total_justificadas,
+        'frequencia_percentual': frequencia.round(2),
+        'maior_sequencia_dias': _maior_sequencia(dias_com_falta, dias_com_aula),
+    }, index=pd.Index([linha[0] for linha in linhas], name='aluno_id'))
+
+
+def ranking_absentismo(session: Session, ano_letivo_id: int, trimestre: int,
+                       frequencia_minima: Optional[float] = None, limite: int = 50) -> pd.DataFrame:
+    """Alunos com mais faltas (opcionalmente só os abaixo da frequência mínima)"""
+    analise = analisar_frequencia(session, ano_letivo_id, trimestre)
+    if frequencia_minima is not None:
+        analise = analise[analise['frequencia_percentual'] < frequencia_minima]
+    return analise.sort_values(['faltas', 'maior_sequencia_dias'], ascending=False).head(limite)
@@ -0,0 +1,406 @@
+"""
+Gerador automático de horários.
+
+Constrói o horário semanal de todas as turmas de um ano letivo a partir de:
+  - `DisciplinaClasse.aulas_semanais` (aulas a colocar por turma);
+  - `ProfessorDisciplina` (professores habilitados, com `preferencia`);
+  - `Sala` (capacidade e tipo: laboratório para `Disciplina.tem_laboratorio`);
+  - `Turma.turno` (grelha de tempos disponível).
+
+A pesquisa é heurística (colocação gulosa por ordem de dificuldade, com
+aleatoriedade) repetida com reinícios até esgotar o tempo; os reinícios
+correm em paralelo em vários processos e fica a melhor solução. O resultado
+é validado com `IndiceHorarios` e gravado em lote.
+"""
+
+import math
+import os
+import random
+import time as relogio
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import time
+from typing import Dict, List, Optional, Any
+
+from sqlalchemy import select, func, update, insert
+from sqlalchemy.orm import Session
+
+from .academico import AnoLetivo, Turma, Disciplina, DisciplinaClasse, Sala, HorarioAula
+from ..instituicao.instituicao import Campus
+from .alunomodels import Matricula
+from .horarios import IndiceHorarios, Intervalo
+from ..pedagogico.pedagogico import ProfessorDisciplina
+from ..recursoshumanos.recursoshumanos import Professor
+from ..enums import Turno
+
+
+DIAS_LETIVOS = (1, 2, 3, 4, 5)  # Segunda a Sexta
+DURACAO_AULA_MINUTOS = 45
+DURACAO_INTERVALO_MINUTOS = 15
+
+# Grelha por turno: (hora de início, número de tempos, tempo após o qual há intervalo)
+GRELHA_TURNOS = {
+    Turno.MANHA: (time(7, 0), 6, 3),
+    Turno.TARDE: (time(13, 0), 6, 3),
+    Turno.NOITE: (time(18, 45), 4, 2),
+}
+
+TIPOS_LABORATORIO = ('laboratorio', 'informatica')
+TIPOS_SALA_AULA = ('aula',)
+
+# Pesos da pontuação (menor é melhor)
+PESO_NAO_ALOCADA = 1000
+PESO_SEM_PREFERENCIA = 3
+PESO_REPETIDA_DIA = 2
+PESO_JANELA_PROFESSOR = 1
+
+
+def _grelha(inicio: time, tempos: int, intervalo_apos: int) -> List[tuple]:
+    """Tempos de um turno em minutos desde a meia-noite"""
+    atual = inicio.hour * 60 + inicio.minute
+    tempos_turno = []
+    for n in range(tempos):
+        tempos_turno.append((atual, atual + DURACAO_AULA_MINUTOS))
+        atual += DURACAO_AULA_MINUTOS
+        if n + 1 == intervalo_apos:
+            atual += DURACAO_INTERVALO_MINUTOS
+    return tempos_turno
+
+
+# ============================================================================
+# CARREGAMENTO DO PROBLEMA
+# ============================================================================
+
+def carregar_problema(session: Session, ano_letivo_id: int,
+                      turma_ids: Optional[List[int]] = None) -> Dict[str, Any]:
+    """Lê os dados necessários e monta o problema (estrutura simples, serializável)"""
+    tempos, tempos_turno = [], {}
+    for turno, (inicio, quantidade, intervalo_apos) in GRELHA_TURNOS.items():
+        indices = []
+        for tempo in _grelha(inicio, quantidade, intervalo_apos):
+            indices.append(len(tempos))
+            tempos.append(tempo)
+        tempos_turno[turno] = indices
+    tempos_turno[Turno.INTEGRAL] = tempos_turno[Turno.MANHA] + tempos_turno[Turno.TARDE]
+
+    # Professores e salas vêm só da escola do ano letivo (explícito, sem depender do escopo da sessão)
+    instituicao_id = session.scalar(select(AnoLetivo.instituicao_id).where(AnoLetivo.id == ano_letivo_id))
+    if instituicao_id is None:
+        raise ValueError("Ano letivo não encontrado")
+
+    consulta_turmas = (
+        select(Turma.id, Turma.classe_id, Turma.turno, Turma.sala_id, func.count(Matricula.id))
+        .outerjoin(Matricula, (Matricula.turma_id == Turma.id) & (Matricula.ativa == True))
+        .where(Turma.ano_letivo_id == ano_letivo_id, Turma.ativa == True)
+        .group_by(Turma.id, Turma.classe_id, Turma.turno, Turma.sala_id)
+    )
+    if turma_ids is not None:
+        consulta_turmas = consulta_turmas.where(Turma.id.in_(turma_ids))
+    turmas = {
+        turma_id: {'classe_id': classe_id, 'tempos': tempos_turno[turno], 'sala_id': sala_id, 'alunos': alunos}
+        for turma_id, classe_id, turno, sala_id, alunos in session.execute(consulta_turmas)
+    }
+
+    curriculo = defaultdict(list)
+    for classe_id, disciplina_id, aulas, laboratorio in session.execute(
+        select(DisciplinaClasse.classe_id, DisciplinaClasse.disciplina_id,
+               DisciplinaClasse.aulas_semanais, Disciplina.tem_laboratorio)
+        .join(Disciplina, Disciplina.id == DisciplinaClasse.disciplina_id)
+        .where(DisciplinaClasse.classe_id.in_({t['classe_id'] for t in turmas.values()}),
+               Disciplina.ativa == True)
+    ):
+        curriculo[classe_id].append((disciplina_id, aulas, bool(laboratorio)))
+
+    tarefas = [
+        (turma_id, disciplina_id, aulas, laboratorio)
+        for turma_id, turma in turmas.items()
+        for disciplina_id, aulas, laboratorio in curriculo[turma['classe_id']]
+        if aulas > 0
+    ]
+
+    qualificados = defaultdict(list)
+    carga_maxima = {}
+    for professor_id, disciplina_id, preferencia, carga in session.execute(
+        select(ProfessorDisciplina.professor_id, ProfessorDisciplina.disciplina_id,
+               ProfessorDisciplina.preferencia, Professor.carga_horaria_semanal)
+        .join(Professor, Professor.id == ProfessorDisciplina.professor_id)
+        .where(ProfessorDisciplina.ativo == True, Professor.ativo == True,
+               Professor.instituicao_id == instituicao_id)
+    ):
+        qualificados[disciplina_id].append((professor_id, bool(preferencia)))
+        # carga_horaria_semanal está em horas; o limite conta tempos de aula
+        carga_maxima[professor_id] = carga * 60 // DURACAO_AULA_MINUTOS if carga else carga
+
+    salas = session.execute(
+        select(Sala.id, Sala.tipo, Sala.capacidade)
+        .join(Campus, Campus.id == Sala.campus_id)
+        .where(Sala.disponivel == True, Campus.instituicao_id == instituicao_id)
+    ).all()
+
+    # Aulas de turmas fora do problema continuam a ocupar professores e salas
+    ocupados = []
+    if turma_ids is not None:
+        for professor_id, sala_id, dia, inicio, fim in session.execute(
+            select(HorarioAula.professor_id, HorarioAula.sala_id, HorarioAula.dia_semana,
+                   HorarioAula.hora_inicio, HorarioAula.hora_fim)
+            .join(Turma, Turma.id == HorarioAula.turma_id)
+            .where(HorarioAula.ativo == True, HorarioAula.data_especifica == None,
+                   Turma.ano_letivo_id == ano_letivo_id, Turma.id.notin_(turma_ids))
+        ):
+            inicio_min, fim_min = inicio.hour * 60 + inicio.minute, fim.hour * 60 + fim.minute
+            for indice, (t_inicio, t_fim) in enumerate(tempos):
+                if t_inicio < fim_min and inicio_min < t_fim:
+                    ocupados.append((professor_id, sala_id, dia, indice))
+
+    return {
+        'tempos': tempos,
+        'dias': DIAS_LETIVOS,
+        'turmas': turmas,
+        'tarefas': tarefas,
+        'qualificados': dict(qualificados),
+        'carga_maxima': carga_maxima,
+        'salas_laboratorio': [(s.id, s.capacidade) for s in salas if s.tipo in TIPOS_LABORATORIO],
+        'salas_aula': [(s.id, s.capacidade) for s in salas if s.tipo in TIPOS_SALA_AULA],
+        'ocupados': ocupados,
+    }
+
+
+# ============================================================================
+# PESQUISA HEURÍSTICA
+# ============================================================================
+
+class _Estado:
+    """Ocupação de turmas, professores e salas durante uma tentativa"""
+
+    def __init__(self, problema):
+        self.turma = set()
+        self.professor = set()
+        self.sala = set()
+        self.carga = defaultdict(int)
+        for professor_id, sala_id, dia, tempo in problema['ocupados']:
+            self.professor.add((professor_id, dia, tempo))
+            self.carga[professor_id] += 1
+            if sala_id is not None:
+                self.sala.add((sala_id, dia, tempo))
+
+
+def _salas_candidatas(problema, turma, laboratorio):
+    if laboratorio:
+        return [s for s, capacidade in problema['salas_laboratorio'] if capacidade >= turma['alunos']]
+    if turma['sala_id'] is not None:
+        return [turma['sala_id']]
+    return [s for s, capacidade in problema['salas_aula'] if capacidade >= turma['alunos']]
+
+
+def _colocar(problema, estado, rng, turma_id, disciplina_id, aulas, laboratorio, professor_id):
+    """Tenta colocar as aulas de uma disciplina com um professor. Retorna as aulas colocadas."""
+    turma = problema['turmas'][turma_id]
+    salas = _salas_candidatas(problema, turma, laboratorio)
+    if not salas:
+        return []
+    maximo_dia = math.ceil(aulas / len(problema['dias']))
+    posicoes = [(dia, tempo) for dia in problema['dias'] for tempo in turma['tempos']]
+    rng.shuffle(posicoes)
+
+    colocadas, por_dia = [], defaultdict(int)
+    for limite in (maximo_dia, aulas):
+        for dia, tempo in posicoes:
+            if len(colocadas) == aulas:
+                break
+            if por_dia[dia] >= limite:
+                continue
+            if (turma_id, dia, tempo) in estado.turma or (professor_id, dia, tempo) in estado.professor:
+                continue
+            sala_id = next((s for s in salas if (s, dia, tempo) not in estado.sala), None)
+            if sala_id is None:
+                continue
+            estado.turma.add((turma_id, dia, tempo))
+            estado.professor.add((professor_id, dia, tempo))
+            estado.sala.add((sala_id, dia, tempo))
+            estado.carga[professor_id] += 1
+            por_dia[dia] += 1
+            colocadas.append((turma_id, disciplina_id, professor_id, sala_id, dia, tempo))
+    return colocadas
+
+
+def _desfazer(estado, colocadas):
+    for turma_id, _, professor_id, sala_id, dia, tempo in colocadas:
+        estado.turma.discard((turma_id, dia, tempo))
+        estado.professor.discard((professor_id, dia, tempo))
+        estado.sala.discard((sala_id, dia, tempo))
+        estado.carga[professor_id] -= 1
+
+
+def _tentativa(problema, rng) -> Dict[str, Any]:
+    """Uma construção gulosa completa"""
+    estado = _Estado(problema)
+    qualificados = problema['qualificados']
+
+    # Mais difíceis primeiro: laboratório, poucos professores, muitas aulas
+    tarefas = sorted(
+        problema['tarefas'],
+        key=lambda t: (not t[3], len(qualificados.get(t[1], ())), -t[2], rng.random())
+    )
+
+    aulas, nao_alocadas, sem_preferencia = [], [], 0
+    for turma_id, disciplina_id, quantidade, laboratorio in tarefas:
+        candidatos = list(qualificados.get(disciplina_id, ()))
+        rng.shuffle(candidatos)
+        candidatos.sort(key=lambda c: (not c[1], estado.carga[c[0]]))
+
+        melhor, melhor_preferido = [], False
+        for professor_id, preferido in candidatos:
+            carga_maxima = problema['carga_maxima'].get(professor_id)
+            if carga_maxima and estado.carga[professor_id] + quantidade > carga_maxima:
+                continue
+            colocadas = _colocar(problema, estado, rng, turma_id, disciplina_id,
+                                 quantidade, laboratorio, professor_id)
+            if len(colocadas) > len(melhor):
+                _desfazer(estado, melhor)
+                melhor, melhor_preferido = colocadas, preferido
+            else:
+                _desfazer(estado, colocadas)
+            if len(melhor) == quantidade:
+                break
+
+        aulas.extend(melhor)
+        if melhor and not melhor_preferido:
+            sem_preferencia += 1
+        if len(melhor) < quantidade:
+            nao_alocadas.append((turma_id, disciplina_id, quantidade - len(melhor)))
+
+    return _avaliar(problema, aulas, nao_alocadas, sem_preferencia)
+
+
+def _avaliar(problema, aulas, nao_alocadas, sem_preferencia) -> Dict[str, Any]:
+    """Métricas de qualidade e pontuação de uma solução"""
+    repetidas = defaultdict(int)
+    tempos_professor = defaultdict(list)
+    for turma_id, disciplina_id, professor_id, _, dia, tempo in aulas:
+        repetidas[(turma_id, disciplina_id, dia)] += 1
+        tempos_professor[(professor_id, dia)].append(tempo)
+
+    repetidas_dia = sum(n - 1 for n in repetidas.values() if n > 1)
+    janelas = sum(max(t) - min(t) + 1 - len(t) for t in tempos_professor.values())
+    total_nao_alocadas = sum(n for _, _, n in nao_alocadas)
+
+    metricas = {
+        'aulas_colocadas': len(aulas),
+        'aulas_nao_alocadas': total_nao_alocadas,
+        'disciplinas_sem_professor_preferido': sem_preferencia,
+        'repeticoes_mesmo_dia': repetidas_dia,
+        'janelas_professores': janelas,
+    }
+    pontuacao = (
+        PESO_NAO_ALOCADA * total_nao_alocadas
+        + PESO_SEM_PREFERENCIA * sem_preferencia
+        + PESO_REPETIDA_DIA * repetidas_dia
+        + PESO_JANELA_PROFESSOR * janelas
+    )
+    return {'aulas': aulas, 'nao_alocadas': nao_alocadas, 'metricas': metricas, 'pontuacao': pontuacao}
+
+
+def _procurar(problema, semente: int, segundos: float) -> Dict[str, Any]:
+    """Reinícios sucessivos até esgotar o tempo (executado em cada processo)"""
+    rng = random.Random(semente)
+    prazo = relogio.monotonic() + segundos
+    melhor, tentativas = None, 0
+    while True:
+        solucao = _tentativa(problema, rng)
+        tentativas += 1
+        if melhor is None or solucao['pontuacao'] < melhor['pontuacao']:
+            melhor = solucao
+        if melhor['pontuacao'] == 0 or relogio.monotonic() >= prazo:
+            break
+    melhor['tentativas'] = tentativas
+    return melhor
+
+
+def resolver(problema, segundos: float = 60.0, processos: Optional[int] = None,
+             semente: Optional[int] = None) -> Dict[str, Any]:
+    """Procura o melhor horário dentro do tempo dado, em paralelo"""
+    processos = processos or os.cpu_count() or 1
+    base = semente if semente is not None else random.randrange(1 << 30)
+    inicio = relogio.monotonic()
+
+    if processos == 1:
+        resultados = [_procurar(problema, base, segundos)]
+    else:
+        with ProcessPoolExecutor(max_workers=processos) as executor:
+            futuros = [executor.submit(_procurar, problema, base + n, segundos) for n in range(processos)]
+            resultados = [f.result() for f in futuros]
+
+    melhor = min(resultados, key=lambda r: r['pontuacao'])
+    melhor['metricas']['tentativas'] = sum(r['tentativas'] for r in resultados)
+    melhor['metricas']['processos'] = processos
+    melhor['metricas']['segundos'] = round(relogio.monotonic() - inicio, 2)
+    return melhor
+
+
+# ============================================================================
+# GRAVAÇÃO
+# ============================================================================
+
+def validar_solucao(problema, solucao) -> list:
+    """Confirma com o índice de horários que a solução não tem choques"""
+    indice = IndiceHorarios()
+    tempos = problema['tempos']
+    indice.construir(
+        Intervalo(tempos[t][0], tempos[t][1], -(n + 1), turma_id, disciplina_id, professor_id, sala_id, dia)
+        for n, (turma_id, disciplina_id, professor_id, sala_id, dia, t) in enumerate(solucao['aulas'])
+    )
+    return indice.conflitos_existentes()
+
+
+def gravar_horario(session: Session, problema, solucao):
+    """Desactiva os horários semanais anteriores das turmas e insere os novos em lote"""
+    conflitos = validar_solucao(problema, solucao)
+    if conflitos:
+        raise ValueError(f"Solução inválida: {len(conflitos)} choques de horário")
+
+    def hora(minutos):
+        return time(minutos // 60, minutos % 60)
+
+    tempos = problema['tempos']
+    linhas = [
+        {
+            'turma_id': turma_id,
+            'disciplina_id': disciplina_id,
+            'professor_id': professor_id,
+            'sala_id': sala_id,
+            'dia_semana': dia,
+            'hora_inicio': hora(tempos[t][0]),
+            'hora_fim': hora(tempos[t][1]),
+            'recorrencia': 'semanal',
+            'ativo': True,
+        }
+        for turma_id, disciplina_id, professor_id, sala_id, dia, t in solucao['aulas']
+    ]
+    try:
+        # Desactivar (e não apagar) preserva as presenças já registadas
+        session.execute(
+            update(HorarioAula)
+            .where(HorarioAula.turma_id.in_(list(problema['turmas'])),
+                   HorarioAula.data_especifica == None)
+            .values(ativo=False)
+        )
+        if linhas:
+            session.execute(insert(HorarioAula), linhas)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    return len(linhas)
+
+
+def gerar_horarios(session: Session, ano_letivo_id: int, turma_ids: Optional[List[int]] = None,
+                   segundos: float = 60.0, processos: Optional[int] = None,
+                   gravar: bool = True) -> Dict[str, Any]:
+    """Carrega, resolve e (opcionalmente) grava o horário. Retorna as métricas de qualidade."""
+    problema = carregar_problema(session, ano_letivo_id, turma_ids)
+    solucao = resolver(problema, segundos, processos)
+    metricas = dict(solucao['metricas'])
+    metricas['nao_alocadas'] = solucao['nao_alocadas']
+    if gravar:
+        metricas['gravadas'] = gravar_horario(session, problema, solucao)
+    return metricas
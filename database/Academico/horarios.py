@@ -0,0 +1,186 @@
+"""
+Detecção de conflitos de horário.
+
+`IndiceHorarios` carrega numa única consulta todas as aulas semanais activas
+e mantém, por (professor, dia), (sala, dia) e (turma, dia), a lista de
+intervalos ordenada por hora de início. Validar o horário proposto para uma
+turma custa O(n log n): ordenação das propostas para detectar choques entre
+si e pesquisa binária no índice para os choques com as outras turmas.
+"""
+
+from bisect import bisect_left
+from collections import defaultdict, namedtuple
+from datetime import time
+from typing import List, Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .academico import HorarioAula, Turma, RESTRICOES_EXCLUSAO_HORARIO
+
+
+# Aula (existente ou proposta) em minutos desde a meia-noite
+Intervalo = namedtuple('Intervalo', 'inicio fim horario_id turma_id disciplina_id professor_id sala_id dia_semana')
+
+# Choque entre duas aulas que partilham um recurso
+Conflito = namedtuple('Conflito', 'recurso recurso_id dia_semana aula conflitante')
+
+RECURSOS = ('professor', 'sala', 'turma')
+
+
+def _minutos(hora: time) -> int:
+    return hora.hour * 60 + hora.minute
+
+
+def _intervalo(aula) -> Intervalo:
+    """Converte um HorarioAula, linha ou dicionário proposto num Intervalo"""
+    obter = aula.get if isinstance(aula, dict) else lambda campo, padrao=None: getattr(aula, campo, padrao)
+    return Intervalo(
+        inicio=_minutos(obter('hora_inicio')),
+        fim=_minutos(obter('hora_fim')),
+        horario_id=obter('id'),
+        turma_id=obter('turma_id'),
+        disciplina_id=obter('disciplina_id'),
+        professor_id=obter('professor_id'),
+        sala_id=obter('sala_id'),
+        dia_semana=obter('dia_semana'),
+    )
+
+
+def _ordem(intervalo: Intervalo) -> Tuple[int, int]:
+    return intervalo.inicio, intervalo.fim
+
+
+def _chaves(intervalo: Intervalo) -> Iterable[Tuple[str, int, int]]:
+    """Recursos ocupados por uma aula"""
+    for recurso in RECURSOS:
+        recurso_id = getattr(intervalo, f'{recurso}_id')
+        if recurso_id is not None:
+            yield recurso, recurso_id, intervalo.dia_semana
+
+
+# ============================================================================
+# ÍNDICE DE INTERVALOS
+# ============================================================================
+
+class IndiceHorarios:
+    """Índice em memória das aulas semanais por recurso e dia"""
+
+    def __init__(self):
+        # chave -> (inícios ordenados, intervalos, máximo acumulado dos fins)
+        self._listas: Dict[Tuple[str, int, int], Tuple[List[int], List[Intervalo], List[int]]] = {}
+
+    @classmethod
+    def carregar(cls, session: Session, ano_letivo_id: Optional[int] = None) -> 'IndiceHorarios':
+        """Constrói o índice com uma única consulta"""
+        consulta = select(
+            HorarioAula.id, HorarioAula.turma_id, HorarioAula.disciplina_id,
+            HorarioAula.professor_id, HorarioAula.sala_id, HorarioAula.dia_semana,
+            HorarioAula.hora_inicio, HorarioAula.hora_fim,
+        ).where(HorarioAula.ativo == True, HorarioAula.data_especifica == None)
+        if ano_letivo_id is not None:
+            consulta = consulta.join(Turma, Turma.id == HorarioAula.turma_id).where(
+                Turma.ano_letivo_id == ano_letivo_id
+            )
+
+        indice = cls()
+        indice.construir(_intervalo(linha) for linha in session.execute(consulta).mappings())
+        return indice
+
+    def construir(self, intervalos: Iterable[Intervalo]):
+        """(Re)constrói as listas ordenadas a partir dos intervalos"""
+        grupos = defaultdict(list)
+        for intervalo in intervalos:
+            for chave in _chaves(intervalo):
+                grupos[chave].append(intervalo)
+
+        self._listas = {}
+        for chave, lista in grupos.items():
+            lista.sort(key=_ordem)
+            fins_max, maior = [], -1
+            for intervalo in lista:
+                maior = max(maior, intervalo.fim)
+                fins_max.append(maior)
+            self._listas[chave] = ([i.inicio for i in lista], lista, fins_max)
+
+    def sobrepostos(self, chave: Tuple[str, int, int], inicio: int, fim: int) -> List[Intervalo]:
+        """Aulas do recurso que se sobrepõem a [inicio, fim)"""
+        if chave not in self._listas:
+            return []
+        inicios, lista, fins_max = self._listas[chave]
+        resultado = []
+        j = bisect_left(inicios, fim) - 1
+        while j >= 0 and fins_max[j] > inicio:
+            if lista[j].fim > inicio:
+                resultado.append(lista[j])
+            j -= 1
+        return resultado
+
+    # ========================================================================
+    # VALIDAÇÃO
+    # ========================================================================
+
+    def validar_turma(self, turma_id: int, propostas: Iterable) -> List[Conflito]:
+        """Valida o horário completo proposto para uma turma.
+
+        As aulas actuais da própria turma são ignoradas (o horário proposto
+        substitui-as). Retorna todos os choques: entre propostas e com as
+        aulas das outras turmas.
+        """
+        aulas = []
+        for n, proposta in enumerate(propostas):
+            aula = _intervalo(proposta)
+            # Propostas ainda não gravadas recebem um identificador negativo
+            aulas.append(aula._replace(turma_id=turma_id, horario_id=aula.horario_id or -(n + 1)))
+        conflitos = []
+
+        for aula in aulas:
+            if aula.fim <= aula.inicio:
+                conflitos.append(Conflito('horario', None, aula.dia_semana, aula, None))
+
+        # Choques entre as propostas: varrimento por recurso após ordenação
+        grupos = defaultdict(list)
+        for aula in aulas:
+            for chave in _chaves(aula):
+                grupos[chave].append(aula)
+        for (recurso, recurso_id, dia), lista in grupos.items():
+            lista.sort(key=_ordem)
+            ativas = []
+            for aula in lista:
+                ativas = [a for a in ativas if a.fim > aula.inicio]
+                for anterior in ativas:
+                    conflitos.append(Conflito(recurso, recurso_id, dia, aula, anterior))
+                ativas.append(aula)
+
+        # Choques com as outras turmas
+        for aula in aulas:
+            for chave in _chaves(aula):
+                if chave[0] == 'turma':
+                    continue
+                for existente in self.sobrepostos(chave, aula.inicio, aula.fim):
+                    if existente.turma_id != turma_id:
+                        conflitos.append(Conflito(chave[0], chave[1], chave[2], aula, existente))
+
+        return conflitos
+
+    def conflitos_existentes(self) -> List[Conflito]:
+        """Lista os choques já gravados na base de dados"""
+        conflitos = []
+        for (recurso, recurso_id, dia), (_, lista, _) in self._listas.items():
+            ativas = []
+            for aula in lista:
+                ativas = [a for a in ativas if a.fim > aula.inicio]
+                for anterior in ativas:
+                    conflitos.append(Conflito(recurso, recurso_id, dia, aula, anterior))
+                ativas.append(aula)
+        return conflitos
+
+
+def aplicar_restricoes_exclusao(engine):
+    """Adiciona as restrições de exclusão a uma base PostgreSQL já existente"""
+    if engine.dialect.name != 'postgresql':
+        return False
+    with engine.begin() as conexao:
+        for ddl in RESTRICOES_EXCLUSAO_HORARIO:
+            conexao.execute(ddl)
+    return True
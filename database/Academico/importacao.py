@@ -0,0 +1,380 @@
+"""
+Importação em lote de novas matrículas.
+
+Lê listas de inscrição em CSV ou XLSX por blocos (sem carregar o ficheiro
+inteiro), valida cada bloco de forma vectorizada com pandas e procura numa
+única consulta as pessoas já registadas (`Pessoa.numero_documento`), que são
+reutilizadas. As linhas válidas são gravadas por ordem de dependência com
+INSERTs em lote:
+
+    Pessoa -> Aluno -> Matricula -> TelefonePessoa -> EncarregadoEducacao
+
+Cada bloco é uma transacção. O resultado inclui um relatório de erros por
+linha do ficheiro.
+
+Colunas reconhecidas (cabeçalho, sem distinção de maiúsculas):
+    nome_completo, data_nascimento, genero, numero_documento, tipo_documento,
+    nacionalidade, email, telefone, codigo_aluno, turma,
+    encarregado_nome, encarregado_documento, encarregado_data_nascimento,
+    encarregado_genero, encarregado_parentesco, encarregado_telefone
+"""
+
+import os
+from datetime import date, datetime
+from typing import Dict, List, Iterator, Optional, Any
+
+import pandas as pd
+from sqlalchemy import select, insert, update, bindparam, tuple_
+from sqlalchemy.orm import Session
+
+from .academico import AnoLetivo, Turma
+from .alunomodels import Aluno, Matricula, EncarregadoEducacao
+from ..recursoshumanos.recursoshumanos import Pessoa, TelefonePessoa
+from ..instituicao.licencas import ServicoLicencas
+from ..enums import Genero, TipoDocumento, TipoParentesco, TipoTelefone, StatusAluno
+
+
+TAMANHO_BLOCO = 5000
+
+OBRIGATORIAS = ['nome_completo', 'data_nascimento', 'genero', 'numero_documento', 'turma']
+
+GENEROS = {
+    'm': Genero.MASCULINO, 'masculino': Genero.MASCULINO,
+    'f': Genero.FEMININO, 'feminino': Genero.FEMININO,
+    'outro': Genero.OUTRO,
+}
+
+TIPOS_DOCUMENTO = {t.value: t for t in TipoDocumento} | {'': TipoDocumento.BILHETE_IDENTIDADE}
+
+PARENTESCOS = {p.value: p for p in TipoParentesco} | {'mãe': TipoParentesco.MAE, 'avó': TipoParentesco.AVO,
+                                                      'irmão': TipoParentesco.IRMAO, 'irmã': TipoParentesco.IRMA}
+
+# Género deduzido do parentesco quando a coluna não vem preenchida
+GENERO_PARENTESCO = {
+    TipoParentesco.PAI: Genero.MASCULINO, TipoParentesco.TIO: Genero.MASCULINO,
+    TipoParentesco.IRMAO: Genero.MASCULINO, TipoParentesco.MAE: Genero.FEMININO,
+    TipoParentesco.TIA: Genero.FEMININO, TipoParentesco.IRMA: Genero.FEMININO,
+}
+
+
+# ============================================================================
+# LEITURA
+# ============================================================================
+
+def ler_blocos(caminho: str, tamanho: int = TAMANHO_BLOCO) -> Iterator[pd.DataFrame]:
+    """Lê CSV ou XLSX em blocos de `tamanho` linhas, tudo como texto.
+
+    O índice de cada bloco é o número da linha no ficheiro (o cabeçalho é a 1).
+    """
+    extensao = os.path.splitext(caminho)[1].lower()
+    if extensao in ('.xlsx', '.xlsm'):
+        from openpyxl import load_workbook
+
+        livro = load_workbook(caminho, read_only=True, data_only=True)
+        try:
+            linhas = livro.active.iter_rows(values_only=True)
+            cabecalho = [str(c or '').strip().lower() for c in next(linhas)]
+            bloco, primeira = [], 2
+            for linha in linhas:
+                bloco.append(['' if v is None else (v.strftime('%Y-%m-%d') if isinstance(v, (date, datetime)) else str(v))
+                              for v in linha])
+                if len(bloco) >= tamanho:
+                    yield pd.DataFrame(bloco, columns=cabecalho, index=range(primeira, primeira + len(bloco)))
+                    primeira += len(bloco)
+                    bloco = []
+            if bloco:
+                yield pd.DataFrame(bloco, columns=cabecalho, index=range(primeira, primeira + len(bloco)))
+        finally:
+            livro.close()
+    elif extensao in ('.csv', '.txt'):
+        primeira = 2
+        for bloco in pd.read_csv(caminho, dtype=str, keep_default_na=False, chunksize=tamanho,
+                                 sep=None, engine='python', encoding='utf-8-sig'):
+            bloco.columns = [str(c).strip().lower() for c in bloco.columns]
+            bloco.index = range(primeira, primeira + len(bloco))
+            primeira += len(bloco)
+            yield bloco
+    else:
+        raise ValueError(f"Formato de ficheiro não suportado: {extensao}")
+
+
+# ============================================================================
+# VALIDAÇÃO VECTORIZADA
+# ============================================================================
+
+def _telefone(serie: pd.Series) -> pd.Series:
+    return serie.str.replace(r'[^\d+]', '', regex=True)
+
+
+def validar_bloco(bloco: pd.DataFrame, turmas: Dict[str, int]) -> pd.DataFrame:
+    """Normaliza o bloco e acrescenta a coluna `erros` (lista por linha)"""
+    df = bloco.copy()
+    for coluna in OBRIGATORIAS + [
+        'tipo_documento', 'nacionalidade', 'email', 'telefone', 'codigo_aluno',
+        'encarregado_nome', 'encarregado_documento', 'encarregado_data_nascimento',
+        'encarregado_genero', 'encarregado_parentesco', 'encarregado_telefone',
+    ]:
+        df[coluna] = df[coluna].fillna('').astype(str).str.strip() if coluna in df else ''
+
+    erros = pd.DataFrame(index=df.index)
+    for coluna in OBRIGATORIAS:
+        erros[f'{coluna} em falta'] = df[coluna] == ''
+
+    df['numero_documento'] = df['numero_documento'].str.upper().str.replace(r'\s+', '', regex=True)
+    df['data_nascimento'] = pd.to_datetime(df['data_nascimento'], errors='coerce', dayfirst=True).dt.date
+    erros['data_nascimento inválida'] = df['data_nascimento'].isna() & ~erros['data_nascimento em falta']
+    df['genero'] = df['genero'].str.lower().map(GENEROS)
+    erros['género inválido'] = df['genero'].isna() & ~erros['genero em falta']
+    df['tipo_documento'] = df['tipo_documento'].str.lower().map(TIPOS_DOCUMENTO)
+    erros['tipo de documento inválido'] = df['tipo_documento'].isna()
+    df['turma_id'] = df['turma'].str.upper().map(turmas)
+    erros['turma inexistente'] = df['turma_id'].isna() & ~erros['turma em falta']
+    erros['documento repetido no ficheiro'] = (
+        df['numero_documento'].duplicated(keep='first') & (df['numero_documento'] != '')
+    )
+
+    df['telefone'] = _telefone(df['telefone'])
+    df['encarregado_telefone'] = _telefone(df['encarregado_telefone'])
+    for coluna in ('telefone', 'encarregado_telefone'):
+        tamanho = df[coluna].str.len()
+        erros[f'{coluna} inválido'] = (tamanho > 0) & ((tamanho < 9) | (tamanho > 20))
+
+    # Encarregado (opcional, mas completo quando indicado)
+    tem_encarregado = (df['encarregado_documento'] != '') | (df['encarregado_nome'] != '')
+    df['encarregado_documento'] = df['encarregado_documento'].str.upper().str.replace(r'\s+', '', regex=True)
+    df['encarregado_parentesco'] = df['encarregado_parentesco'].str.lower().map(PARENTESCOS)
+    df['encarregado_genero'] = df['encarregado_genero'].str.lower().map(GENEROS).fillna(
+        df['encarregado_parentesco'].map(GENERO_PARENTESCO)
+    )
+    df['encarregado_data_nascimento'] = pd.to_datetime(
+        df['encarregado_data_nascimento'], errors='coerce', dayfirst=True
+    ).dt.date
+    erros['documento do encarregado em falta'] = tem_encarregado & (df['encarregado_documento'] == '')
+    erros['parentesco do encarregado inválido'] = tem_encarregado & df['encarregado_parentesco'].isna()
+    erros['encarregado igual ao aluno'] = tem_encarregado & (df['encarregado_documento'] == df['numero_documento'])
+    df['tem_encarregado'] = tem_encarregado
+
+    # As mensagens só são montadas para as linhas com falhas
+    df['erros'] = pd.Series([[] for _ in range(len(df))], index=df.index, dtype=object)
+    falhas = erros[erros.any(axis=1)]
+    if not falhas.empty:
+        nomes = falhas.columns.to_numpy()
+        df.loc[falhas.index, 'erros'] = pd.Series(
+            [list(nomes[linha]) for linha in falhas.to_numpy()], index=falhas.index, dtype=object
+        )
+    return df
+
+
+def _vagas(df: pd.DataFrame, vagas: Dict[int, int]) -> pd.Series:
+    """Linhas que excedem as vagas da turma, pela ordem do ficheiro"""
+    ordem = df.groupby('turma_id').cumcount() + 1
+    return ordem > df['turma_id'].map(vagas).fillna(0)
+
+
+# ============================================================================
+# IMPORTAÇÃO
+# ============================================================================
+
+class ImportadorMatriculas:
+    """Importa listas de inscrição para um ano letivo"""
+
+    def __init__(self, session: Session, ano_letivo_id: int, data_matricula: Optional[date] = None,
+                 licencas: Optional[ServicoLicencas] = None):
+        self.session = session
+        self.licencas = licencas
+        self.ano_letivo = session.get(AnoLetivo, ano_letivo_id)
+        if self.ano_letivo is None:
+            raise ValueError("Ano letivo não encontrado")
+        self.data_matricula = data_matricula or date.today()
+        self.relatorio: List[Dict[str, Any]] = []
+        self.totais = {'linhas': 0, 'importadas': 0, 'pessoas_reutilizadas': 0}
+
+    def _turmas(self):
+        linhas = self.session.execute(
+            select(Turma.id, Turma.codigo, Turma.vagas_disponiveis)
+            .where(Turma.ano_letivo_id == self.ano_letivo.id, Turma.ativa == True)
+        ).all()
+        return {codigo.upper(): id_ for id_, codigo, _ in linhas}, {id_: vagas or 0 for id_, _, vagas in linhas}
+
+    def _erro(self, linha: int, mensagens: List[str]):
+        self.relatorio.append({'linha': int(linha), 'erros': mensagens})
+
+    def importar(self, caminho: str) -> Dict[str, Any]:
+        """Importa o ficheiro. Retorna os totais e o relatório de erros por linha."""
+        for bloco in ler_blocos(caminho):
+            turmas, vagas = self._turmas()
+            df = validar_bloco(bloco, turmas)
+            self.totais['linhas'] += len(df)
+
+            validas = df[df['erros'].str.len() == 0]
+            excedentes = _vagas(validas, vagas)
+            for linha in validas.index[excedentes]:
+                self._erro(linha, ['turma sem vagas'])
+            for linha, mensagens in df.loc[df['erros'].str.len() > 0, 'erros'].items():
+                self._erro(linha, mensagens)
+            validas = validas[~excedentes]
+            if validas.empty:
+                continue
+
+            try:
+                self.totais['importadas'] += self._gravar(validas)
+                self.session.commit()
+            except Exception as erro:
+                self.session.rollback()
+                for linha in validas.index:
+                    self._erro(linha, [f'erro ao gravar o bloco: {erro}'])
+
+        self.relatorio.sort(key=lambda r: r['linha'])
+        return {**self.totais, 'erros': self.relatorio}
+
+    def _gravar(self, df: pd.DataFrame) -> int:
+        """Grava um bloco válido. Retorna o número de matrículas criadas."""
+        agora = datetime.utcnow()
+        documentos = set(df['numero_documento']) | set(df.loc[df['tem_encarregado'], 'encarregado_documento'])
+
+        # Pessoas e alunos já existentes, numa consulta
+        existentes = {
+            doc: (pessoa_id, aluno_id)
+            for doc, pessoa_id, aluno_id in self.session.execute(
+                select(Pessoa.numero_documento, Pessoa.id, Aluno.id)
+                .outerjoin(Aluno, Aluno.pessoa_id == Pessoa.id)
+                .where(Pessoa.numero_documento.in_(documentos))
+            )
+        }
+        matriculados = set(self.session.execute(
+            select(Matricula.aluno_id).where(
+                Matricula.ano_letivo_id == self.ano_letivo.id,
+                Matricula.aluno_id.in_([a for _, a in existentes.values() if a is not None]),
+            )
+        ).scalars())
+        ja_matriculado = df['numero_documento'].map(lambda d: existentes.get(d, (None, None))[1] in matriculados)
+        for linha in df.index[ja_matriculado]:
+            self._erro(linha, ['aluno já matriculado neste ano letivo'])
+        df = df[~ja_matriculado]
+
+        encarregado_novo = (
+            df['tem_encarregado']
+            & ~df['encarregado_documento'].isin(existentes)
+            & ~df['encarregado_documento'].isin(df['numero_documento'])
+        )
+        incompleto = encarregado_novo & (
+            df['encarregado_data_nascimento'].isna() | df['encarregado_genero'].isna() | (df['encarregado_nome'] == '')
+        )
+        for linha in df.index[incompleto]:
+            self._erro(linha, ['encarregado novo sem nome, data de nascimento ou género'])
+        df = df[~incompleto]
+        if df.empty:
+            return 0
+        self.totais['pessoas_reutilizadas'] += int(df['numero_documento'].isin(existentes).sum())
+
+        # 1. Pessoas (alunos e encarregados novos)
+        pessoas = [
+            {'tipo': 'aluno', 'nome_completo': r.nome_completo, 'data_nascimento': r.data_nascimento,
+             'genero': r.genero, 'tipo_documento': r.tipo_documento, 'numero_documento': r.numero_documento,
+             'nacionalidade': r.nacionalidade or 'angolana', 'email_pessoal': r.email or None,
+             'ativo': True, 'data_cadastro': agora}
+            for r in df[~df['numero_documento'].isin(existentes)].itertuples()
+        ]
+        novos_encarregados = df[encarregado_novo.loc[df.index]].drop_duplicates('encarregado_documento')
+        pessoas += [
+            {'tipo': 'encarregado', 'nome_completo': r.encarregado_nome,
+             'data_nascimento': r.encarregado_data_nascimento, 'genero': r.encarregado_genero,
+             'tipo_documento': TipoDocumento.BILHETE_IDENTIDADE, 'numero_documento': r.encarregado_documento,
+             'nacionalidade': 'angolana', 'email_pessoal': None, 'ativo': True, 'data_cadastro': agora}
+            for r in novos_encarregados.itertuples()
+        ]
+        pessoa_ids = {doc: pessoa_id for doc, (pessoa_id, _) in existentes.items()}
+        if pessoas:
+            pessoa_ids.update({
+                doc: pessoa_id for pessoa_id, doc in self.session.execute(
+                    insert(Pessoa).returning(Pessoa.id, Pessoa.numero_documento), pessoas
+                )
+            })
+
+        # 2. Alunos
+        ano = self.ano_letivo.ano
+        sem_aluno = df[df['numero_documento'].map(lambda d: existentes.get(d, (None, None))[1] is None)]
+        aluno_ids = {doc: aluno_id for doc, (_, aluno_id) in existentes.items() if aluno_id is not None}
+        if not sem_aluno.empty:
+            alunos = [
+                {'instituicao_id': self.ano_letivo.instituicao_id, 'pessoa_id': pessoa_ids[r.numero_documento],
+                 'codigo_aluno': r.codigo_aluno or f"AL{ano}-{pessoa_ids[r.numero_documento]:06d}",
+                 'status': StatusAluno.ATIVO, 'data_entrada': self.data_matricula}
+                for r in sem_aluno.itertuples()
+            ]
+            # INSERT em lote não passa pelo before_flush: a licença é verificada aqui
+            if self.licencas is not None:
+                self.licencas.exigir('alunos', self.ano_letivo.instituicao_id, len(alunos))
+            por_pessoa = {pessoa_id: doc for doc, pessoa_id in pessoa_ids.items()}
+            aluno_ids.update({
+                por_pessoa[pessoa_id]: aluno_id for aluno_id, pessoa_id in self.session.execute(
+                    insert(Aluno).returning(Aluno.id, Aluno.pessoa_id), alunos
+                )
+            })
+            if self.licencas is not None:
+                self.licencas.registar(self.session, 'alunos', self.ano_letivo.instituicao_id, len(alunos))
+
+        # 3. Matrículas
+        self.session.execute(insert(Matricula), [
+            {'instituicao_id': self.ano_letivo.instituicao_id,
+             'aluno_id': aluno_ids[r.numero_documento], 'ano_letivo_id': self.ano_letivo.id,
+             'turma_id': int(r.turma_id), 'numero_matricula': f"{ano}-{aluno_ids[r.numero_documento]}",
+             'data_matricula': self.data_matricula, 'ativa': True, 'tipo_ingresso': 'normal'}
+            for r in df.itertuples()
+        ])
+        ocupadas = df.groupby('turma_id').size()
+        tabela = Turma.__table__
+        self.session.connection().execute(
+            update(tabela)
+            .where(tabela.c.id == bindparam('t_id'))
+            .values(vagas_disponiveis=tabela.c.vagas_disponiveis - bindparam('n')),
+            [{'t_id': int(turma_id), 'n': int(n)} for turma_id, n in ocupadas.items()]
+        )
+
+        # 4. Telefones (sem repetir os que as pessoas reutilizadas já têm)
+        telefones = {}
+        for r in df.itertuples():
+            if r.telefone:
+                telefones[(pessoa_ids[r.numero_documento], r.telefone)] = True
+            if r.tem_encarregado and r.encarregado_telefone:
+                telefones.setdefault((pessoa_ids[r.encarregado_documento], r.encarregado_telefone), True)
+        if telefones:
+            ja_registados = set(self.session.execute(
+                select(TelefonePessoa.pessoa_id, TelefonePessoa.numero)
+                .where(tuple_(TelefonePessoa.pessoa_id, TelefonePessoa.numero).in_(list(telefones)))
+            ).tuples())
+            novos = [chave for chave in telefones if chave not in ja_registados]
+            if novos:
+                self.session.execute(insert(TelefonePessoa), [
+                    {'pessoa_id': pessoa_id, 'numero': numero, 'tipo': TipoTelefone.CELULAR,
+                     'whatsapp': False, 'principal': False}
+                    for pessoa_id, numero in novos
+                ])
+
+        # 5. Encarregados de educação
+        com_encarregado = df[df['tem_encarregado']]
+        if not com_encarregado.empty:
+            ligacoes = {
+                (aluno_ids[r.numero_documento], pessoa_ids[r.encarregado_documento]): r.encarregado_parentesco
+                for r in com_encarregado.itertuples()
+            }
+            existentes_ligacoes = set(self.session.execute(
+                select(EncarregadoEducacao.aluno_id, EncarregadoEducacao.pessoa_id)
+                .where(EncarregadoEducacao.aluno_id.in_([a for a, _ in ligacoes]))
+            ).tuples())
+            novas = [(chave, p) for chave, p in ligacoes.items() if chave not in existentes_ligacoes]
+            if novas:
+                self.session.execute(insert(EncarregadoEducacao), [
+                    {'aluno_id': aluno_id, 'pessoa_id': pessoa_id, 'parentesco': parentesco,
+                     'principal': True, 'responsavel_financeiro': True, 'autorizado_buscar_aluno': True}
+                    for (aluno_id, pessoa_id), parentesco in novas
+                ])
+
+        return len(df)
+
+
+def importar_matriculas(session: Session, ano_letivo_id: int, caminho: str,
+                        data_matricula: Optional[date] = None,
+                        licencas: Optional[ServicoLicencas] = None) -> Dict[str, Any]:
+    """Importa um ficheiro CSV/XLSX de inscrições"""
+    return ImportadorMatriculas(session, ano_letivo_id, data_matricula, licencas).importar(caminho)
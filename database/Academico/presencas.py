@@ -0,0 +1,211 @@
+"""
+Registo de presenças em lote.
+
+`carregar_chamada` obtém numa consulta a lista de alunos da turma de um
+`HorarioAula`, com a presença já registada (se houver) e os contadores de
+faltas da matrícula. `registrar_chamada` grava a chamada completa de uma
+aula com um único upsert multi-linha e actualiza os contadores de faltas
+por diferença, pelo que os alertas de `max_faltas_injustificadas` não
+precisam de recontar presenças. Os bitmaps de `MapaFrequencia` são
+actualizados na mesma transacção.
+"""
+
+from datetime import date
+from typing import Dict, List, Optional, Any
+
+from sqlalchemy import select, update, bindparam, func, case, and_
+from sqlalchemy.orm import Session
+
+from .academico import HorarioAula, PresencaAula, Turma, AnoLetivo
+from .alunomodels import Aluno, Matricula
+from ..instituicao.instituicao import ConfiguracaoSistema
+from ..recursoshumanos.recursoshumanos import Pessoa
+from .frequencia import atualizar_mapas
+from ..base_database import upsert
+
+
+def _tipo_falta(presente: Optional[bool], justificada: Optional[bool]) -> Optional[str]:
+    """'injustificada', 'justificada' ou None (presente / sem registo)"""
+    if presente is None or presente:
+        return None
+    return 'justificada' if justificada else 'injustificada'
+
+
+def limite_faltas_turma(session: Session, turma_id: int) -> Optional[int]:
+    """max_faltas_injustificadas da instituição a que a turma pertence"""
+    return session.execute(
+        select(ConfiguracaoSistema.max_faltas_injustificadas)
+        .join(AnoLetivo, AnoLetivo.instituicao_id == ConfiguracaoSistema.instituicao_id)
+        .join(Turma, Turma.ano_letivo_id == AnoLetivo.id)
+        .where(Turma.id == turma_id)
+    ).scalar()
+
+
+# ============================================================================
+# CHAMADA
+# ============================================================================
+
+def carregar_chamada(session: Session, horario_id: int, data_aula: date) -> List[Dict[str, Any]]:
+    """Lista de alunos da aula, com presença registada e contadores, numa consulta"""
+    linhas = session.execute(
+        select(
+            Matricula.id.label('matricula_id'),
+            Aluno.id.label('aluno_id'),
+            Aluno.codigo_aluno,
+            Pessoa.nome_completo,
+            Matricula.faltas_injustificadas,
+            Matricula.faltas_justificadas,
+            PresencaAula.presente,
+            PresencaAula.justificada,
+            HorarioAula.turma_id,
+            HorarioAula.hora_inicio,
+            Turma.ano_letivo_id,
+        )
+        .select_from(HorarioAula)
+        .join(Turma, Turma.id == HorarioAula.turma_id)
+        .join(Matricula, and_(Matricula.turma_id == HorarioAula.turma_id, Matricula.ativa == True))
+        .join(Aluno, Aluno.id == Matricula.aluno_id)
+        .join(Pessoa, Pessoa.id == Aluno.pessoa_id)
+        .outerjoin(PresencaAula, and_(
+            PresencaAula.horario_id == HorarioAula.id,
+            PresencaAula.aluno_id == Aluno.id,
+            PresencaAula.data_aula == data_aula,
+        ))
+        .where(HorarioAula.id == horario_id)
+        .order_by(Pessoa.nome_completo)
+    ).mappings().all()
+    return [dict(linha) for linha in linhas]
+
+
+def registrar_chamada(session: Session, horario_id: int, data_aula: date,
+                      registros: Dict[int, Any], registrado_por_id: Optional[int] = None,
+                      limite_faltas: Optional[int] = None,
+                      chamada: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+    """Grava a chamada completa de uma aula.
+
+    `registros` associa aluno_id a `presente` (bool) ou a um dicionário com
+    `presente`, `justificada`, `motivo_justificacao`, `atraso_minutos`.
+    Alunos da turma ausentes de `registros` ficam como presentes. Retorna
+    os alunos que atingiram agora o limite de faltas injustificadas.
+    """
+    if chamada is None:
+        chamada = carregar_chamada(session, horario_id, data_aula)
+    if not chamada:
+        return []
+    if limite_faltas is None:
+        limite_faltas = limite_faltas_turma(session, chamada[0]['turma_id'])
+
+    linhas, marcas = [], []
+    for aluno in chamada:
+        registo = registros.get(aluno['aluno_id'], True)
+        if not isinstance(registo, dict):
+            registo = {'presente': bool(registo)}
+        presente = bool(registo.get('presente', True))
+        justificada = bool(registo.get('justificada', False)) and not presente
+
+        linhas.append({
+            'horario_id': horario_id,
+            'aluno_id': aluno['aluno_id'],
+            'data_aula': data_aula,
+            'presente': presente,
+            'justificada': justificada,
+            'motivo_justificacao': registo.get('motivo_justificacao'),
+            'atraso_minutos': registo.get('atraso_minutos', 0),
+            'registrado_por_id': registrado_por_id,
+        })
+        marcas.append((aluno['aluno_id'], presente, justificada))
+
+    try:
+        # As variações dos contadores partem das presenças gravadas, não de
+        # `chamada` (que pode ter sido lida antes de outra gravação). O
+        # bloqueio do horário serializa chamadas simultâneas da mesma aula.
+        session.execute(select(HorarioAula.id).where(HorarioAula.id == horario_id).with_for_update())
+        gravadas = {
+            aluno_id: _tipo_falta(presente, justificada)
+            for aluno_id, presente, justificada in session.execute(
+                select(PresencaAula.aluno_id, PresencaAula.presente, PresencaAula.justificada)
+                .where(PresencaAula.horario_id == horario_id, PresencaAula.data_aula == data_aula)
+            )
+        }
+
+        deltas = []
+        for aluno, linha in zip(chamada, linhas):
+            anterior = gravadas.get(aluno['aluno_id'])
+            atual = _tipo_falta(linha['presente'], linha['justificada'])
+            if anterior == atual:
+                continue
+            deltas.append({
+                'm_id': aluno['matricula_id'],
+                'd_inj': (atual == 'injustificada') - (anterior == 'injustificada'),
+                'd_just': (atual == 'justificada') - (anterior == 'justificada'),
+            })
+
+        upsert(
+            session, PresencaAula, linhas,
+            chaves=('horario_id', 'aluno_id', 'data_aula'),
+            atualizar=('presente', 'justificada', 'motivo_justificacao', 'atraso_minutos', 'registrado_por_id'),
+        )
+        if deltas:
+            tabela = Matricula.__table__
+            session.connection().execute(
+                update(tabela)
+                .where(tabela.c.id == bindparam('m_id'))
+                .values(
+                    faltas_injustificadas=tabela.c.faltas_injustificadas + bindparam('d_inj'),
+                    faltas_justificadas=tabela.c.faltas_justificadas + bindparam('d_just'),
+                ),
+                deltas
+            )
+
+        alertas = []
+        novas_faltas = {d['m_id']: d['d_inj'] for d in deltas if d['d_inj'] > 0}
+        if limite_faltas and novas_faltas:
+            totais = dict(session.execute(
+                select(Matricula.id, Matricula.faltas_injustificadas).where(Matricula.id.in_(novas_faltas))
+            ).tuples())
+            for aluno in chamada:
+                delta = novas_faltas.get(aluno['matricula_id'])
+                if delta is None:
+                    continue
+                total = totais[aluno['matricula_id']] or 0
+                if total >= limite_faltas > total - delta:
+                    alertas.append({**aluno, 'faltas_injustificadas': total, 'limite': limite_faltas})
+
+        atualizar_mapas(session, chamada[0]['ano_letivo_id'], data_aula, chamada[0]['hora_inicio'], marcas)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    return alertas
+
+
+# ============================================================================
+# RECONCILIAÇÃO
+# ============================================================================
+
+def recalcular_contadores(session: Session, ano_letivo_id: int) -> int:
+    """Recalcula os contadores de faltas de todas as matrículas do ano numa agregação"""
+    inicio, fim = session.execute(
+        select(AnoLetivo.data_inicio, AnoLetivo.data_fim).where(AnoLetivo.id == ano_letivo_id)
+    ).one()
+    totais = session.execute(
+        select(
+            Matricula.id,
+            func.sum(case((and_(PresencaAula.presente == False, PresencaAula.justificada == False), 1), else_=0)),
+            func.sum(case((and_(PresencaAula.presente == False, PresencaAula.justificada == True), 1), else_=0)),
+        )
+        .select_from(Matricula)
+        .outerjoin(PresencaAula, and_(
+            PresencaAula.aluno_id == Matricula.aluno_id,
+            PresencaAula.data_aula.between(inicio, fim),
+        ))
+        .where(Matricula.ano_letivo_id == ano_letivo_id)
+        .group_by(Matricula.id)
+    ).all()
+    if totais:
+        session.execute(update(Matricula), [
+            {'id': matricula_id, 'faltas_injustificadas': injustificadas or 0, 'faltas_justificadas': justificadas or 0}
+            for matricula_id, injustificadas, justificadas in totais
+        ])
+    session.commit()
+    return len(totais)
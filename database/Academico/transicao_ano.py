@@ -0,0 +1,470 @@
+"""
+Transição de ano letivo.
+
+Prepara o ano letivo de destino a partir do de origem com instruções
+INSERT ... SELECT, todas na mesma transacção:
+
+  1. classes, grade curricular (`DisciplinaClasse`) e turmas;
+  2. planos de pagamento e respectivos `ParcelaTemplate`;
+  3. nova `Matricula` para cada aluno aprovado (classe seguinte, do mesmo
+     nível ou ciclo sempre que exista) ou reprovado (mesma classe,
+     `repetente`), distribuída pelas turmas segundo as vagas;
+  4. vagas das turmas e plano de `ParcelaPropina` das novas matrículas;
+  5. encerramento do ano de origem e desactivação dos seus horários (as
+     restrições de exclusão de `HorarioAula` abrangem todas as aulas
+     activas, de qualquer ano).
+
+Todos os passos são idempotentes (só inserem o que ainda não existe). Em
+modo de pré-visualização a transacção é desfeita no fim e devolve-se apenas
+o resumo: linhas por passo, tempo de cada passo e distribuição de alunos.
+"""
+
+import time
+from datetime import date, datetime
+from typing import Dict, List, Any, Callable
+
+from sqlalchemy import (
+    select, insert, update, literal, func, and_, or_, exists, cast, case, String, Date
+)
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.sql.functions import FunctionElement
+
+from .academico import AnoLetivo, Classe, Turma, DisciplinaClasse, HorarioAula
+from .alunomodels import Aluno, Matricula
+from ..modelsGeral import HistoricoAcademico
+from ..finanacas.financas import PlanoPagamento, ParcelaTemplate, ParcelaPropina
+from ..enums import ResultadoAvaliacao, StatusAluno, StatusPagamento
+
+
+# ============================================================================
+# CONSTRUÇÃO DE DATAS NO SERVIDOR
+# ============================================================================
+
+class data_de(FunctionElement):
+    """Data a partir de (ano, mês, dia) calculada pela base de dados.
+
+    Dias que o mês não tem (29 a 31) passam para o último dia do mês.
+    """
+    type = Date()
+    name = 'data_de'
+    inherit_cache = True
+
+
+def _partes(elemento, compilador, **kw):
+    return [compilador.process(c, **kw) for c in elemento.clauses]
+
+
+@compiles(data_de)
+def _data_de_padrao(elemento, compilador, **kw):
+    ano, mes, dia = _partes(elemento, compilador, **kw)
+    primeiro = f"make_date({ano}, {mes}, 1)"
+    ultimo_dia = f"CAST(EXTRACT(DAY FROM {primeiro} + INTERVAL '1 month' - INTERVAL '1 day') AS INTEGER)"
+    return f"({primeiro} + (LEAST({dia}, {ultimo_dia}) - 1))"
+
+
+@compiles(data_de, 'sqlite')
+def _data_de_sqlite(elemento, compilador, **kw):
+    ano, mes, dia = _partes(elemento, compilador, **kw)
+    primeiro = f"printf('%04d-%02d-01', {ano}, {mes})"
+    # min() compara as datas ISO como texto
+    return (f"min(date({primeiro}, '+' || ({dia} - 1) || ' days'), "
+            f"date({primeiro}, '+1 month', '-1 day'))")
+
+
+@compiles(data_de, 'mysql')
+def _data_de_mysql(elemento, compilador, **kw):
+    ano, mes, dia = _partes(elemento, compilador, **kw)
+    primeiro = f"STR_TO_DATE(CONCAT_WS('-', {ano}, {mes}, 1), '%Y-%m-%d')"
+    return f"LEAST(DATE_ADD({primeiro}, INTERVAL ({dia}) - 1 DAY), LAST_DAY({primeiro}))"
+
+
+# ============================================================================
+# PASSOS
+# ============================================================================
+
+def desativar_horarios_anos(turmas):
+    """UPDATE que desactiva as aulas semanais das turmas indicadas (subconsulta de ids)"""
+    return (
+        update(HorarioAula.__table__)
+        .where(HorarioAula.turma_id.in_(turmas), HorarioAula.ativo == True)
+        .values(ativo=False)
+    )
+
+
+class TransicaoAnoLetivo:
+    """Transição em lote de um ano letivo para o seguinte"""
+
+    def __init__(self, session: Session, origem_id: int, destino_id: int):
+        self.session = session
+        self.origem_id = origem_id
+        self.destino_id = destino_id
+        self.destino = session.get(AnoLetivo, destino_id)
+        if self.destino is None or session.get(AnoLetivo, origem_id) is None:
+            raise ValueError("Ano letivo de origem ou destino não encontrado")
+        if origem_id == destino_id:
+            raise ValueError("O ano letivo de destino deve ser diferente do de origem")
+
+    def _executar(self, instrucao) -> int:
+        return self.session.execute(instrucao).rowcount or 0
+
+    def _classes_correspondentes(self):
+        """Aliases (origem, destino) de Classe ligados pelo código"""
+        co, cd = aliased(Classe), aliased(Classe)
+        juncao = and_(cd.ano_letivo_id == self.destino_id, cd.codigo == co.codigo)
+        return co, cd, juncao
+
+    def clonar_classes(self) -> int:
+        co, cd, juncao = self._classes_correspondentes()
+        colunas = ['nivel', 'codigo', 'nome', 'ordem', 'faixa_etaria_min', 'faixa_etaria_max',
+                   'carga_horaria_semanal', 'tem_exame_nacional', 'ciclo', 'ativa']
+        origem = select(literal(self.destino_id), *[getattr(co, c) for c in colunas]).where(
+            co.ano_letivo_id == self.origem_id, co.ativa == True, ~exists().where(juncao)
+        )
+        return self._executar(insert(Classe.__table__).from_select(['ano_letivo_id', *colunas], origem))
+
+    def clonar_grade(self) -> int:
+        co, cd, juncao = self._classes_correspondentes()
+        dc = aliased(DisciplinaClasse)
+        colunas = ['disciplina_id', 'horas_semanais', 'aulas_semanais', 'peso_avaliacao',
+                   'incluir_media_final', 'ordem_grade']
+        origem = (
+            select(cd.id, *[getattr(DisciplinaClasse, c) for c in colunas])
+            .join(co, co.id == DisciplinaClasse.classe_id)
+            .join(cd, juncao)
+            .where(co.ano_letivo_id == self.origem_id, ~exists().where(
+                dc.classe_id == cd.id, dc.disciplina_id == DisciplinaClasse.disciplina_id
+            ))
+        )
+        return self._executar(insert(DisciplinaClasse.__table__).from_select(['classe_id', *colunas], origem))
+
+    def clonar_turmas(self) -> int:
+        co, cd, juncao = self._classes_correspondentes()
+        td = aliased(Turma)
+        colunas = ['instituicao_id', 'sala_id', 'codigo', 'nome', 'turno', 'hora_inicio', 'hora_fim',
+                   'capacidade_maxima', 'professor_coordenador_id']
+        origem = (
+            select(
+                literal(self.destino_id), cd.id, *[getattr(Turma, c) for c in colunas],
+                Turma.capacidade_maxima, literal(True), literal(datetime.utcnow()),
+            )
+            .join(co, co.id == Turma.classe_id)
+            .join(cd, juncao)
+            .where(Turma.ano_letivo_id == self.origem_id, Turma.ativa == True, ~exists().where(
+                td.ano_letivo_id == self.destino_id, td.classe_id == cd.id, td.codigo == Turma.codigo
+            ))
+        )
+        return self._executar(insert(Turma.__table__).from_select(
+            ['ano_letivo_id', 'classe_id', *colunas, 'vagas_disponiveis', 'ativa', 'data_criacao'], origem
+        ))
+
+    def clonar_planos(self) -> int:
+        co, cd, juncao = self._classes_correspondentes()
+        pd_ = aliased(PlanoPagamento)
+        colunas = ['instituicao_id', 'nome', 'descricao', 'tipo', 'valor_total', 'valor_matricula', 'numero_parcelas',
+                   'tipo_cobranca', 'desconto_pagamento_avista_percentual', 'desconto_irmaos_percentual',
+                   'desconto_funcionarios_percentual']
+        origem = (
+            select(literal(self.destino_id), cd.id, *[getattr(PlanoPagamento, c) for c in colunas],
+                   literal(True), literal(datetime.utcnow()))
+            .join(co, co.id == PlanoPagamento.classe_id)
+            .join(cd, juncao)
+            .where(PlanoPagamento.ano_letivo_id == self.origem_id, PlanoPagamento.ativo == True,
+                   ~exists().where(pd_.ano_letivo_id == self.destino_id, pd_.classe_id == cd.id,
+                                   pd_.nome == PlanoPagamento.nome))
+        )
+        return self._executar(insert(PlanoPagamento.__table__).from_select(
+            ['ano_letivo_id', 'classe_id', *colunas, 'ativo', 'data_criacao'], origem
+        ))
+
+    def clonar_parcelas_template(self) -> int:
+        co, cd, juncao = self._classes_correspondentes()
+        po, pd_ = aliased(PlanoPagamento), aliased(PlanoPagamento)
+        pt = aliased(ParcelaTemplate)
+        colunas = ['numero_parcela', 'nome', 'valor_parcela', 'percentual_valor_total', 'dia_vencimento',
+                   'mes_referencia', 'inclui_propina', 'inclui_alimentacao', 'inclui_transporte',
+                   'inclui_material', 'inclui_uniforme', 'inclui_atividades', 'observacoes']
+        origem = (
+            select(pd_.id, *[getattr(ParcelaTemplate, c) for c in colunas])
+            .join(po, po.id == ParcelaTemplate.plano_pagamento_id)
+            .join(co, co.id == po.classe_id)
+            .join(cd, juncao)
+            .join(pd_, and_(pd_.ano_letivo_id == self.destino_id, pd_.classe_id == cd.id, pd_.nome == po.nome))
+            .where(po.ano_letivo_id == self.origem_id, ~exists().where(
+                pt.plano_pagamento_id == pd_.id, pt.numero_parcela == ParcelaTemplate.numero_parcela
+            ))
+        )
+        return self._executar(insert(ParcelaTemplate.__table__).from_select(
+            ['plano_pagamento_id', *colunas], origem
+        ))
+
+    def _destinos(self):
+        """CTE com as classes de destino possíveis de cada aluno a rematricular.
+
+        Aprovados seguem para a classe de ordem seguinte, preferindo o mesmo
+        `nivel` e depois o mesmo `ciclo` (a ordem não é única: há classes
+        técnicas e regulares com a mesma ordem); reprovados ficam na classe
+        com o mesmo código. `opcoes` conta os destinos com a melhor
+        preferência: mais de um torna o destino ambíguo.
+        """
+        to, co, cd, c2 = aliased(Turma), aliased(Classe), aliased(Classe), aliased(Classe)
+        md = aliased(Matricula)
+        aprovado = HistoricoAcademico.resultado == ResultadoAvaliacao.APROVADO
+        proxima_ordem = (
+            select(func.min(c2.ordem))
+            .where(c2.ano_letivo_id == self.destino_id, c2.ativa == True, c2.ordem > co.ordem)
+            .scalar_subquery()
+        )
+        preferencia = case((cd.nivel == co.nivel, 0), (cd.ciclo == co.ciclo, 1), else_=2)
+        return (
+            select(
+                HistoricoAcademico.aluno_id,
+                to.codigo.label('turma_origem'),
+                co.nome.label('classe_origem'),
+                cd.id.label('classe_id'),
+                cd.nome.label('classe_destino'),
+                (~aprovado).label('repetente'),
+                func.rank().over(
+                    partition_by=HistoricoAcademico.aluno_id, order_by=preferencia
+                ).label('escolha'),
+                func.count().over(
+                    partition_by=(HistoricoAcademico.aluno_id, preferencia)
+                ).label('opcoes'),
+            )
+            .join(Aluno, Aluno.id == HistoricoAcademico.aluno_id)
+            .join(to, to.id == HistoricoAcademico.turma_id)
+            .join(co, co.id == to.classe_id)
+            .join(cd, and_(cd.ano_letivo_id == self.destino_id, cd.ativa == True, or_(
+                and_(aprovado, cd.ordem == proxima_ordem),
+                and_(~aprovado, cd.codigo == co.codigo),
+            )))
+            .where(
+                HistoricoAcademico.ano_letivo_id == self.origem_id,
+                HistoricoAcademico.resultado.in_([ResultadoAvaliacao.APROVADO, ResultadoAvaliacao.REPROVADO]),
+                Aluno.status == StatusAluno.ATIVO,
+                ~exists().where(md.aluno_id == HistoricoAcademico.aluno_id, md.ano_letivo_id == self.destino_id),
+            )
+            .cte('destinos')
+        )
+
+    def _candidatos(self):
+        """CTE com os alunos a rematricular, a classe de destino e a ordem dentro dela"""
+        destinos = self._destinos()
+        return (
+            select(
+                destinos.c.aluno_id,
+                destinos.c.classe_origem,
+                destinos.c.classe_id,
+                destinos.c.classe_destino,
+                destinos.c.repetente,
+                func.row_number().over(
+                    partition_by=destinos.c.classe_id, order_by=(destinos.c.turma_origem, destinos.c.aluno_id)
+                ).label('posicao'),
+            )
+            .where(destinos.c.escolha == 1, destinos.c.opcoes == 1)
+            .cte('candidatos')
+        )
+
+    def destinos_ambiguos(self) -> Dict[str, List[str]]:
+        """Classes de origem cujos aprovados têm mais de uma classe de destino possível"""
+        destinos = self._destinos()
+        ambiguos: Dict[str, List[str]] = {}
+        for origem, destino in self.session.execute(
+            select(destinos.c.classe_origem, destinos.c.classe_destino)
+            .where(destinos.c.escolha == 1, destinos.c.opcoes > 1)
+            .distinct()
+            .order_by(destinos.c.classe_origem, destinos.c.classe_destino)
+        ):
+            ambiguos.setdefault(origem, []).append(destino)
+        return ambiguos
+
+    def _vagas(self):
+        """CTE das turmas de destino com as vagas livres acumuladas por classe"""
+        ocupadas = (
+            select(func.count(Matricula.id))
+            .where(Matricula.turma_id == Turma.id, Matricula.ativa == True)
+            .scalar_subquery()
+        )
+        livres = Turma.capacidade_maxima - ocupadas
+        base = (
+            select(Turma.id.label('turma_id'), Turma.classe_id, livres.label('livres'), Turma.codigo)
+            .where(Turma.ano_letivo_id == self.destino_id, Turma.ativa == True)
+            .subquery()
+        )
+        return (
+            select(
+                base.c.turma_id, base.c.classe_id, base.c.livres,
+                func.sum(base.c.livres).over(
+                    partition_by=base.c.classe_id, order_by=(base.c.codigo, base.c.turma_id)
+                ).label('acumulado'),
+            )
+            .where(base.c.livres > 0)
+            .cte('vagas')
+        )
+
+    def criar_matriculas(self) -> int:
+        ambiguos = self.destinos_ambiguos()
+        if ambiguos:
+            detalhe = '; '.join(f"{origem} -> {', '.join(destinos)}" for origem, destinos in ambiguos.items())
+            raise ValueError(f"Classe de destino ambígua (mesma ordem, nível e ciclo): {detalhe}")
+        candidatos, vagas = self._candidatos(), self._vagas()
+        valor_matricula = (
+            select(func.min(PlanoPagamento.valor_matricula))
+            .where(PlanoPagamento.ano_letivo_id == self.destino_id, PlanoPagamento.ativo == True,
+                   PlanoPagamento.classe_id == candidatos.c.classe_id)
+            .scalar_subquery()
+        )
+        origem = (
+            select(
+                literal(self.destino.instituicao_id),
+                candidatos.c.aluno_id,
+                literal(self.destino_id),
+                vagas.c.turma_id,
+                literal(f"{self.destino.ano}-", String) + cast(candidatos.c.aluno_id, String),
+                literal(date.today()),
+                literal(True),
+                literal(False),
+                candidatos.c.repetente,
+                literal(0),
+                literal(0),
+                literal('renovacao'),
+                func.coalesce(valor_matricula, 0),
+                literal(0),
+                literal(0),
+            )
+            .join(vagas, and_(
+                vagas.c.classe_id == candidatos.c.classe_id,
+                candidatos.c.posicao > vagas.c.acumulado - vagas.c.livres,
+                candidatos.c.posicao <= vagas.c.acumulado,
+            ))
+        )
+        return self._executar(insert(Matricula.__table__).from_select([
+            'instituicao_id', 'aluno_id', 'ano_letivo_id', 'turma_id', 'numero_matricula', 'data_matricula', 'ativa',
+            'transferencia', 'repetente', 'faltas_injustificadas', 'faltas_justificadas', 'tipo_ingresso',
+            'valor_matricula', 'valor_matricula_pago', 'desconto_matricula_percentual',
+        ], origem))
+
+    def atualizar_vagas(self) -> int:
+        ocupadas = (
+            select(func.count(Matricula.id))
+            .where(Matricula.turma_id == Turma.id, Matricula.ativa == True)
+            .scalar_subquery()
+        )
+        return self._executar(
+            update(Turma.__table__)
+            .where(Turma.ano_letivo_id == self.destino_id)
+            .values(vagas_disponiveis=Turma.capacidade_maxima - ocupadas)
+        )
+
+    def gerar_parcelas(self) -> int:
+        inicio = self.destino.data_inicio
+        planos = (
+            select(PlanoPagamento.classe_id, func.min(PlanoPagamento.id).label('plano_id'))
+            .where(PlanoPagamento.ano_letivo_id == self.destino_id, PlanoPagamento.ativo == True)
+            .group_by(PlanoPagamento.classe_id)
+            .subquery()
+        )
+        pp = aliased(ParcelaPropina)
+        # Meses anteriores ao início do ano letivo pertencem ao ano civil seguinte
+        ano_referencia = case(
+            (ParcelaTemplate.mes_referencia < inicio.month, inicio.year + 1), else_=inicio.year
+        )
+        origem = (
+            select(
+                Matricula.instituicao_id, Matricula.id, ParcelaTemplate.id, ParcelaTemplate.numero_parcela, ParcelaTemplate.nome,
+                ParcelaTemplate.mes_referencia, ano_referencia,
+                ParcelaTemplate.valor_parcela, ParcelaTemplate.valor_parcela, literal(0), literal(0), literal(0),
+                data_de(ano_referencia, ParcelaTemplate.mes_referencia, ParcelaTemplate.dia_vencimento),
+                literal(0), literal(0), literal(0),
+                literal(StatusPagamento.PENDENTE, ParcelaPropina.status.type),
+                literal(False), literal(datetime.utcnow()),
+            )
+            .join(Turma, Turma.id == Matricula.turma_id)
+            .join(planos, planos.c.classe_id == Turma.classe_id)
+            .join(ParcelaTemplate, ParcelaTemplate.plano_pagamento_id == planos.c.plano_id)
+            .where(Matricula.ano_letivo_id == self.destino_id, Matricula.ativa == True,
+                   ~exists().where(pp.matricula_id == Matricula.id))
+        )
+        return self._executar(insert(ParcelaPropina.__table__).from_select([
+            'instituicao_id', 'matricula_id', 'parcela_template_id', 'numero_parcela', 'nome_parcela', 'mes_referencia',
+            'ano_referencia', 'valor_original', 'valor_com_desconto', 'valor_pago', 'desconto_percentual',
+            'desconto_valor', 'data_vencimento', 'juros_mora', 'multa_atraso', 'dias_atraso', 'status',
+            'pago_parcialmente', 'data_criacao',
+        ], origem))
+
+    def encerrar_origem(self) -> int:
+        return self._executar(
+            update(AnoLetivo.__table__)
+            .where(AnoLetivo.id == self.origem_id)
+            .values(concluido=True, ativo=False)
+        )
+
+    def desativar_horarios(self) -> int:
+        return self._executar(desativar_horarios_anos(
+            select(Turma.id).where(Turma.ano_letivo_id == self.origem_id)
+        ))
+
+    # ========================================================================
+    # EXECUÇÃO
+    # ========================================================================
+
+    def distribuicao(self) -> List[Dict[str, Any]]:
+        """Alunos por (classe de origem, classe de destino, repetente) ainda por rematricular"""
+        candidatos = self._candidatos()
+        return [dict(linha) for linha in self.session.execute(
+            select(candidatos.c.classe_origem, candidatos.c.classe_destino, candidatos.c.repetente,
+                   func.count().label('alunos'))
+            .group_by(candidatos.c.classe_origem, candidatos.c.classe_destino, candidatos.c.repetente)
+            .order_by(candidatos.c.classe_origem)
+        ).mappings()]
+
+    def pendentes(self) -> Dict[str, int]:
+        """Alunos do ano de origem que a transição não abrange, por resultado"""
+        return {
+            resultado.value: total
+            for resultado, total in self.session.execute(
+                select(HistoricoAcademico.resultado, func.count())
+                .where(HistoricoAcademico.ano_letivo_id == self.origem_id,
+                       HistoricoAcademico.resultado.notin_(
+                           [ResultadoAvaliacao.APROVADO, ResultadoAvaliacao.REPROVADO]))
+                .group_by(HistoricoAcademico.resultado)
+            )
+        }
+
+    def executar(self, previsualizar: bool = False) -> Dict[str, Any]:
+        """Corre todos os passos numa transacção; em pré-visualização desfaz no fim"""
+        passos: List[Callable[[], int]] = [
+            self.clonar_classes, self.clonar_grade, self.clonar_turmas, self.clonar_planos,
+            self.clonar_parcelas_template, self.criar_matriculas, self.atualizar_vagas,
+            self.gerar_parcelas, self.encerrar_origem, self.desativar_horarios,
+        ]
+        relatorio = []
+        try:
+            distribuicao = None
+            for passo in passos:
+                if passo == self.criar_matriculas:
+                    distribuicao = self.distribuicao()
+                inicio = time.perf_counter()
+                linhas = passo()
+                relatorio.append({
+                    'passo': passo.__name__,
+                    'linhas': linhas,
+                    'segundos': round(time.perf_counter() - inicio, 4),
+                })
+            matriculas = next(r['linhas'] for r in relatorio if r['passo'] == 'criar_matriculas')
+            sem_vaga = sum(d['alunos'] for d in distribuicao) - matriculas
+            pendentes = self.pendentes()
+            if previsualizar:
+                self.session.rollback()
+            else:
+                self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+        return {
+            'aplicado': not previsualizar,
+            'passos': relatorio,
+            'distribuicao': distribuicao,
+            'sem_vaga': sem_vaga,
+            'pendentes': pendentes,
+        }
@@ -0,0 +1,445 @@
+"""
+Particionamento mensal e arquivo de logs_sistema.
+
+- PostgreSQL: `logs_sistema` é uma tabela particionada (ver
+  PARTICIONAMENTO_LOGS); `garantir_particoes` cria as partições mensais
+  `logs_sistema_AAAAMM` com antecedência. Registos de meses sem partição
+  vão para `logs_sistema_padrao`; `rodar` passa-os para partições mensais
+  (que depois são arquivadas como as outras).
+- Outras bases (SQLite): `logs_sistema` guarda só o mês corrente; `rodar`
+  move os meses anteriores para tabelas `logs_sistema_AAAAMM`.
+- `arquivar` exporta os meses mais antigos que N meses para ficheiros
+  JSONL comprimidos (ou Parquet) com um índice ao lado
+  (`logs_AAAAMM.indice.json`: intervalo de datas e ids, contagens por
+  acção/módulo/utilizador, sha256) e remove a partição.
+- `pesquisar_logs` consulta a tabela viva, as partições/tabelas mensais e
+  os arquivos, usando os índices para saltar ficheiros que não interessam.
+"""
+
+import gzip
+import heapq
+import json
+import os
+import re
+from collections import Counter
+from datetime import date, datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import Column, MetaData, Table, inspect, select, text, func
+from sqlalchemy.orm import Session
+
+from .modelsGeral import LogSistema
+from .pedagogico.integridade import hash_arquivo
+
+
+MESES_ATIVOS = 12
+MESES_ANTECEDENCIA = 3
+LOTE_LEITURA = 5000
+
+PREFIXO = LogSistema.__tablename__
+_NOME_MENSAL = re.compile(rf'^{PREFIXO}_(\d{{4}})(\d{{2}})$')
+_INDICE = re.compile(r'^logs_(\d{6})\.indice\.json$')
+
+COLUNAS = [c.name for c in LogSistema.__table__.columns]
+
+
+# ============================================================================
+# MESES E TABELAS
+# ============================================================================
+
+def _mes(dia: date) -> Tuple[int, int]:
+    return dia.year, dia.month
+
+
+def _somar_meses(mes: Tuple[int, int], n: int) -> Tuple[int, int]:
+    total = mes[0] * 12 + mes[1] - 1 + n
+    return total // 12, total % 12 + 1
+
+
+def _inicio(mes: Tuple[int, int]) -> datetime:
+    return datetime(mes[0], mes[1], 1)
+
+
+def nome_mensal(mes: Tuple[int, int]) -> str:
+    return f"{PREFIXO}_{mes[0]:04d}{mes[1]:02d}"
+
+
+def _tabela(nome: str) -> Table:
+    """Tabela com as colunas de LogSistema (para ler partições e tabelas mensais)"""
+    return Table(nome, MetaData(), *[Column(c.name, c.type) for c in LogSistema.__table__.columns])
+
+
+def tabelas_mensais(session: Session) -> Dict[Tuple[int, int], str]:
+    """Partições (PostgreSQL) ou tabelas rodadas existentes, por mês"""
+    nomes = inspect(session.connection()).get_table_names()
+    encontradas = {}
+    for nome in nomes:
+        m = _NOME_MENSAL.match(nome)
+        if m:
+            encontradas[(int(m.group(1)), int(m.group(2)))] = nome
+    return encontradas
+
+
+def _postgresql(session: Session) -> bool:
+    return session.get_bind().dialect.name == 'postgresql'
+
+
+# ============================================================================
+# PARTIÇÕES (POSTGRESQL) E ROTAÇÃO (SQLITE)
+# ============================================================================
+
+PADRAO = f"{PREFIXO}_padrao"
+
+
+def _criar_particao(session: Session, mes: Tuple[int, int]) -> int:
+    """Cria a partição de um mês; os registos do mês que estejam na partição
+    por omissão passam para ela (senão a criação falharia). Devolve quantos."""
+    nome = nome_mensal(mes)
+    de, ate = _inicio(mes).isoformat(), _inicio(_somar_meses(mes, 1)).isoformat()
+    intervalo = f"data_log >= '{de}' AND data_log < '{ate}'"
+    if session.execute(text(f"SELECT 1 FROM {PADRAO} WHERE {intervalo} LIMIT 1")).first() is None:
+        session.execute(text(f"CREATE TABLE IF NOT EXISTS {nome} PARTITION OF {PREFIXO} "
+                             f"FOR VALUES FROM ('{de}') TO ('{ate}')"))
+        return 0
+    session.execute(text(f"CREATE TABLE {nome} (LIKE {PREFIXO} INCLUDING DEFAULTS)"))
+    movidas = session.execute(text(
+        f"WITH movidas AS (DELETE FROM {PADRAO} WHERE {intervalo} RETURNING *) "
+        f"INSERT INTO {nome} SELECT * FROM movidas"
+    )).rowcount
+    session.execute(text(f"ALTER TABLE {PREFIXO} ATTACH PARTITION {nome} FOR VALUES FROM ('{de}') TO ('{ate}')"))
+    return movidas
+
+
+def garantir_particoes(session: Session, meses_antecedencia: int = MESES_ANTECEDENCIA,
+                       hoje: Optional[date] = None) -> List[str]:
+    """Cria as partições do mês corrente e dos seguintes (PostgreSQL)"""
+    if not _postgresql(session):
+        return []
+    atual = _mes(hoje or date.today())
+    existentes = tabelas_mensais(session)
+    criadas = []
+    try:
+        for n in range(meses_antecedencia + 1):
+            mes = _somar_meses(atual, n)
+            if mes in existentes:
+                continue
+            _criar_particao(session, mes)
+            criadas.append(nome_mensal(mes))
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    return criadas
+
+
+def _esvaziar_padrao(session: Session) -> Dict[str, int]:
+    """Passa os registos da partição por omissão para partições mensais (PostgreSQL)"""
+    meses = session.execute(text(
+        f"SELECT DISTINCT date_trunc('month', data_log) FROM {PADRAO} ORDER BY 1"
+    )).scalars().all()
+    movidas = {}
+    try:
+        for inicio in meses:
+            mes = _mes(inicio)
+            movidas[nome_mensal(mes)] = _criar_particao(session, mes)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    return movidas
+
+
+def rodar(session: Session, hoje: Optional[date] = None) -> Dict[str, int]:
+    """Move os meses anteriores ao corrente para tabelas logs_sistema_AAAAMM.
+
+    No PostgreSQL só há que esvaziar a partição por omissão.
+    """
+    if _postgresql(session):
+        return _esvaziar_padrao(session)
+    tabela = LogSistema.__table__
+    inicio_atual = _inicio(_mes(hoje or date.today()))
+    mais_antiga = session.execute(
+        select(func.min(tabela.c.data_log)).where(tabela.c.data_log < inicio_atual)
+    ).scalar()
+    if mais_antiga is None:
+        return {}
+
+    movidas = {}
+    try:
+        mes = _mes(mais_antiga)
+        while _inicio(mes) < inicio_atual:
+            de, ate = _inicio(mes), _inicio(_somar_meses(mes, 1))
+            nome = nome_mensal(mes)
+            filtro = (tabela.c.data_log >= de) & (tabela.c.data_log < ate)
+            session.execute(text(f"CREATE TABLE IF NOT EXISTS {nome} AS SELECT * FROM {PREFIXO} WHERE 0"))
+            destino = _tabela(nome)
+            resultado = session.execute(
+                destino.insert().from_select(COLUNAS, select(*tabela.columns).where(filtro))
+            )
+            session.execute(tabela.delete().where(filtro))
+            if resultado.rowcount:
+                movidas[nome] = resultado.rowcount
+            mes = _somar_meses(mes, 1)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    return movidas
+
+
+# ============================================================================
+# ARQUIVO
+# ============================================================================
+
+def _linha_json(linha: Dict) -> Dict:
+    return {k: (v.isoformat() if isinstance(v, datetime) else v) for k, v in linha.items()}
+
+
+def _escrever_jsonl(caminho: str, linhas: Iterator[Dict], resumo) -> None:
+    with gzip.open(caminho, 'wt', encoding='utf-8') as f:
+        for linha in linhas:
+            resumo(linha)
+            f.write(json.dumps(_linha_json(linha), ensure_ascii=False, separators=(',', ':')))
+            f.write('\n')
+
+
+def _escrever_parquet(caminho: str, linhas: Iterator[Dict], resumo) -> None:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("O formato parquet requer o pacote pyarrow")
+
+    escritor = None
+    lote = []
+
+    def gravar_lote():
+        nonlocal escritor
+        registos = [dict(_linha_json(l), dados_anteriores=json.dumps(l['dados_anteriores']),
+                         dados_novos=json.dumps(l['dados_novos'])) for l in lote]
+        tabela = pa.Table.from_pylist(registos)
+        if escritor is None:
+            escritor = pq.ParquetWriter(caminho, tabela.schema, compression='zstd')
+        escritor.write_table(tabela)
+        lote.clear()
+
+    try:
+        for linha in linhas:
+            resumo(linha)
+            lote.append(linha)
+            if len(lote) >= LOTE_LEITURA:
+                gravar_lote()
+        if lote or escritor is None:
+            gravar_lote()
+    finally:
+        if escritor is not None:
+            escritor.close()
+
+
+def _ler_mes(session: Session, nome: str) -> Iterator[Dict]:
+    tabela = _tabela(nome)
+    resultado = session.execute(
+        select(tabela).order_by(tabela.c.data_log, tabela.c.id).execution_options(yield_per=LOTE_LEITURA)
+    )
+    for linha in resultado.mappings():
+        yield dict(linha)
+
+
+def arquivar_mes(session: Session, mes: Tuple[int, int], nome: str, pasta: str,
+                 formato: str = 'jsonl') -> Dict:
+    """Exporta uma tabela mensal, grava o índice e remove a tabela"""
+    extensao = {'jsonl': 'jsonl.gz', 'parquet': 'parquet'}.get(formato)
+    if extensao is None:
+        raise ValueError(f"Formato de arquivo desconhecido: {formato}")
+    chave = f"{mes[0]:04d}{mes[1]:02d}"
+    ficheiro = f"logs_{chave}.{extensao}"
+    caminho = os.path.join(pasta, ficheiro)
+
+    contagens = {'acao': Counter(), 'modulo': Counter(), 'usuario_id': Counter(), 'tabela': Counter()}
+    limites = {'linhas': 0, 'data_min': None, 'data_max': None, 'id_min': None, 'id_max': None}
+
+    def resumo(linha):
+        limites['linhas'] += 1
+        for campo in contagens:
+            contagens[campo][str(linha[campo])] += 1
+        d, i = linha['data_log'], linha['id']
+        limites['data_min'] = d if limites['data_min'] is None else min(limites['data_min'], d)
+        limites['data_max'] = d if limites['data_max'] is None else max(limites['data_max'], d)
+        limites['id_min'] = i if limites['id_min'] is None else min(limites['id_min'], i)
+        limites['id_max'] = i if limites['id_max'] is None else max(limites['id_max'], i)
+
+    os.makedirs(pasta, exist_ok=True)
+    parcial = caminho + '.parcial'
+    escrever = _escrever_jsonl if formato == 'jsonl' else _escrever_parquet
+    escrever(parcial, _ler_mes(session, nome), resumo)
+    os.replace(parcial, caminho)
+
+    indice = {
+        'mes': chave,
+        'ficheiro': ficheiro,
+        'formato': formato,
+        'linhas': limites['linhas'],
+        'data_min': limites['data_min'].isoformat() if limites['data_min'] else None,
+        'data_max': limites['data_max'].isoformat() if limites['data_max'] else None,
+        'id_min': limites['id_min'],
+        'id_max': limites['id_max'],
+        'contagens': {campo: dict(c) for campo, c in contagens.items()},
+        'sha256': hash_arquivo(caminho),
+        'arquivado_em': datetime.utcnow().isoformat(),
+    }
+    caminho_indice = os.path.join(pasta, f"logs_{chave}.indice.json")
+    with open(caminho_indice + '.parcial', 'w', encoding='utf-8') as f:
+        json.dump(indice, f, ensure_ascii=False, indent=1)
+    os.replace(caminho_indice + '.parcial', caminho_indice)
+
+    # Só remove depois de o arquivo e o índice estarem gravados
+    try:
+        session.execute(text(f"DROP TABLE {nome}"))
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    return indice
+
+
+def arquivar(session: Session, pasta: str, meses_ativos: int = MESES_ATIVOS,
+             formato: str = 'jsonl', hoje: Optional[date] = None) -> List[Dict]:
+    """Arquiva as partições/tabelas mensais com mais de `meses_ativos` meses"""
+    limite = _somar_meses(_mes(hoje or date.today()), -meses_ativos)
+    rodar(session, hoje)
+    indices = []
+    for mes, nome in sorted(tabelas_mensais(session).items()):
+        if mes < limite:
+            indices.append(arquivar_mes(session, mes, nome, pasta, formato))
+    return indices
+
+
+def manter_logs(session: Session, pasta_arquivo: Optional[str] = None,
+                meses_ativos: int = MESES_ATIVOS, formato: str = 'jsonl') -> Dict:
+    """Manutenção periódica: partições futuras, rotação e arquivo"""
+    resultado = {'particoes': garantir_particoes(session), 'rodadas': rodar(session), 'arquivados': []}
+    if pasta_arquivo:
+        resultado['arquivados'] = arquivar(session, pasta_arquivo, meses_ativos, formato)
+    return resultado
+
+
+# ============================================================================
+# PESQUISA
+# ============================================================================
+
+def _carregar_indices(pasta: Optional[str]) -> List[Dict]:
+    if not pasta or not os.path.isdir(pasta):
+        return []
+    indices = []
+    for nome in os.listdir(pasta):
+        if _INDICE.match(nome):
+            with open(os.path.join(pasta, nome), encoding='utf-8') as f:
+                indices.append(json.load(f))
+    return indices
+
+
+def _ler_arquivo(pasta: str, indice: Dict) -> Iterator[Dict]:
+    caminho = os.path.join(pasta, indice['ficheiro'])
+    if indice['formato'] == 'parquet':
+        import pyarrow.parquet as pq
+        for lote in pq.ParquetFile(caminho).iter_batches(batch_size=LOTE_LEITURA):
+            for linha in lote.to_pylist():
+                linha['dados_anteriores'] = json.loads(linha['dados_anteriores'])
+                linha['dados_novos'] = json.loads(linha['dados_novos'])
+                yield linha
+    else:
+        with gzip.open(caminho, 'rt', encoding='utf-8') as f:
+            for texto_linha in f:
+                yield json.loads(texto_linha)
+
+
+class _Filtro:
+    """Critérios de pesquisa aplicáveis a SQL, a índices e a linhas de arquivo"""
+
+    def __init__(self, inicio=None, fim=None, usuario_id=None, acao=None, modulo=None,
+                 tabela=None, registro_id=None, texto=None):
+        self.inicio, self.fim = inicio, fim
+        self.igualdades = {k: v for k, v in (('usuario_id', usuario_id), ('acao', acao), ('modulo', modulo),
+                                              ('tabela', tabela), ('registro_id', registro_id)) if v is not None}
+        self.texto = texto.lower() if texto else None
+
+    def sql(self, consulta, t):
+        if self.inicio:
+            consulta = consulta.where(t.c.data_log >= self.inicio)
+        if self.fim:
+            consulta = consulta.where(t.c.data_log < self.fim)
+        for campo, valor in self.igualdades.items():
+            consulta = consulta.where(t.c[campo] == valor)
+        if self.texto:
+            consulta = consulta.where(func.lower(t.c.descricao).contains(self.texto))
+        return consulta
+
+    def mes_interessa(self, de: datetime, ate: datetime) -> bool:
+        return not ((self.inicio and ate <= self.inicio) or (self.fim and de >= self.fim))
+
+    def indice_interessa(self, indice: Dict) -> bool:
+        if not indice['linhas']:
+            return False
+        de, ate = datetime.fromisoformat(indice['data_min']), datetime.fromisoformat(indice['data_max'])
+        if (self.inicio and ate < self.inicio) or (self.fim and de >= self.fim):
+            return False
+        for campo, valor in self.igualdades.items():
+            if campo in indice['contagens'] and str(valor) not in indice['contagens'][campo]:
+                return False
+        return True
+
+    def linha(self, linha: Dict) -> bool:
+        data = linha['data_log']
+        if (self.inicio and data < self.inicio) or (self.fim and data >= self.fim):
+            return False
+        for campo, valor in self.igualdades.items():
+            if linha.get(campo) != valor:
+                return False
+        return not self.texto or self.texto in (linha.get('descricao') or '').lower()
+
+
+def pesquisar_logs(session: Session, pasta_arquivo: Optional[str] = None, limite: int = 200,
+                   **criterios) -> List[Dict]:
+    """
+    Pesquisa em logs vivos, partições/tabelas mensais e arquivos; devolve as
+    `limite` entradas mais recentes (data_log decrescente) como dicionários.
+    Critérios: inicio, fim, usuario_id, acao, modulo, tabela, registro_id, texto.
+    """
+    filtro = _Filtro(**criterios)
+    fontes = []   # (data_max conhecida, leitor)
+
+    # Tabela viva (no PostgreSQL inclui todas as partições, com poda pelo data_log)
+    viva = LogSistema.__table__
+    fontes.append((datetime.max, lambda: session.execute(
+        filtro.sql(select(viva), viva).order_by(viva.c.data_log.desc(), viva.c.id.desc()).limit(limite)
+    ).mappings()))
+
+    if not _postgresql(session):
+        for mes, nome in tabelas_mensais(session).items():
+            de, ate = _inicio(mes), _inicio(_somar_meses(mes, 1))
+            if filtro.mes_interessa(de, ate):
+                t = _tabela(nome)
+                fontes.append((ate, lambda t=t: session.execute(
+                    filtro.sql(select(t), t).order_by(t.c.data_log.desc(), t.c.id.desc()).limit(limite)
+                ).mappings()))
+
+    for indice in _carregar_indices(pasta_arquivo):
+        if filtro.indice_interessa(indice):
+            def ler(indice=indice):
+                linhas = []
+                for linha in _ler_arquivo(pasta_arquivo, indice):
+                    linha['data_log'] = datetime.fromisoformat(linha['data_log'])
+                    if filtro.linha(linha):
+                        linhas.append(linha)
+                return heapq.nlargest(limite, linhas, key=lambda l: (l['data_log'], l['id']))
+            fontes.append((datetime.fromisoformat(indice['data_max']), ler))
+
+    # Das fontes mais recentes para as mais antigas; pára quando as restantes
+    # já não podem ter entradas mais recentes que a mais antiga seleccionada
+    resultados: List[Dict] = []
+    for data_max, ler in sorted(fontes, key=lambda f: f[0], reverse=True):
+        if len(resultados) >= limite and data_max < resultados[-1]['data_log']:
+            break
+        resultados.extend(dict(linha) for linha in ler())
+        resultados = heapq.nlargest(limite, resultados, key=lambda l: (l['data_log'], l['id']))
+    return resultados
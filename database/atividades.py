@@ -0,0 +1,163 @@
+"""
+Feed de actividade recente sobre LogSistema.
+
+- Paginação por chave em (data_log, id), nunca OFFSET: cada página continua
+  a partir da última linha vista e usa o índice idx_log_data_id.
+- Actualização incremental: são lidas as linhas a partir da data_log mais
+  recente já vista, menos uma janela de sobreposição. Um id atribuído antes
+  mas com commit depois de outros (gravações lentas, lotes) continua a ser
+  apanhado; os ids já vistos dentro da janela são ignorados.
+- Um buffer circular com as últimas N entradas responde aos refrescamentos
+  do dashboard sem ir à base.
+"""
+
+import threading
+from collections import deque, namedtuple
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select, and_, or_
+from sqlalchemy.orm import Session
+
+from .modelsGeral import LogSistema, Usuario
+
+
+CAPACIDADE = 200
+TAMANHO_PAGINA = 50
+LOTE_ATUALIZACAO = 500
+# Atraso máximo entre a data_log de um registo e o seu commit
+JANELA_ATUALIZACAO = timedelta(minutes=2)
+
+Atividade = namedtuple('Atividade', 'id data_log usuario acao modulo descricao')
+
+# Posição (data_log, id) da última linha de uma página
+Cursor = Tuple[datetime, int]
+
+
+def _consulta():
+    return (
+        select(LogSistema.id, LogSistema.data_log, Usuario.username,
+               LogSistema.acao, LogSistema.modulo, LogSistema.descricao)
+        .outerjoin(Usuario, Usuario.id == LogSistema.usuario_id)
+    )
+
+
+def _antes_de(cursor: Cursor):
+    data_log, log_id = cursor
+    return or_(LogSistema.data_log < data_log,
+               and_(LogSistema.data_log == data_log, LogSistema.id < log_id))
+
+
+def _depois_de(cursor: Cursor):
+    data_log, log_id = cursor
+    return or_(LogSistema.data_log > data_log,
+               and_(LogSistema.data_log == data_log, LogSistema.id > log_id))
+
+
+def pagina(session: Session, antes: Optional[Cursor] = None, tamanho: int = TAMANHO_PAGINA,
+           modulo: Optional[str] = None) -> Tuple[List[Atividade], Optional[Cursor]]:
+    """Página de actividades (mais recentes primeiro) e o cursor da seguinte"""
+    consulta = _consulta()
+    if antes is not None:
+        consulta = consulta.where(_antes_de(antes))
+    if modulo:
+        consulta = consulta.where(LogSistema.modulo == modulo)
+    linhas = [Atividade(*linha) for linha in session.execute(
+        consulta.order_by(LogSistema.data_log.desc(), LogSistema.id.desc()).limit(tamanho)
+    )]
+    seguinte = (linhas[-1].data_log, linhas[-1].id) if len(linhas) == tamanho else None
+    return linhas, seguinte
+
+
+class FeedAtividades:
+    """Últimas `capacidade` actividades em memória, actualizadas por (data_log, id)"""
+
+    def __init__(self, capacidade: int = CAPACIDADE, janela: timedelta = JANELA_ATUALIZACAO):
+        self.capacidade = capacidade
+        self.janela = janela
+        self._buffer: deque = deque(maxlen=capacidade)   # ordem cronológica
+        self._ultima_data: Optional[datetime] = None
+        self._vistos: Dict[int, datetime] = {}            # ids lidos dentro da janela
+        self._carregado = False
+        self._bloqueio = threading.Lock()
+
+    @property
+    def carregado(self) -> bool:
+        return self._carregado
+
+    def _marcar(self, atividades: List[Atividade]):
+        for a in atividades:
+            self._vistos[a.id] = a.data_log
+        datas = [a.data_log for a in atividades]
+        if self._ultima_data is not None:
+            datas.append(self._ultima_data)
+        if datas:
+            self._ultima_data = max(datas)
+            limite = self._ultima_data - self.janela
+            self._vistos = {i: d for i, d in self._vistos.items() if d >= limite}
+
+    def carregar(self, session: Session) -> int:
+        """Lê as últimas `capacidade` actividades"""
+        linhas, _ = pagina(session, tamanho=self.capacidade)
+        with self._bloqueio:
+            self._buffer.clear()
+            self._buffer.extend(reversed(linhas))
+            self._ultima_data = None
+            self._vistos = {}
+            self._marcar(linhas)
+            self._carregado = True
+        return len(linhas)
+
+    def atualizar(self, session: Session) -> List[Atividade]:
+        """Acrescenta ao buffer as actividades ainda não vistas, relendo a janela de sobreposição"""
+        if not self.carregado:
+            self.carregar(session)
+            return list(self._buffer)
+
+        novas: List[Atividade] = []
+        posicao: Optional[Cursor] = None
+        while True:
+            consulta = _consulta()
+            if posicao is not None:
+                consulta = consulta.where(_depois_de(posicao))
+            elif self._ultima_data is not None:
+                consulta = consulta.where(LogSistema.data_log >= self._ultima_data - self.janela)
+            lote = [Atividade(*linha) for linha in session.execute(
+                consulta.order_by(LogSistema.data_log, LogSistema.id).limit(LOTE_ATUALIZACAO)
+            )]
+            if not lote:
+                break
+            novas.extend(a for a in lote if a.id not in self._vistos)
+            posicao = (lote[-1].data_log, lote[-1].id)
+            if len(lote) < LOTE_ATUALIZACAO:
+                break
+        self._marcar(novas)
+
+        if novas:
+            # Registos com commit tardio chegam fora de ordem de data
+            with self._bloqueio:
+                ordenadas = sorted([*self._buffer, *novas], key=lambda a: (a.data_log, a.id))
+                self._buffer.clear()
+                self._buffer.extend(ordenadas[-self.capacidade:])
+        return novas
+
+    def recentes(self, n: Optional[int] = None) -> List[Atividade]:
+        """As `n` actividades mais recentes do buffer (sem consulta)"""
+        with self._bloqueio:
+            itens = list(self._buffer)
+        itens.reverse()
+        return itens if n is None else itens[:n]
+
+    def pagina(self, session: Session, antes: Optional[Cursor] = None,
+               tamanho: int = TAMANHO_PAGINA) -> Tuple[List[Atividade], Optional[Cursor]]:
+        """Como `pagina`, servida pelo buffer enquanto este cobre o pedido"""
+        itens = self.recentes()
+        if antes is not None:
+            itens = [a for a in itens if (a.data_log, a.id) < antes]
+        # Com menos de `capacidade` linhas o buffer contém a tabela inteira
+        completo = self.carregado and len(self._buffer) < self.capacidade
+        if len(itens) > tamanho or completo:
+            linhas = itens[:tamanho]
+            seguinte = (linhas[-1].data_log, linhas[-1].id) if len(itens) > tamanho else None
+            return linhas, seguinte
+        return pagina(session, antes, tamanho)
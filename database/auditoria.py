@@ -0,0 +1,257 @@
+"""
+Auditoria assíncrona em lote para LogSistema.
+
+- Um `after_flush` captura automaticamente as criações, alterações (só as
+  colunas alteradas) e remoções de cada flush.
+- As entradas ficam na sessão até ao commit (um rollback descarta-as) e são
+  então colocadas numa fila limitada; uma thread grava-as em lote com um
+  único INSERT executemany.
+- Tabelas financeiras são auditadas de forma síncrona, na mesma transacção
+  do registo auditado.
+- Com a fila cheia, quem faz commit grava o lote directamente (contrapressão
+  em vez de perder registos). `fechar()` (também em atexit) grava o que falta.
+- Colunas sensíveis (hashes de senha, salts, tokens) são gravadas como
+  '***', nunca com o valor real.
+"""
+
+import atexit
+import enum
+import queue
+import sys
+import threading
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Callable, Dict, FrozenSet, Iterable, List, Mapping, Optional
+
+from sqlalchemy import event, insert, inspect
+from sqlalchemy.orm import Session
+
+from .modelsGeral import LogSistema
+
+
+TAMANHO_FILA = 10_000
+TAMANHO_LOTE = 500
+INTERVALO_GRAVACAO = 1.0   # segundos
+ESPERA_FILA = 0.5          # segundos antes de gravar directamente
+
+TABELAS_SINCRONAS = frozenset({
+    'planos_pagamento', 'parcelas_propina', 'pagamentos', 'caixas', 'movimentos_caixa',
+    'contratos_fornecedores', 'pagamentos_fornecedores', 'vendas', 'itens_venda', 'pagamentos_venda',
+})
+
+TABELAS_IGNORADAS = frozenset({LogSistema.__tablename__})
+
+# Ocultadas em qualquer tabela
+COLUNAS_SENSIVEIS = frozenset({'senha_hash', 'salt'})
+
+# Colunas ocultadas adicionalmente, por tabela
+COLUNAS_SENSIVEIS_TABELA: Dict[str, FrozenSet[str]] = {
+    'usuarios': frozenset({'token_recuperacao'}),
+}
+
+OCULTO = '***'
+
+_CHAVE_PENDENTES = 'auditoria_pendentes'
+
+
+def _serializavel(valor):
+    """Converte um valor de coluna para JSON"""
+    if valor is None or isinstance(valor, (str, int, float, bool)):
+        return valor
+    if isinstance(valor, (datetime, date, time)):
+        return valor.isoformat()
+    if isinstance(valor, Decimal):
+        return str(valor)
+    if isinstance(valor, enum.Enum):
+        return valor.value
+    if isinstance(valor, bytes):
+        return None
+    if isinstance(valor, (list, tuple)):
+        return [_serializavel(v) for v in valor]
+    if isinstance(valor, dict):
+        return {str(k): _serializavel(v) for k, v in valor.items()}
+    return str(valor)
+
+
+class GravadorAuditoria:
+    """Captura alterações do ORM e grava-as em LogSistema em lote"""
+
+    def __init__(self, fabrica_sessoes: Callable[[], Session], tamanho_fila: int = TAMANHO_FILA,
+                 tamanho_lote: int = TAMANHO_LOTE, intervalo: float = INTERVALO_GRAVACAO,
+                 tabelas_sincronas: Iterable[str] = TABELAS_SINCRONAS,
+                 tabelas_ignoradas: Iterable[str] = TABELAS_IGNORADAS,
+                 colunas_sensiveis: Iterable[str] = COLUNAS_SENSIVEIS,
+                 colunas_sensiveis_tabela: Mapping[str, Iterable[str]] = COLUNAS_SENSIVEIS_TABELA):
+        self.fabrica_sessoes = fabrica_sessoes
+        self.tamanho_lote = tamanho_lote
+        self.intervalo = intervalo
+        self.tabelas_sincronas = frozenset(tabelas_sincronas)
+        self.tabelas_ignoradas = frozenset(tabelas_ignoradas)
+        self.colunas_sensiveis = frozenset(colunas_sensiveis)
+        self.colunas_sensiveis_tabela = {t: frozenset(c) for t, c in colunas_sensiveis_tabela.items()}
+        self.usuario_id: Optional[int] = None    # utilizador por omissão (session.info tem prioridade)
+        self.gravados = 0
+
+        self._fila: queue.Queue = queue.Queue(maxsize=tamanho_fila)
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._ciclo, name='auditoria', daemon=True)
+        self._thread.start()
+        atexit.register(self.fechar)
+
+    # ========================================================================
+    # CAPTURA
+    # ========================================================================
+
+    def instalar(self, alvo=Session):
+        """Regista os eventos numa classe Session ou num sessionmaker"""
+        event.listen(alvo, 'after_flush', self._apos_flush)
+        event.listen(alvo, 'after_commit', self._apos_commit)
+        event.listen(alvo, 'after_rollback', self._apos_rollback)
+
+    def _ocultas(self, obj) -> FrozenSet[str]:
+        return self.colunas_sensiveis | self.colunas_sensiveis_tabela.get(obj.__tablename__, frozenset())
+
+    @staticmethod
+    def _valor(valor, oculto: bool):
+        if oculto and valor is not None:
+            return OCULTO
+        return _serializavel(valor)
+
+    def _entrada(self, session: Session, acao: str, obj, anteriores=None, novos=None) -> Dict:
+        tabela = obj.__tablename__
+        registro_id = getattr(obj, 'id', None)
+        return {
+            'usuario_id': session.info.get('usuario_id', self.usuario_id),
+            'acao': acao,
+            'modulo': session.info.get('modulo') or type(obj).__module__.rsplit('.', 1)[-1],
+            'descricao': f"{acao} {tabela} #{registro_id}",
+            'dados_anteriores': anteriores,
+            'dados_novos': novos,
+            'registro_id': registro_id if isinstance(registro_id, int) else None,
+            'tabela': tabela,
+            'ip_address': session.info.get('ip_address'),
+            'user_agent': session.info.get('user_agent'),
+            'data_log': datetime.utcnow(),
+        }
+
+    def capturar(self, session: Session) -> List[Dict]:
+        """Entradas de auditoria do flush em curso"""
+        entradas = []
+        for obj in session.new:
+            if getattr(obj, '__tablename__', None) in self.tabelas_ignoradas:
+                continue
+            estado, ocultas = inspect(obj), self._ocultas(obj)
+            novos = {c.key: self._valor(getattr(obj, c.key), c.key in ocultas)
+                     for c in estado.mapper.column_attrs}
+            entradas.append(self._entrada(session, 'create', obj, novos=novos))
+
+        for obj in session.dirty:
+            if getattr(obj, '__tablename__', None) in self.tabelas_ignoradas:
+                continue
+            estado, ocultas = inspect(obj), self._ocultas(obj)
+            anteriores, novos = {}, {}
+            for atributo in estado.mapper.column_attrs:
+                historico = estado.attrs[atributo.key].history
+                if not historico.has_changes():
+                    continue
+                oculta = atributo.key in ocultas
+                anteriores[atributo.key] = self._valor(historico.deleted[0] if historico.deleted else None, oculta)
+                novos[atributo.key] = self._valor(historico.added[0] if historico.added else None, oculta)
+            if novos:
+                entradas.append(self._entrada(session, 'update', obj, anteriores, novos))
+
+        for obj in session.deleted:
+            if getattr(obj, '__tablename__', None) in self.tabelas_ignoradas:
+                continue
+            estado, ocultas = inspect(obj), self._ocultas(obj)
+            anteriores = {c.key: self._valor(getattr(obj, c.key), c.key in ocultas)
+                          for c in estado.mapper.column_attrs}
+            entradas.append(self._entrada(session, 'delete', obj, anteriores=anteriores))
+        return entradas
+
+    def _apos_flush(self, session: Session, contexto):
+        entradas = self.capturar(session)
+        if not entradas:
+            return
+        sincronas = [e for e in entradas if e['tabela'] in self.tabelas_sincronas]
+        if sincronas:
+            # Mesma transacção: o registo financeiro e a auditoria são gravados juntos
+            session.connection().execute(insert(LogSistema.__table__), sincronas)
+        assincronas = [e for e in entradas if e['tabela'] not in self.tabelas_sincronas]
+        if assincronas:
+            session.info.setdefault(_CHAVE_PENDENTES, []).extend(assincronas)
+
+    def _apos_commit(self, session: Session):
+        entradas = session.info.pop(_CHAVE_PENDENTES, None)
+        if entradas:
+            self.enfileirar(entradas)
+
+    def _apos_rollback(self, session: Session):
+        session.info.pop(_CHAVE_PENDENTES, None)
+
+    # ========================================================================
+    # FILA E GRAVAÇÃO
+    # ========================================================================
+
+    def enfileirar(self, entradas: List[Dict]):
+        """Coloca entradas na fila; se estiver cheia grava-as directamente"""
+        for i, entrada in enumerate(entradas):
+            try:
+                self._fila.put(entrada, timeout=ESPERA_FILA)
+            except queue.Full:
+                self.gravar(entradas[i:])
+                return
+
+    def gravar(self, entradas: List[Dict]):
+        """Grava um lote com um INSERT executemany"""
+        if not entradas:
+            return
+        session = self.fabrica_sessoes()
+        try:
+            session.connection().execute(insert(LogSistema.__table__), entradas)
+            session.commit()
+            self.gravados += len(entradas)
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def _drenar(self, primeiro=None) -> List[Dict]:
+        lote = [primeiro] if primeiro is not None else []
+        while len(lote) < self.tamanho_lote:
+            try:
+                lote.append(self._fila.get_nowait())
+            except queue.Empty:
+                break
+        return lote
+
+    def _ciclo(self):
+        pendentes: List[Dict] = []
+        while not self._parar.is_set():
+            if not pendentes:
+                try:
+                    pendentes = self._drenar(self._fila.get(timeout=self.intervalo))
+                except queue.Empty:
+                    continue
+            try:
+                self.gravar(pendentes)
+                pendentes = []
+            except Exception as erro:
+                # Mantém o lote e tenta de novo no próximo ciclo
+                print(f"Auditoria: falha ao gravar {len(pendentes)} registos: {erro}", file=sys.stderr)
+                self._parar.wait(self.intervalo)
+        if pendentes:
+            self.gravar(pendentes)
+
+    def fechar(self):
+        """Pára a thread e grava tudo o que está na fila"""
+        if self._parar.is_set():
+            return
+        self._parar.set()
+        self._thread.join()
+        while True:
+            lote = self._drenar()
+            if not lote:
+                break
+            self.gravar(lote)
@@ -0,0 +1,197 @@
+"""
+Serviço de autenticação.
+
+- O identificador é classificado antes da consulta (contém '@' -> email,
+  caso contrário -> username), pelo que cada login é uma única procura
+  por igualdade servida por um índice, sem `OR` entre colunas.
+- A consulta e a verificação da senha correm num conjunto de threads; a
+  interface recebe um `Future` (ou usa `autenticar` num worker).
+- As actualizações de `data_ultimo_login` e das tentativas falhadas são
+  acumuladas e gravadas em lote: um UPDATE executemany para os sucessos e
+  outro para as falhas. Um bloqueio de conta é gravado de imediato.
+- Hashes em formato antigo ou com custo abaixo do configurado são
+  recalculados após um login com sucesso (ainda na thread de trabalho) e
+  gravados no mesmo lote.
+"""
+
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, Future
+from datetime import datetime
+from typing import Callable, Dict, Optional, Tuple
+
+from sqlalchemy import select, update, bindparam, case, func
+from sqlalchemy.orm import Session
+
+from .modelsGeral import Usuario
+from . import senhas
+
+
+MAX_TENTATIVAS = 5
+INTERVALO_GRAVACAO = 0.5   # segundos
+
+ResultadoLogin = namedtuple(
+    'ResultadoLogin', 'sucesso motivo usuario_id tentativas_restantes trocar_senha'
+)
+
+# Motivos
+SUCESSO = 'sucesso'
+NAO_ENCONTRADO = 'nao_encontrado'
+DESATIVADO = 'desativado'
+BLOQUEADO = 'bloqueado'
+SENHA_INCORRETA = 'senha_incorreta'
+
+
+def coluna_identificador(identificador: str):
+    """Coluna indexada a usar para o identificador dado"""
+    return Usuario.email if '@' in identificador else Usuario.username
+
+
+class ServicoAutenticacao:
+    """Autenticação fora da thread da interface com gravação em lote"""
+
+    def __init__(self, fabrica_sessoes: Callable[[], Session], trabalhadores: int = 4,
+                 max_tentativas: int = MAX_TENTATIVAS, intervalo_gravacao: float = INTERVALO_GRAVACAO,
+                 verificador: Optional[Callable[[str, str, str], bool]] = None):
+        self.fabrica_sessoes = fabrica_sessoes
+        self.max_tentativas = max_tentativas
+        self.intervalo_gravacao = intervalo_gravacao
+        self.verificador = verificador or senhas.verificar
+        self._executor = ThreadPoolExecutor(max_workers=trabalhadores, thread_name_prefix='login')
+
+        # Actualizações pendentes
+        self._bloqueio = threading.Lock()
+        self._sucessos: Dict[int, datetime] = {}
+        self._falhas: Dict[int, int] = {}
+        self._novos_hashes: Dict[int, Tuple[str, str, str]] = {}
+        self._parar = threading.Event()
+        self._gravador = threading.Thread(target=self._ciclo_gravacao, name='login-gravador', daemon=True)
+        self._gravador.start()
+
+    # ========================================================================
+    # AUTENTICAÇÃO
+    # ========================================================================
+
+    def _procurar(self, session: Session, identificador: str):
+        coluna = coluna_identificador(identificador)
+        return session.execute(
+            select(Usuario.id, Usuario.senha_hash, Usuario.salt, Usuario.ativo,
+                   Usuario.tentativas_login_falhas, Usuario.trocar_senha_proximo_login)
+            .where(coluna == identificador)
+        ).first()
+
+    def autenticar(self, identificador: str, senha: str) -> ResultadoLogin:
+        """Autentica de forma síncrona (chamar a partir de uma thread de trabalho)"""
+        identificador = identificador.strip()
+        session = self.fabrica_sessoes()
+        try:
+            usuario = self._procurar(session, identificador)
+        finally:
+            session.close()
+
+        if usuario is None:
+            return ResultadoLogin(False, NAO_ENCONTRADO, None, None, False)
+        if not usuario.ativo:
+            return ResultadoLogin(False, DESATIVADO, usuario.id, 0, False)
+
+        if self.verificador(senha, usuario.senha_hash, usuario.salt):
+            novo_hash = senhas.gerar_hash(senha) if senhas.precisa_atualizar(usuario.senha_hash) else None
+            with self._bloqueio:
+                self._sucessos[usuario.id] = datetime.utcnow()
+                self._falhas.pop(usuario.id, None)
+                if novo_hash:
+                    self._novos_hashes[usuario.id] = (usuario.senha_hash, *novo_hash)
+            return ResultadoLogin(True, SUCESSO, usuario.id, self.max_tentativas,
+                                  bool(usuario.trocar_senha_proximo_login))
+
+        with self._bloqueio:
+            self._sucessos.pop(usuario.id, None)
+            self._falhas[usuario.id] = self._falhas.get(usuario.id, 0) + 1
+            tentativas = (usuario.tentativas_login_falhas or 0) + self._falhas[usuario.id]
+        restantes = max(self.max_tentativas - tentativas, 0)
+        if restantes == 0:
+            self.gravar_pendentes()
+            return ResultadoLogin(False, BLOQUEADO, usuario.id, 0, False)
+        return ResultadoLogin(False, SENHA_INCORRETA, usuario.id, restantes, False)
+
+    def autenticar_async(self, identificador: str, senha: str) -> Future:
+        """Autentica no conjunto de threads do serviço"""
+        return self._executor.submit(self.autenticar, identificador, senha)
+
+    # ========================================================================
+    # GRAVAÇÃO EM LOTE
+    # ========================================================================
+
+    def _ciclo_gravacao(self):
+        while not self._parar.wait(self.intervalo_gravacao):
+            try:
+                self.gravar_pendentes()
+            except Exception:
+                # Mantém as actualizações para a próxima tentativa
+                pass
+
+    def gravar_pendentes(self) -> int:
+        """Grava as actualizações acumuladas: um UPDATE por tipo (sucessos, falhas, hashes)"""
+        with self._bloqueio:
+            sucessos, self._sucessos = self._sucessos, {}
+            falhas, self._falhas = self._falhas, {}
+            novos_hashes, self._novos_hashes = self._novos_hashes, {}
+        if not sucessos and not falhas and not novos_hashes:
+            return 0
+
+        tabela = Usuario.__table__
+        session = self.fabrica_sessoes()
+        try:
+            conexao = session.connection()
+            if sucessos:
+                conexao.execute(
+                    update(tabela)
+                    .where(tabela.c.id == bindparam('u_id'))
+                    .values(data_ultimo_login=bindparam('quando'), tentativas_login_falhas=0, data_bloqueio=None),
+                    [{'u_id': u, 'quando': quando} for u, quando in sucessos.items()]
+                )
+            if falhas:
+                total = func.coalesce(tabela.c.tentativas_login_falhas, 0) + bindparam('n')
+                bloquear = total >= self.max_tentativas
+                conexao.execute(
+                    update(tabela)
+                    .where(tabela.c.id == bindparam('u_id'))
+                    .values(
+                        tentativas_login_falhas=total,
+                        ativo=case((bloquear, False), else_=tabela.c.ativo),
+                        data_bloqueio=case((bloquear, bindparam('agora')), else_=tabela.c.data_bloqueio),
+                    ),
+                    [{'u_id': u, 'n': n, 'agora': datetime.utcnow()} for u, n in falhas.items()]
+                )
+            if novos_hashes:
+                conexao.execute(
+                    update(tabela)
+                    # Só substitui se a senha não foi trocada entretanto
+                    .where(tabela.c.id == bindparam('u_id'), tabela.c.senha_hash == bindparam('antigo'))
+                    .values(senha_hash=bindparam('novo_hash'), salt=bindparam('novo_salt')),
+                    [{'u_id': u, 'antigo': antigo, 'novo_hash': h, 'novo_salt': salt}
+                     for u, (antigo, h, salt) in novos_hashes.items()]
+                )
+            session.commit()
+        except Exception:
+            session.rollback()
+            # Devolve ao buffer para não perder tentativas falhadas
+            with self._bloqueio:
+                for u, quando in sucessos.items():
+                    self._sucessos.setdefault(u, quando)
+                for u, n in falhas.items():
+                    self._falhas[u] = self._falhas.get(u, 0) + n
+                for u, novo in novos_hashes.items():
+                    self._novos_hashes.setdefault(u, novo)
+            raise
+        finally:
+            session.close()
+        return len(sucessos) + len(falhas) + len(novos_hashes)
+
+    def fechar(self):
+        """Pára o gravador e grava o que falta"""
+        self._parar.set()
+        self._gravador.join()
+        self._executor.shutdown(wait=True)
+        self.gravar_pendentes()
+
@@ -1,3 +1,5 @@
+import re
+import unicodedata
 from datetime import datetime, date
 from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Boolean, func, text
 from sqlalchemy.ext.declarative import declarative_base, declared_attr
@@ -20,6 +22,50 @@ Base = declarative_base()
 
 
 
+# ============================================================================
+#                    UTILITÁRIOS DE ESCRITA EM LOTE
+# ============================================================================
+
+def dobrar_texto(texto) -> str:
+    """Texto sem acentos, em minúsculas e só com letras, dígitos e espaços simples"""
+    if not texto:
+        return ''
+    decomposto = unicodedata.normalize('NFKD', str(texto))
+    sem_acentos = ''.join(c for c in decomposto if not unicodedata.combining(c))
+    return re.sub(r'[^0-9a-z]+', ' ', sem_acentos.lower()).strip()
+
+
+def upsert(session: Session, modelo, linhas, chaves, atualizar):
+    """INSERT multi-linha que actualiza `atualizar` quando `chaves` já existem.
+
+    Usa ON CONFLICT (PostgreSQL/SQLite) ou ON DUPLICATE KEY (MySQL) para
+    escrever todas as linhas numa única instrução.
+    """
+    if not linhas:
+        return
+    dialeto = session.bind.dialect.name
+    if dialeto == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialeto == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialeto in ('mysql', 'mariadb'):
+        from sqlalchemy.dialects.mysql import insert
+        instrucao = insert(modelo).values(linhas)
+        instrucao = instrucao.on_duplicate_key_update({c: instrucao.inserted[c] for c in atualizar})
+        session.execute(instrucao)
+        return
+    else:
+        raise NotImplementedError(f"Upsert não suportado para {dialeto}")
+    instrucao = insert(modelo).values(linhas)
+    instrucao = instrucao.on_conflict_do_update(
+        index_elements=list(chaves),
+        set_={c: instrucao.excluded[c] for c in atualizar}
+    )
+    session.execute(instrucao)
+
+
 def create_schemas(engine):
+    """Cria/actualiza o esquema (ver database.migracoes); devolve o tempo por passo"""
+    from .migracoes import migrar
 
-    pass
\ No newline at end of file
+    return migrar(engine)
@@ -0,0 +1,214 @@
+"""
+Benchmarks de desempenho.
+
+Correm contra uma base SQLite temporária que faz de servidor local, criada
+só com as tabelas necessárias. Uso:
+
+    python -m database.benchmarks logins [numero_logins]
+    python -m database.benchmarks custo_senha [alvo_ms]
+    python -m database.benchmarks instituicoes [alunos_por_escola]
+"""
+
+import os
+import secrets
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from typing import Dict, Any
+
+from sqlalchemy import create_engine, event, insert, select, func
+from sqlalchemy.orm import sessionmaker
+
+from .base_database import Base
+from .modelsGeral import Usuario
+from .recursoshumanos.recursoshumanos import Pessoa
+from .instituicao.instituicao import Instituicao
+from .Academico.alunomodels import Aluno
+from .enums import Genero, TipoDocumento, NivelAcesso, StatusAluno
+from .senhas import HasherLegado, calibrar
+
+
+def _servidor_local(tabelas):
+    """Engine SQLite num ficheiro temporário com as tabelas indicadas"""
+    pasta = tempfile.mkdtemp(prefix='bench_')
+    engine = create_engine(f"sqlite:///{os.path.join(pasta, 'bench.db')}",
+                           connect_args={'check_same_thread': False, 'timeout': 30})
+    Base.metadata.create_all(engine, tables=[t.__table__ for t in tabelas])
+    return engine, sessionmaker(bind=engine)
+
+
+def _percentis(amostras) -> Dict[str, float]:
+    ordenadas = sorted(amostras)
+    def p(q):
+        return round(ordenadas[min(int(q * len(ordenadas)), len(ordenadas) - 1)] * 1000, 2)
+    return {'p50_ms': p(0.50), 'p95_ms': p(0.95), 'p99_ms': p(0.99),
+            'media_ms': round(statistics.fmean(ordenadas) * 1000, 2)}
+
+
+# ============================================================================
+# LOGIN
+# ============================================================================
+
+def _criar_usuarios(fabrica, total: int, senha: str):
+    agora = datetime.utcnow()
+    pessoas, usuarios = [], []
+    for i in range(total):
+        pessoas.append({
+            'id': i + 1, 'tipo': 'funcionario', 'nome_completo': f'Utilizador {i}',
+            'data_nascimento': date(1990, 1, 1), 'genero': Genero.OUTRO,
+            'tipo_documento': TipoDocumento.BILHETE_IDENTIDADE, 'numero_documento': f'BENCH{i:08d}',
+            'nacionalidade': 'angolana', 'ativo': True, 'data_cadastro': agora,
+        })
+        # Hashes no formato antigo: cada primeiro login faz também a actualização
+        salt = secrets.token_hex(16)
+        usuarios.append({
+            'id': i + 1, 'pessoa_id': i + 1, 'username': f'user{i}', 'email': f'user{i}@escola.ao',
+            'senha_hash': HasherLegado().derivar(senha, salt), 'salt': salt,
+            'nivel_acesso': NivelAcesso.FUNCIONARIO, 'ativo': True, 'data_ativacao': agora,
+            'data_ultima_troca_senha': agora, 'trocar_senha_proximo_login': False,
+            'tentativas_login_falhas': 0,
+        })
+    with fabrica() as session:
+        session.execute(insert(Pessoa), pessoas)
+        session.execute(insert(Usuario), usuarios)
+        session.commit()
+
+
+def benchmark_logins(total: int = 1000, clientes: int = 64, proporcao_falhas: float = 0.1) -> Dict[str, Any]:
+    """Simula `total` logins concorrentes (parte com senha errada) contra o serviço"""
+    from .autenticacao import ServicoAutenticacao
+
+    engine, fabrica = _servidor_local([Pessoa, Usuario])
+    senha = 'Senha#Bench2024'
+    _criar_usuarios(fabrica, total, senha)
+
+    instrucoes = {'SELECT': 0, 'UPDATE': 0}
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _contar(conexao, cursor, sql, parametros, contexto, executemany):
+        tipo = sql.lstrip().split(' ', 1)[0].upper()
+        if tipo in instrucoes:
+            instrucoes[tipo] += 1
+
+    servico = ServicoAutenticacao(fabrica, trabalhadores=8)
+    falhas = set(range(0, total, max(int(1 / proporcao_falhas), 1))) if proporcao_falhas else set()
+
+    def login(i):
+        identificador = f'user{i}@escola.ao' if i % 2 else f'user{i}'
+        inicio = time.perf_counter()
+        resultado = servico.autenticar_async(identificador, 'errada' if i in falhas else senha).result()
+        return time.perf_counter() - inicio, resultado.sucesso
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clientes) as clientes_pool:
+        resultados = list(clientes_pool.map(login, range(total)))
+    duracao = time.perf_counter() - inicio
+    servico.fechar()
+    engine.dispose()
+
+    latencias = [r[0] for r in resultados]
+    return {
+        'logins': total,
+        'sucessos': sum(1 for r in resultados if r[1]),
+        'segundos': round(duracao, 3),
+        'logins_por_segundo': round(total / duracao, 1),
+        **_percentis(latencias),
+        'instrucoes_select': instrucoes['SELECT'],
+        'instrucoes_update': instrucoes['UPDATE'],
+    }
+
+
+# ============================================================================
+# CUSTO DO HASH DE SENHAS
+# ============================================================================
+
+def benchmark_custo_senha(alvo_ms: int = 250) -> Dict[str, Any]:
+    """Escolhe o custo de scrypt e PBKDF2 que cabe em `alvo_ms` neste hardware"""
+    resultado = {}
+    for algoritmo in ('scrypt', 'pbkdf2_sha256'):
+        calibracao = calibrar(alvo_ms, algoritmo)
+        for especificacao, ms in calibracao['medicoes']:
+            resultado[especificacao] = f"{ms} ms"
+        resultado[f'recomendado_{algoritmo}'] = calibracao['especificacao']
+    return resultado
+
+
+# ============================================================================
+# SEPARAÇÃO POR INSTITUIÇÃO
+# ============================================================================
+
+def _criar_escolas(fabrica, escolas: int, alunos_por_escola: int):
+    agora = datetime.utcnow()
+    instituicoes, pessoas, alunos = [], [], []
+    for e in range(1, escolas + 1):
+        instituicoes.append({
+            'id': e, 'codigo_med': f'MED{e:05d}', 'nome_oficial': f'Escola {e}', 'nif': f'NIF{e:09d}',
+            'data_autorizacao': date(2000, 1, 1), 'email_principal': f'escola{e}@escola.ao',
+            'provincia': 'Luanda', 'municipio': 'Luanda', 'bairro': 'Centro',
+            'inicio_ano_letivo': date(2024, 9, 1), 'fim_ano_letivo': date(2025, 7, 31),
+        })
+        for i in range(alunos_por_escola):
+            n = len(pessoas) + 1
+            pessoas.append({
+                'id': n, 'tipo': 'aluno', 'nome_completo': f'Aluno {n}', 'data_nascimento': date(2010, 1, 1),
+                'genero': Genero.OUTRO, 'tipo_documento': TipoDocumento.BILHETE_IDENTIDADE,
+                'numero_documento': f'BENCH{n:08d}', 'nacionalidade': 'angolana', 'ativo': True,
+                'data_cadastro': agora,
+            })
+            alunos.append({
+                'id': n, 'instituicao_id': e, 'pessoa_id': n, 'codigo_aluno': f'E{e}-{i:06d}',
+                'status': StatusAluno.ATIVO if i % 10 else StatusAluno.TRANSFERIDO,
+                'data_entrada': date(2024, 9, 1),
+            })
+    with fabrica() as session:
+        session.execute(insert(Instituicao), instituicoes)
+        session.execute(insert(Pessoa), pessoas)
+        session.execute(insert(Aluno), alunos)
+        session.commit()
+
+
+def benchmark_instituicoes(alunos_por_escola: int = 2000, repeticoes: int = 200) -> Dict[str, Any]:
+    """Custo das consultas de uma escola com 1, 5 e 20 escolas na mesma base"""
+    from .instituicao import escopo
+
+    resultado = {}
+    for escolas in (1, 5, 20):
+        engine, fabrica = _servidor_local([Instituicao, Pessoa, Aluno])
+        _criar_escolas(fabrica, escolas, alunos_por_escola)
+        escopo.instalar(fabrica)
+
+        latencias = []
+        with fabrica() as session:
+            escopo.definir_instituicao(session, 1)
+            for i in range(repeticoes):
+                inicio = time.perf_counter()
+                session.execute(
+                    select(func.count(Aluno.id)).where(Aluno.status == StatusAluno.ATIVO)
+                ).scalar()
+                session.execute(
+                    select(Aluno.id, Aluno.codigo_aluno)
+                    .where(Aluno.codigo_aluno > f'E1-{(i * 37) % alunos_por_escola:06d}')
+                    .order_by(Aluno.codigo_aluno).limit(50)
+                ).all()
+                latencias.append(time.perf_counter() - inicio)
+        engine.dispose()
+        resultado[f'{escolas}_escolas'] = f"{_percentis(latencias)['p50_ms']} ms (p50)"
+    resultado['alunos_por_escola'] = alunos_por_escola
+    return resultado
+
+
+BENCHMARKS = {
+    'logins': benchmark_logins,
+    'custo_senha': benchmark_custo_senha,
+    'instituicoes': benchmark_instituicoes,
+}
+
+
+if __name__ == '__main__':
+    nome = sys.argv[1] if len(sys.argv) > 1 else 'logins'
+    argumentos = [int(a) for a in sys.argv[2:]]
+    for chave, valor in BENCHMARKS[nome](*argumentos).items():
+        print(f"{chave:>22}: {valor}")
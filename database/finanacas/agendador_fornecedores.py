@@ -0,0 +1,185 @@
+"""
+Agendador de contratos de fornecedores.
+
+Numa única passagem sobre os contratos activos:
+  1. gera os `PagamentoFornecedor` do mês com inserções em lote (incluindo
+     a última mensalidade dos contratos que terminam no mês);
+  2. renova (ou encerra) os contratos com `data_fim` ultrapassada e gera as
+     mensalidades que as renovações passam a cobrir.
+
+As renovações contam sempre os períodos a partir de `data_inicio`, pelo
+que o dia do mês do contrato original se mantém ao longo das renovações.
+
+Cada mensalidade tem uma referência determinística (`CTR<id>-<AAAAMM>`),
+única na tabela, pelo que o agendador é idempotente: pode ser executado
+várias vezes, ou novamente após uma falha, sem duplicar pagamentos.
+"""
+
+from calendar import monthrange
+from datetime import date, timedelta
+from typing import Optional, Dict, Any
+
+from sqlalchemy import select, insert, update
+from sqlalchemy.orm import Session
+
+from .financas import ContratoFornecedor, PagamentoFornecedor
+from ..enums import StatusPagamento
+
+
+TAMANHO_LOTE = 1000
+
+
+def referencia_mensalidade(contrato_id: int, ano: int, mes: int) -> str:
+    """Referência única da mensalidade de um contrato num mês"""
+    return f"CTR{contrato_id}-{ano}{mes:02d}"
+
+
+def _somar_meses(data: date, meses: int) -> date:
+    """Soma meses a uma data, ajustando ao último dia do mês quando necessário"""
+    total = data.month - 1 + meses
+    ano, mes = data.year + total // 12, total % 12 + 1
+    return date(ano, mes, min(data.day, monthrange(ano, mes)[1]))
+
+
+def _duracao_meses(inicio: date, fim: date) -> int:
+    """Duração (em meses, no mínimo 1) da vigência de um contrato; `fim` é o último dia"""
+    seguinte = fim + timedelta(days=1)
+    meses = (seguinte.year - inicio.year) * 12 + seguinte.month - inicio.month
+    return max(meses, 1)
+
+
+def _fim_periodo(inicio: date, meses: int) -> date:
+    """Último dia de uma vigência de `meses` meses iniciada em `inicio`"""
+    return _somar_meses(inicio, meses) - timedelta(days=1)
+
+
+# ============================================================================
+# RENOVAÇÕES
+# ============================================================================
+
+def renovar_contratos(session: Session, data_referencia: date) -> Dict[str, int]:
+    """Renova os contratos vencidos com renovação automática e encerra os restantes"""
+    vencidos = session.execute(
+        select(
+            ContratoFornecedor.id, ContratoFornecedor.data_inicio,
+            ContratoFornecedor.data_fim, ContratoFornecedor.renovacao_automatica,
+            ContratoFornecedor.duracao_meses,
+        ).where(
+            ContratoFornecedor.status == 'ativo',
+            ContratoFornecedor.data_fim < data_referencia,
+        )
+    ).all()
+
+    renovacoes, encerramentos = [], []
+    for contrato_id, inicio, fim, automatica, duracao in vencidos:
+        if automatica:
+            # A vigência original fica gravada na primeira renovação
+            meses = duracao or _duracao_meses(inicio, fim)
+            periodos = max(_duracao_meses(inicio, fim) // meses, 1)
+            novo_fim = fim
+            while novo_fim < data_referencia:
+                periodos += 1
+                novo_fim = _fim_periodo(inicio, periodos * meses)
+            renovacoes.append({'id': contrato_id, 'data_fim': novo_fim, 'duracao_meses': meses})
+        else:
+            encerramentos.append({
+                'id': contrato_id,
+                'status': 'encerrado',
+                'data_encerramento': fim,
+                'motivo_encerramento': 'Término de vigência',
+            })
+
+    if renovacoes:
+        session.execute(update(ContratoFornecedor), renovacoes)
+    if encerramentos:
+        session.execute(update(ContratoFornecedor), encerramentos)
+    return {'renovados': len(renovacoes), 'encerrados': len(encerramentos)}
+
+
+# ============================================================================
+# MENSALIDADES
+# ============================================================================
+
+def _inserir_em_lote(session: Session, linhas):
+    """Insere pagamentos ignorando referências já existentes"""
+    if session.bind.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        instrucao = pg_insert(PagamentoFornecedor).on_conflict_do_nothing(index_elements=['referencia'])
+    else:
+        instrucao = insert(PagamentoFornecedor)
+    for i in range(0, len(linhas), TAMANHO_LOTE):
+        session.execute(instrucao, linhas[i:i + TAMANHO_LOTE])
+
+
+def gerar_pagamentos_mes(session: Session, ano: int, mes: int, funcionario_id: int) -> int:
+    """Gera as mensalidades do mês para todos os contratos activos. Retorna quantas foram criadas."""
+    primeiro_dia = date(ano, mes, 1)
+    ultimo_dia = date(ano, mes, monthrange(ano, mes)[1])
+
+    contratos = session.execute(
+        select(
+            ContratoFornecedor.id, ContratoFornecedor.fornecedor_id,
+            ContratoFornecedor.numero_contrato, ContratoFornecedor.valor_mensal,
+            ContratoFornecedor.dia_vencimento, ContratoFornecedor.data_inicio,
+            ContratoFornecedor.data_fim,
+        ).where(
+            ContratoFornecedor.status == 'ativo',
+            ContratoFornecedor.data_fim >= primeiro_dia,
+            ContratoFornecedor.data_inicio <= ultimo_dia,
+            ContratoFornecedor.valor_mensal != None,
+        )
+    ).all()
+    if not contratos:
+        return 0
+
+    referencias = [referencia_mensalidade(c.id, ano, mes) for c in contratos]
+    existentes = set()
+    for i in range(0, len(referencias), TAMANHO_LOTE):
+        existentes.update(session.execute(
+            select(PagamentoFornecedor.referencia)
+            .where(PagamentoFornecedor.referencia.in_(referencias[i:i + TAMANHO_LOTE]))
+        ).scalars())
+
+    linhas = []
+    for contrato, referencia in zip(contratos, referencias):
+        if referencia in existentes:
+            continue
+        vencimento = date(ano, mes, min(contrato.dia_vencimento or 10, ultimo_dia.day))
+        if not contrato.data_inicio <= vencimento <= contrato.data_fim:
+            continue
+        linhas.append({
+            'contrato_id': contrato.id,
+            'fornecedor_id': contrato.fornecedor_id,
+            'referencia': referencia,
+            'descricao': f"Mensalidade {mes:02d}/{ano} - Contrato {contrato.numero_contrato}",
+            'valor': contrato.valor_mensal,
+            'valor_pago': 0,
+            'data_vencimento': vencimento,
+            'status': StatusPagamento.PENDENTE,
+            'funcionario_id': funcionario_id,
+        })
+
+    if linhas:
+        _inserir_em_lote(session, linhas)
+    return len(linhas)
+
+
+def executar_agendador(session: Session, funcionario_id: int,
+                       data_referencia: Optional[date] = None) -> Dict[str, Any]:
+    """Executa renovações e geração de pagamentos do mês numa única transacção"""
+    data_referencia = data_referencia or date.today()
+    ano, mes = data_referencia.year, data_referencia.month
+    try:
+        # Antes das renovações: contratos terminados no início do mês ainda
+        # estão activos e recebem a última mensalidade
+        gerados = gerar_pagamentos_mes(session, ano, mes, funcionario_id)
+        resultado = renovar_contratos(session, data_referencia)
+        # Depois: contratos renovados passam a cobrir o vencimento do mês
+        gerados += gerar_pagamentos_mes(session, ano, mes, funcionario_id)
+        resultado['pagamentos_gerados'] = gerados
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    resultado['data_referencia'] = data_referencia
+    return resultado
@@ -0,0 +1,248 @@
+"""
+Livro-caixa com saldo corrente.
+
+Todos os movimentos de caixa devem passar por `registrar_movimento`, que
+actualiza `Caixa.total_entradas`/`total_saidas` na mesma transacção e grava
+em cada `MovimentoCaixa` o saldo resultante (`saldo_apos`). Assim o saldo,
+o fecho e a conferência de um caixa são O(1), sem somar os movimentos.
+"""
+
+from datetime import datetime
+from decimal import Decimal
+from typing import Optional, List, Dict, Any, Iterable
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from .financas import Caixa, MovimentoCaixa
+
+
+TIPOS_MOVIMENTO = ('entrada', 'saida')
+
+# Diferença tolerada (arredondamentos) ao comparar saldos
+TOLERANCIA_DIVERGENCIA = Decimal('0.01')
+
+
+class CaixaFechadoError(ValueError):
+    """Operação não permitida num caixa já fechado"""
+    pass
+
+
+# ============================================================================
+# MOVIMENTAÇÃO
+# ============================================================================
+
+def _bloquear_caixa(session: Session, caixa_id: int) -> Caixa:
+    """Carrega o caixa com bloqueio de linha (SELECT ... FOR UPDATE)"""
+    caixa = session.query(Caixa).filter(Caixa.id == caixa_id).with_for_update().populate_existing().one_or_none()
+    if caixa is None:
+        raise ValueError(f"Caixa {caixa_id} não encontrado")
+    return caixa
+
+
+def registrar_movimento(session: Session, caixa_id: int, tipo: str, valor, categoria: str,
+                        descricao: str, funcionario_id: int, **dados) -> MovimentoCaixa:
+    """Regista um movimento e actualiza os totais do caixa na mesma transacção.
+
+    O commit fica a cargo de quem chama; em caso de rollback os totais do
+    caixa e o movimento são desfeitos em conjunto.
+    """
+    if tipo not in TIPOS_MOVIMENTO:
+        raise ValueError(f"Tipo de movimento inválido: {tipo}")
+    valor = Decimal(str(valor))
+    if valor <= 0:
+        raise ValueError("O valor do movimento deve ser positivo")
+
+    caixa = _bloquear_caixa(session, caixa_id)
+    if not caixa.aberto:
+        raise CaixaFechadoError(f"Caixa {caixa.codigo_caixa} está fechado")
+
+    if tipo == 'entrada':
+        caixa.total_entradas = Decimal(caixa.total_entradas or 0) + valor
+    else:
+        caixa.total_saidas = Decimal(caixa.total_saidas or 0) + valor
+
+    movimento = MovimentoCaixa(
+        caixa_id=caixa.id,
+        tipo=tipo,
+        categoria=categoria,
+        valor=valor,
+        descricao=descricao,
+        funcionario_id=funcionario_id,
+        saldo_apos=caixa.saldo_atual,
+        confirmado=True,
+        **dados
+    )
+    session.add(movimento)
+    session.flush()
+    return movimento
+
+
+def estornar_movimento(session: Session, movimento_id: int, funcionario_id: int,
+                       motivo: str) -> MovimentoCaixa:
+    """Estorna um movimento lançando o movimento inverso (o original é preservado)"""
+    original = session.get(MovimentoCaixa, movimento_id)
+    if original is None:
+        raise ValueError(f"Movimento {movimento_id} não encontrado")
+    # O bloqueio do caixa serializa estornos concorrentes do mesmo movimento
+    _bloquear_caixa(session, original.caixa_id)
+    estorno_id = session.query(MovimentoCaixa.id).filter(
+        MovimentoCaixa.movimento_estornado_id == original.id
+    ).scalar()
+    if estorno_id is not None:
+        raise ValueError(f"Movimento {movimento_id} já foi estornado pelo movimento #{estorno_id}")
+    tipo_inverso = 'saida' if original.tipo == 'entrada' else 'entrada'
+    return registrar_movimento(
+        session, original.caixa_id, tipo_inverso, original.valor,
+        categoria='estorno',
+        descricao=f"Estorno do movimento #{original.id}: {motivo}",
+        funcionario_id=funcionario_id,
+        pagamento_id=original.pagamento_id,
+        fornecedor_id=original.fornecedor_id,
+        movimento_estornado_id=original.id,
+    )
+
+
+# ============================================================================
+# FECHO E CONFERÊNCIA
+# ============================================================================
+
+def fechar_caixa(session: Session, caixa_id: int, fechado_por: str,
+                 observacoes: Optional[str] = None) -> Caixa:
+    """Fecha o caixa gravando o saldo final a partir dos totais mantidos"""
+    caixa = _bloquear_caixa(session, caixa_id)
+    if not caixa.aberto:
+        raise CaixaFechadoError(f"Caixa {caixa.codigo_caixa} já está fechado")
+
+    caixa.saldo_final = caixa.saldo_atual
+    caixa.data_fechamento = datetime.utcnow()
+    caixa.aberto = False
+    caixa.fechado_por = fechado_por
+    if observacoes:
+        caixa.observacoes = observacoes
+    session.flush()
+    return caixa
+
+
+def conferir_caixa(session: Session, caixa_id: int, conferente_id: int,
+                   saldo_contado) -> Decimal:
+    """Confere um caixa fechado contra o valor contado. Retorna a diferença."""
+    caixa = _bloquear_caixa(session, caixa_id)
+    if caixa.aberto:
+        raise ValueError(f"Caixa {caixa.codigo_caixa} deve ser fechado antes da conferência")
+
+    diferenca = Decimal(str(saldo_contado)) - Decimal(caixa.saldo_final)
+    caixa.conferido = abs(diferenca) < TOLERANCIA_DIVERGENCIA
+    caixa.data_conferencia = datetime.utcnow()
+    caixa.conferido_por_id = conferente_id
+    if not caixa.conferido:
+        nota = f"Divergência na conferência: {diferenca:+.2f}"
+        caixa.observacoes = f"{caixa.observacoes}\n{nota}" if caixa.observacoes else nota
+    session.flush()
+    return diferenca
+
+
+# ============================================================================
+# VERIFICAÇÃO DE CONSISTÊNCIA
+# ============================================================================
+
+def preencher_saldo_apos(session: Session, lote: int = 5000) -> int:
+    """Calcula `saldo_apos` dos movimentos gravados antes da coluna existir.
+
+    Percorre os movimentos confirmados dos caixas com saldos em falta por
+    (caixa_id, id) e grava o saldo corrente em lotes. Retorna o número de
+    movimentos preenchidos.
+    """
+    pendentes = session.query(MovimentoCaixa.caixa_id).filter(
+        MovimentoCaixa.saldo_apos == None, MovimentoCaixa.confirmado == True
+    ).distinct().subquery()
+    iniciais = dict(session.query(Caixa.id, Caixa.saldo_inicial).filter(Caixa.id.in_(select(pendentes))))
+    movimentos = session.query(
+        MovimentoCaixa.caixa_id, MovimentoCaixa.id, MovimentoCaixa.tipo,
+        MovimentoCaixa.valor, MovimentoCaixa.saldo_apos
+    ).filter(
+        MovimentoCaixa.caixa_id.in_(list(iniciais)), MovimentoCaixa.confirmado == True
+    ).order_by(MovimentoCaixa.caixa_id, MovimentoCaixa.id).yield_per(lote)
+
+    saldos = {}
+    alteracoes = []
+    for caixa_id, movimento_id, tipo, valor, saldo_apos in movimentos:
+        saldo = saldos.get(caixa_id, Decimal(iniciais[caixa_id] or 0))
+        saldo += Decimal(valor) if tipo == 'entrada' else -Decimal(valor)
+        saldos[caixa_id] = saldo
+        if saldo_apos is None:
+            alteracoes.append({'id': movimento_id, 'saldo_apos': saldo})
+    for i in range(0, len(alteracoes), lote):
+        session.execute(update(MovimentoCaixa), alteracoes[i:i + lote])
+    session.flush()
+    return len(alteracoes)
+
+
+def verificar_consistencia(session: Session, caixa_ids: Optional[Iterable[int]] = None,
+                           lote: int = 5000) -> List[Dict[str, Any]]:
+    """Recalcula os saldos a partir dos movimentos numa única passagem.
+
+    Percorre os movimentos ordenados por (caixa_id, id) e compara o saldo
+    corrente recalculado com `saldo_apos` de cada movimento e, no fim de cada
+    caixa, com os totais e o saldo final gravados. Retorna a lista de
+    divergências encontradas.
+    """
+    consulta_caixas = session.query(
+        Caixa.id, Caixa.codigo_caixa, Caixa.saldo_inicial, Caixa.saldo_final,
+        Caixa.total_entradas, Caixa.total_saidas
+    )
+    consulta_movimentos = session.query(
+        MovimentoCaixa.caixa_id, MovimentoCaixa.id, MovimentoCaixa.tipo,
+        MovimentoCaixa.valor, MovimentoCaixa.saldo_apos
+    ).filter(MovimentoCaixa.confirmado == True)
+    if caixa_ids is not None:
+        caixa_ids = list(caixa_ids)
+        consulta_caixas = consulta_caixas.filter(Caixa.id.in_(caixa_ids))
+        consulta_movimentos = consulta_movimentos.filter(MovimentoCaixa.caixa_id.in_(caixa_ids))
+
+    caixas = {c.id: c for c in consulta_caixas}
+    acumulados = {caixa_id: [Decimal(0), Decimal(0)] for caixa_id in caixas}
+    divergencias = []
+
+    movimentos = consulta_movimentos.order_by(MovimentoCaixa.caixa_id, MovimentoCaixa.id).yield_per(lote)
+    for caixa_id, movimento_id, tipo, valor, saldo_apos in movimentos:
+        caixa = caixas.get(caixa_id)
+        if caixa is None:
+            continue
+        totais = acumulados[caixa_id]
+        if tipo == 'entrada':
+            totais[0] += Decimal(valor)
+        else:
+            totais[1] += Decimal(valor)
+        esperado = Decimal(caixa.saldo_inicial) + totais[0] - totais[1]
+        if saldo_apos is None or abs(Decimal(saldo_apos) - esperado) >= TOLERANCIA_DIVERGENCIA:
+            divergencias.append({
+                'caixa_id': caixa_id,
+                'codigo_caixa': caixa.codigo_caixa,
+                'movimento_id': movimento_id,
+                'campo': 'saldo_apos',
+                'gravado': saldo_apos,
+                'esperado': esperado,
+            })
+
+    for caixa_id, caixa in caixas.items():
+        entradas, saidas = acumulados[caixa_id]
+        esperados = {
+            'total_entradas': entradas,
+            'total_saidas': saidas,
+        }
+        if caixa.saldo_final is not None:
+            esperados['saldo_final'] = Decimal(caixa.saldo_inicial) + entradas - saidas
+        for campo, esperado in esperados.items():
+            gravado = getattr(caixa, campo)
+            if abs(Decimal(gravado or 0) - esperado) >= TOLERANCIA_DIVERGENCIA:
+                divergencias.append({
+                    'caixa_id': caixa_id,
+                    'codigo_caixa': caixa.codigo_caixa,
+                    'movimento_id': None,
+                    'campo': campo,
+                    'gravado': gravado,
+                    'esperado': esperado,
+                })
+
+    return divergencias
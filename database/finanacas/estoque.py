@@ -0,0 +1,114 @@
+"""
+Motor de reposição de estoque.
+
+Calcula a velocidade de saída de cada produto numa janela móvel a partir de
+`ItemVenda` (vendas) e `MovimentacaoEstoque` (outras saídas e perdas), numa
+única consulta agregada sobre todo o catálogo, e sugere as quantidades a
+encomendar até `estoque_maximo` com uma passagem NumPy. As sugestões são
+agrupadas por fornecedor.
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+
+from .financas import Produto, MovimentacaoEstoque, ItemVenda, Venda
+
+
+JANELA_DIAS = 90
+COBERTURA_DIAS = 30
+PRAZO_ENTREGA_DIAS = 7
+
+TIPOS_SAIDA = ('saida', 'perda')
+
+COLUNAS = [
+    'produto_id', 'codigo', 'nome', 'fornecedor_id', 'quantidade_estoque',
+    'estoque_minimo', 'estoque_maximo', 'preco_custo', 'vendidos', 'outras_saidas',
+]
+
+
+def consulta_reposicao(janela_dias: int = JANELA_DIAS):
+    """Consulta agregada: catálogo activo com saídas na janela"""
+    inicio = datetime.utcnow() - timedelta(days=janela_dias)
+
+    vendas = (
+        select(ItemVenda.produto_id, func.sum(ItemVenda.quantidade).label('quantidade'))
+        .join(Venda, Venda.id == ItemVenda.venda_id)
+        .where(Venda.data_venda >= inicio, Venda.status != 'cancelada')
+        .group_by(ItemVenda.produto_id)
+        .subquery()
+    )
+    # Saídas de venda já estão em ItemVenda; aqui só as restantes
+    saidas = (
+        select(
+            MovimentacaoEstoque.produto_id,
+            func.sum(func.abs(MovimentacaoEstoque.quantidade)).label('quantidade'),
+        )
+        .where(
+            MovimentacaoEstoque.data_movimentacao >= inicio,
+            MovimentacaoEstoque.tipo.in_(TIPOS_SAIDA),
+            MovimentacaoEstoque.venda_id == None,
+        )
+        .group_by(MovimentacaoEstoque.produto_id)
+        .subquery()
+    )
+
+    return (
+        select(
+            Produto.id, Produto.codigo, Produto.nome, Produto.fornecedor_id,
+            Produto.quantidade_estoque, Produto.estoque_minimo, Produto.estoque_maximo,
+            Produto.preco_custo,
+            func.coalesce(vendas.c.quantidade, 0),
+            func.coalesce(saidas.c.quantidade, 0),
+        )
+        .outerjoin(vendas, vendas.c.produto_id == Produto.id)
+        .outerjoin(saidas, saidas.c.produto_id == Produto.id)
+        .where(Produto.ativo == True, Produto.controlar_estoque == True)
+    )
+
+
+def sugerir_reposicao(session: Session, janela_dias: int = JANELA_DIAS,
+                      cobertura_dias: int = COBERTURA_DIAS,
+                      prazo_entrega_dias: int = PRAZO_ENTREGA_DIAS) -> pd.DataFrame:
+    """Retorna os produtos a repor com a quantidade sugerida para encomenda.
+
+    Um produto é sugerido quando o estoque já está no mínimo ou o atingirá
+    durante o prazo de entrega ao ritmo actual de saída. A quantidade cobre
+    o consumo previsto para `cobertura_dias` acima do mínimo, limitada a
+    `estoque_maximo`.
+    """
+    linhas = session.execute(consulta_reposicao(janela_dias)).all()
+    df = pd.DataFrame.from_records(linhas, columns=COLUNAS)
+    if df.empty:
+        return df.assign(velocidade_diaria=[], quantidade_sugerida=[], custo_estimado=[])
+
+    estoque = df['quantidade_estoque'].to_numpy(dtype=float)
+    minimo = df['estoque_minimo'].to_numpy(dtype=float)
+    maximo = df['estoque_maximo'].to_numpy(dtype=float, na_value=np.inf)
+    saidas = df['vendidos'].to_numpy(dtype=float) + df['outras_saidas'].to_numpy(dtype=float)
+
+    velocidade = saidas / janela_dias
+    estoque_na_entrega = estoque - velocidade * prazo_entrega_dias
+    precisa = (estoque <= minimo) | (estoque_na_entrega <= minimo)
+
+    alvo = np.minimum(minimo + velocidade * (cobertura_dias + prazo_entrega_dias), maximo)
+    alvo = np.maximum(alvo, minimo + 1)
+    sugerida = np.where(precisa, np.ceil(np.maximum(alvo - estoque, 0)), 0).astype(np.int64)
+
+    df['velocidade_diaria'] = velocidade
+    df['quantidade_sugerida'] = sugerida
+    df['custo_estimado'] = sugerida * df['preco_custo'].to_numpy(dtype=float)
+    return df[sugerida > 0].sort_values(['fornecedor_id', 'velocidade_diaria'], ascending=[True, False])
+
+
+def reposicao_por_fornecedor(session: Session, **parametros) -> Dict[int, pd.DataFrame]:
+    """Agrupa as sugestões de reposição por fornecedor (None = sem fornecedor)"""
+    sugestoes = sugerir_reposicao(session, **parametros)
+    return {
+        (None if pd.isna(fornecedor_id) else int(fornecedor_id)): grupo
+        for fornecedor_id, grupo in sugestoes.groupby('fornecedor_id', dropna=False)
+    }
@@ -7,6 +7,7 @@ class PlanoPagamento(Base):
     __tablename__ = 'planos_pagamento'
     
     id = Column(Integer, primary_key=True, autoincrement=True)
+    instituicao_id = Column(Integer, ForeignKey('instituicoes.id', ondelete='CASCADE'), nullable=False)
     ano_letivo_id = Column(Integer, ForeignKey('anos_letivos.id', ondelete='CASCADE'), nullable=False)
     classe_id = Column(Integer, ForeignKey('classes.id', ondelete='CASCADE'), nullable=False)
     
@@ -39,6 +40,7 @@ class PlanoPagamento(Base):
     parcelas_template = relationship("ParcelaTemplate", back_populates="plano_pagamento", cascade="all, delete-orphan")
     
     __table_args__ = (
+        Index('idx_plano_instituicao_ano', 'instituicao_id', 'ano_letivo_id'),
         UniqueConstraint('ano_letivo_id', 'classe_id', 'nome', name='uq_plano_pagamento'),
         Index('idx_plano_ativo', 'ativo'),
         CheckConstraint('numero_parcelas > 0', name='ck_parcelas_positivo'),
@@ -89,6 +91,7 @@ class ParcelaPropina(Base):
     __tablename__ = 'parcelas_propina'
     
     id = Column(Integer, primary_key=True, autoincrement=True)
+    instituicao_id = Column(Integer, ForeignKey('instituicoes.id', ondelete='CASCADE'), nullable=False)
     matricula_id = Column(Integer, ForeignKey('matriculas.id', ondelete='CASCADE'), nullable=False)
     parcela_template_id = Column(Integer, ForeignKey('parcelas_template.id'))
     
@@ -134,10 +137,15 @@ class ParcelaPropina(Base):
     template = relationship("ParcelaTemplate")
     
     __table_args__ = (
+        Index('idx_parcela_instituicao_status', 'instituicao_id', 'status', 'data_vencimento'),
         Index('idx_parcela_matricula', 'matricula_id'),
         Index('idx_parcela_status', 'status'),
         Index('idx_parcela_vencimento', 'data_vencimento'),
         Index('idx_parcela_mes_ano', 'mes_referencia', 'ano_referencia'),
+        # Parcial: só as parcelas por pagar (consultas de dívida e inadimplência)
+        Index('idx_parcela_em_aberto', 'data_vencimento', 'matricula_id',
+              postgresql_where=text("status IN ('PENDENTE', 'PAGO_PARCIAL', 'ATRASADO')"),
+              sqlite_where=text("status IN ('PENDENTE', 'PAGO_PARCIAL', 'ATRASADO')")),
         CheckConstraint('valor_pago <= valor_com_desconto + juros_mora + multa_atraso', name='ck_valor_pago'),
     )
     
@@ -169,6 +177,7 @@ class Pagamento(Base):
     __tablename__ = 'pagamentos'
     
     id = Column(Integer, primary_key=True, autoincrement=True)
+    instituicao_id = Column(Integer, ForeignKey('instituicoes.id', ondelete='CASCADE'), nullable=False)
     aluno_id = Column(Integer, ForeignKey('alunos.id', ondelete='CASCADE'), nullable=False)
     parcela_id = Column(Integer, ForeignKey('parcelas_propina.id', ondelete='CASCADE'))
     encarregado_id = Column(Integer, ForeignKey('encarregados_educacao.id'))
@@ -214,6 +223,7 @@ class Pagamento(Base):
     caixa = relationship("Caixa")
     
     __table_args__ = (
+        Index('idx_pagamento_instituicao_data', 'instituicao_id', 'data_pagamento'),
         Index('idx_pagamento_recibo', 'numero_recibo'),
         Index('idx_pagamento_aluno', 'aluno_id'),
         Index('idx_pagamento_data', 'data_pagamento'),
@@ -226,6 +236,7 @@ class Caixa(Base):
     __tablename__ = 'caixas'
     
     id = Column(Integer, primary_key=True, autoincrement=True)
+    instituicao_id = Column(Integer, ForeignKey('instituicoes.id', ondelete='CASCADE'), nullable=False)
     funcionario_responsavel_id = Column(Integer, ForeignKey('funcionarios.id'), nullable=False)
     
     # Identificação
@@ -263,6 +274,7 @@ class Caixa(Base):
     movimentos = relationship("MovimentoCaixa", back_populates="caixa", cascade="all, delete-orphan")
     
     __table_args__ = (
+        Index('idx_caixa_instituicao_abertura', 'instituicao_id', 'data_abertura'),
         Index('idx_caixa_aberto', 'aberto'),
         Index('idx_caixa_periodo', 'periodo'),
         Index('idx_caixa_data_abertura', 'data_abertura'),
@@ -273,7 +285,7 @@ class Caixa(Base):
         """Saldo atual do caixa"""
         if self.saldo_final is not None:
             return Decimal(self.saldo_final)
-        return Decimal(self.saldo_inicial) + Decimal(self.total_entradas) - Decimal(self.total_saidas)
+        return Decimal(self.saldo_inicial) + Decimal(self.total_entradas or 0) - Decimal(self.total_saidas or 0)
 
 class MovimentoCaixa(Base):
     """Movimentações do caixa"""
@@ -290,10 +302,16 @@ class MovimentoCaixa(Base):
     valor = Column(Numeric(10, 2), nullable=False)
     descricao = Column(String(500), nullable=False)
     
+    # Saldo corrente do caixa após este movimento (mantido por registrar_movimento)
+    saldo_apos = Column(Numeric(12, 2))
+    
     # Origem/Destino
     pagamento_id = Column(Integer, ForeignKey('pagamentos.id'))
     fornecedor_id = Column(Integer, ForeignKey('fornecedores.id'))
     
+    # Movimento que este estorna (cada movimento só pode ser estornado uma vez)
+    movimento_estornado_id = Column(Integer, ForeignKey('movimentos_caixa.id'))
+    
     # Data
     data_movimento = Column(DateTime, default=datetime.utcnow, nullable=False)
     
@@ -320,6 +338,9 @@ class MovimentoCaixa(Base):
         Index('idx_movimento_caixa', 'caixa_id'),
         Index('idx_movimento_tipo', 'tipo'),
         Index('idx_movimento_data', 'data_movimento'),
+        Index('uq_movimento_estornado', 'movimento_estornado_id', unique=True),
+        CheckConstraint("tipo IN ('entrada', 'saida')", name='ck_movimento_tipo'),
+        CheckConstraint('valor > 0', name='ck_movimento_valor_positivo'),
     )
 
 class Fornecedor(Base):
@@ -327,6 +348,7 @@ class Fornecedor(Base):
     __tablename__ = 'fornecedores'
     
     id = Column(Integer, primary_key=True, autoincrement=True)
+    instituicao_id = Column(Integer, ForeignKey('instituicoes.id', ondelete='CASCADE'), nullable=False)
     
     # Identificação
     nome = Column(String(200), nullable=False)
@@ -371,6 +393,7 @@ class Fornecedor(Base):
     produtos = relationship("Produto", back_populates="fornecedor", cascade="all, delete-orphan")
     
     __table_args__ = (
+        Index('idx_fornecedor_instituicao_ativo', 'instituicao_id', 'ativo'),
         Index('idx_fornecedor_nome', 'nome'),
         Index('idx_fornecedor_nif', 'nif'),
         Index('idx_fornecedor_ativo', 'ativo'),
@@ -414,6 +437,7 @@ class ContratoFornecedor(Base):
     data_inicio = Column(Date, nullable=False)
     data_fim = Column(Date, nullable=False)
     renovacao_automatica = Column(Boolean, default=False)
+    duracao_meses = Column(Integer, comment='Meses de cada período de vigência (gravado na primeira renovação)')
     
     # Pagamento
     dia_vencimento = Column(Integer, default=10)
@@ -438,6 +462,7 @@ class ContratoFornecedor(Base):
         Index('idx_contrato_fornecedor', 'fornecedor_id'),
         Index('idx_contrato_status', 'status'),
         Index('idx_contrato_data_fim', 'data_fim'),
+        Index('idx_contrato_status_fim', 'status', 'data_fim'),
         CheckConstraint('data_fim > data_inicio', name='ck_contrato_datas'),
     )
 
@@ -490,6 +515,7 @@ class Produto(Base):
     __tablename__ = 'produtos'
     
     id = Column(Integer, primary_key=True, autoincrement=True)
+    instituicao_id = Column(Integer, ForeignKey('instituicoes.id', ondelete='CASCADE'), nullable=False)
     fornecedor_id = Column(Integer, ForeignKey('fornecedores.id'))
     
     # Identificação
@@ -527,6 +553,7 @@ class Produto(Base):
     movimentacoes = relationship("MovimentacaoEstoque", back_populates="produto", cascade="all, delete-orphan")
     
     __table_args__ = (
+        Index('idx_produto_instituicao_categoria', 'instituicao_id', 'categoria'),
         Index('idx_produto_codigo', 'codigo'),
         Index('idx_produto_categoria', 'categoria'),
         Index('idx_produto_ativo', 'ativo'),
@@ -534,9 +561,9 @@ class Produto(Base):
         CheckConstraint('quantidade_estoque >= 0', name='ck_estoque_positivo'),
     )
     
-    @property
+    @hybrid_property
     def necessita_reposicao(self) -> bool:
-        """Verifica se precisa repor estoque"""
+        """Verifica se precisa repor estoque (também utilizável em filtros SQL)"""
         return self.quantidade_estoque <= self.estoque_minimo
 
 class MovimentacaoEstoque(Base):
@@ -590,6 +617,7 @@ class Venda(Base):
     __tablename__ = 'vendas'
     
     id = Column(Integer, primary_key=True, autoincrement=True)
+    instituicao_id = Column(Integer, ForeignKey('instituicoes.id', ondelete='CASCADE'), nullable=False)
     aluno_id = Column(Integer, ForeignKey('alunos.id'))
     funcionario_id = Column(Integer, ForeignKey('funcionarios.id'), nullable=False)
     
@@ -623,6 +651,7 @@ class Venda(Base):
     pagamentos_venda = relationship("PagamentoVenda", back_populates="venda", cascade="all, delete-orphan")
     
     __table_args__ = (
+        Index('idx_venda_instituicao_data', 'instituicao_id', 'data_venda'),
         Index('idx_venda_numero', 'numero_venda'),
         Index('idx_venda_aluno', 'aluno_id'),
         Index('idx_venda_data', 'data_venda'),
@@ -0,0 +1,152 @@
+"""
+Relatório de antiguidade da dívida (aging) de propinas.
+
+Carrega numa única consulta colunar todas as parcelas em aberto de um ano
+letivo e faz a classificação por faixas de atraso e as tabelas dinâmicas
+(classe, turma, turno) com NumPy/pandas, sem percorrer alunos em Python.
+"""
+
+from collections import OrderedDict
+from datetime import date
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+
+from .financas import ParcelaPropina
+from ..Academico.academico import Turma, Classe
+from ..Academico.alunomodels import Matricula
+from ..enums import StatusPagamento
+
+
+# Limites inferiores (em dias de atraso) de cada faixa, a partir da segunda
+LIMITES_FAIXAS = np.array([31, 61, 91])
+ROTULOS_FAIXAS = ['0-30', '31-60', '61-90', '90+']
+
+DIMENSOES = {
+    'classe': 'classe',
+    'turma': 'turma',
+    'turno': 'turno',
+}
+
+STATUS_EM_ABERTO = (
+    StatusPagamento.PENDENTE,
+    StatusPagamento.PAGO_PARCIAL,
+    StatusPagamento.ATRASADO,
+)
+
+COLUNAS = ['aluno_id', 'classe', 'turma', 'turno', 'data_vencimento', 'valor_restante']
+
+
+# ============================================================================
+# MOTOR DO RELATÓRIO
+# ============================================================================
+
+class RelatorioInadimplencia:
+    """Motor do relatório de inadimplência por faixas de atraso"""
+
+    def __init__(self, session: Session, max_cache: int = 16):
+        self.session = session
+        self.max_cache = max_cache
+        self._cache: "OrderedDict[Tuple[int, date], pd.DataFrame]" = OrderedDict()
+
+    def _consulta(self, ano_letivo_id: int, data_referencia: date):
+        """Consulta colunar única das parcelas vencidas em aberto"""
+        restante = (
+            ParcelaPropina.valor_com_desconto
+            + func.coalesce(ParcelaPropina.juros_mora, 0)
+            + func.coalesce(ParcelaPropina.multa_atraso, 0)
+            - ParcelaPropina.valor_pago
+        )
+        return (
+            select(
+                Matricula.aluno_id,
+                Classe.nome,
+                Turma.nome,
+                Turma.turno,
+                ParcelaPropina.data_vencimento,
+                restante,
+            )
+            .select_from(ParcelaPropina)
+            .join(Matricula, Matricula.id == ParcelaPropina.matricula_id)
+            .join(Turma, Turma.id == Matricula.turma_id)
+            .join(Classe, Classe.id == Turma.classe_id)
+            .where(
+                Matricula.ano_letivo_id == ano_letivo_id,
+                ParcelaPropina.status.in_(STATUS_EM_ABERTO),
+                ParcelaPropina.data_vencimento <= data_referencia,
+                restante > 0,
+            )
+        )
+
+    def gerar(self, ano_letivo_id: int, data_referencia: Optional[date] = None) -> pd.DataFrame:
+        """Retorna o detalhe das parcelas em atraso já classificado por faixa"""
+        data_referencia = data_referencia or date.today()
+        chave = (ano_letivo_id, data_referencia)
+        if chave in self._cache:
+            self._cache.move_to_end(chave)
+            return self._cache[chave]
+
+        linhas = self.session.execute(self._consulta(ano_letivo_id, data_referencia)).all()
+        df = pd.DataFrame.from_records(linhas, columns=COLUNAS)
+
+        df['turno'] = df['turno'].map(lambda t: t.value if t is not None else None)
+        df['valor_restante'] = df['valor_restante'].astype(float)
+
+        vencimentos = df['data_vencimento'].to_numpy(dtype='datetime64[D]')
+        dias = (np.datetime64(data_referencia, 'D') - vencimentos).astype(np.int64)
+        df['dias_atraso'] = dias
+        df['faixa'] = pd.Categorical.from_codes(
+            np.digitize(dias, LIMITES_FAIXAS), categories=ROTULOS_FAIXAS, ordered=True
+        )
+
+        self._cache[chave] = df
+        if len(self._cache) > self.max_cache:
+            self._cache.popitem(last=False)
+        return df
+
+    def por_dimensao(self, ano_letivo_id: int, dimensao: str = 'classe',
+                     data_referencia: Optional[date] = None) -> pd.DataFrame:
+        """Tabela dinâmica do valor em dívida: linhas = dimensão, colunas = faixas"""
+        if dimensao not in DIMENSOES:
+            raise ValueError(f"Dimensão inválida: {dimensao}")
+        df = self.gerar(ano_letivo_id, data_referencia)
+        tabela = df.pivot_table(
+            index=DIMENSOES[dimensao], columns='faixa', values='valor_restante',
+            aggfunc='sum', fill_value=0.0, observed=False
+        )
+        tabela = tabela.reindex(columns=ROTULOS_FAIXAS, fill_value=0.0)
+        tabela['total'] = tabela.sum(axis=1)
+        tabela['alunos'] = df.groupby(DIMENSOES[dimensao])['aluno_id'].nunique()
+        return tabela.sort_values('total', ascending=False)
+
+    def resumo(self, ano_letivo_id: int, data_referencia: Optional[date] = None) -> pd.DataFrame:
+        """Totais por faixa: valor em dívida, número de parcelas e de alunos"""
+        df = self.gerar(ano_letivo_id, data_referencia)
+        agrupado = df.groupby('faixa', observed=False)
+        return pd.DataFrame({
+            'valor': agrupado['valor_restante'].sum(),
+            'parcelas': agrupado.size(),
+            'alunos': agrupado['aluno_id'].nunique(),
+        }).reindex(ROTULOS_FAIXAS, fill_value=0)
+
+    def invalidar(self, ano_letivo_id: Optional[int] = None):
+        """Remove resultados em cache (de um ano letivo ou todos)"""
+        if ano_letivo_id is None:
+            self._cache.clear()
+            return
+        for chave in [c for c in self._cache if c[0] == ano_letivo_id]:
+            del self._cache[chave]
+
+    def renderizar(self, chart, ano_letivo_id: int, data_referencia: Optional[date] = None):
+        """Desenha o resumo por faixas num ChartWidget"""
+        resumo = self.resumo(ano_letivo_id, data_referencia)
+        chart.plotBarChart(
+            resumo['valor'].tolist(),
+            ROTULOS_FAIXAS,
+            "Dívida por Antiguidade",
+            "Dias em atraso",
+            "Valor (Kz)"
+        )
@@ -0,0 +1,257 @@
+"""
+Previsão de fluxo de caixa (90 dias).
+
+Entradas: parcelas de propina em aberto, ponderadas pela propensão de
+pagamento pontual de cada família. Saídas: pagamentos a fornecedores
+pendentes e mensalidades de contratos activos ainda não lançadas.
+
+A propensão é calculada de forma vectorizada sobre o histórico de
+`Pagamento` e mantida em cache; `atualizar_propensao` só recalcula as
+famílias com pagamentos novos desde a última actualização.
+"""
+
+from datetime import date, timedelta
+from typing import Optional, Iterable
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, func, and_
+from sqlalchemy.orm import Session
+
+from .financas import ParcelaPropina, Pagamento, PagamentoFornecedor, ContratoFornecedor
+from ..Academico.alunomodels import Aluno, Matricula, EncarregadoEducacao
+from ..enums import StatusPagamento
+
+
+HORIZONTE_DIAS = 90
+
+# Prior bayesiano da taxa de pontualidade (equivale a N pagamentos "médios")
+PESO_PRIOR = 3.0
+
+STATUS_EM_ABERTO = (
+    StatusPagamento.PENDENTE,
+    StatusPagamento.PAGO_PARCIAL,
+    StatusPagamento.ATRASADO,
+)
+
+
+def _expressao_familia():
+    """Família = pessoa do encarregado responsável financeiro (ou o próprio aluno)"""
+    responsavel = (
+        select(
+            EncarregadoEducacao.aluno_id.label('aluno_id'),
+            func.min(EncarregadoEducacao.pessoa_id).label('pessoa_id'),
+        )
+        .where(EncarregadoEducacao.responsavel_financeiro == True)
+        .group_by(EncarregadoEducacao.aluno_id)
+        .subquery()
+    )
+    familia = func.coalesce(responsavel.c.pessoa_id, Aluno.pessoa_id)
+    return responsavel, familia
+
+
+# ============================================================================
+# PROPENSÃO DE PAGAMENTO
+# ============================================================================
+
+class PrevisaoFluxoCaixa:
+    """Previsão de fluxo de caixa com propensão de pagamento por família"""
+
+    def __init__(self, session: Session, tolerancia_dias: int = 5):
+        self.session = session
+        self.tolerancia_dias = tolerancia_dias
+        self.propensao = pd.DataFrame(columns=['pontuais', 'total']).astype(float)
+        self.propensao.index.name = 'familia'
+        self.taxa_global = 0.5
+        self.ultimo_pagamento_id = 0
+
+    def _historico(self, familias: Optional[Iterable[int]] = None) -> pd.DataFrame:
+        """Primeiro pagamento de cada parcela, com a família e o vencimento"""
+        responsavel, familia = _expressao_familia()
+        consulta = (
+            select(
+                familia.label('familia'),
+                Pagamento.parcela_id,
+                ParcelaPropina.data_vencimento,
+                func.min(Pagamento.data_contabilizacao).label('data_pagamento'),
+            )
+            .select_from(Pagamento)
+            .join(ParcelaPropina, ParcelaPropina.id == Pagamento.parcela_id)
+            .join(Aluno, Aluno.id == Pagamento.aluno_id)
+            .outerjoin(responsavel, responsavel.c.aluno_id == Aluno.id)
+            .where(Pagamento.confirmado == True, Pagamento.estornado == False)
+            .group_by(familia, Pagamento.parcela_id, ParcelaPropina.data_vencimento)
+        )
+        if familias is not None:
+            consulta = consulta.where(familia.in_(list(familias)))
+        linhas = self.session.execute(consulta).all()
+        return pd.DataFrame.from_records(
+            linhas, columns=['familia', 'parcela_id', 'data_vencimento', 'data_pagamento']
+        )
+
+    def _agregar(self, historico: pd.DataFrame) -> pd.DataFrame:
+        """Conta parcelas pagas e pagas a tempo por família"""
+        if historico.empty:
+            return pd.DataFrame(columns=['pontuais', 'total'], dtype=float)
+        vencimento = historico['data_vencimento'].to_numpy(dtype='datetime64[D]')
+        pagamento = historico['data_pagamento'].to_numpy(dtype='datetime64[D]')
+        historico = historico.assign(
+            pontual=(pagamento - vencimento).astype(np.int64) <= self.tolerancia_dias
+        )
+        agrupado = historico.groupby('familia')['pontual']
+        return pd.DataFrame({
+            'pontuais': agrupado.sum().astype(float),
+            'total': agrupado.size().astype(float),
+        })
+
+    def _recalcular_taxa_global(self):
+        total = self.propensao['total'].sum()
+        if total > 0:
+            self.taxa_global = float(self.propensao['pontuais'].sum() / total)
+
+    def carregar_propensao(self):
+        """Calcula a propensão de todas as famílias numa passagem"""
+        self.ultimo_pagamento_id = self.session.query(func.coalesce(func.max(Pagamento.id), 0)).scalar()
+        self.propensao = self._agregar(self._historico())
+        self._recalcular_taxa_global()
+
+    def atualizar_propensao(self) -> int:
+        """Recalcula só as famílias com pagamentos novos. Retorna quantas foram actualizadas."""
+        if self.ultimo_pagamento_id == 0 and self.propensao.empty:
+            self.carregar_propensao()
+            return len(self.propensao)
+
+        responsavel, familia = _expressao_familia()
+        novos = self.session.execute(
+            select(familia, func.max(Pagamento.id))
+            .select_from(Pagamento)
+            .join(Aluno, Aluno.id == Pagamento.aluno_id)
+            .outerjoin(responsavel, responsavel.c.aluno_id == Aluno.id)
+            .where(Pagamento.id > self.ultimo_pagamento_id)
+            .group_by(familia)
+        ).all()
+        if not novos:
+            return 0
+
+        familias = [f for f, _ in novos]
+        atualizadas = self._agregar(self._historico(familias))
+        self.propensao = pd.concat([
+            self.propensao.drop(index=familias, errors='ignore'), atualizadas
+        ])
+        self.ultimo_pagamento_id = max(self.ultimo_pagamento_id, max(m for _, m in novos))
+        self._recalcular_taxa_global()
+        return len(familias)
+
+    def taxas(self) -> pd.Series:
+        """Taxa de pontualidade suavizada por família"""
+        p = self.propensao
+        return (p['pontuais'] + PESO_PRIOR * self.taxa_global) / (p['total'] + PESO_PRIOR)
+
+    # ========================================================================
+    # PROJECÇÃO
+    # ========================================================================
+
+    def _entradas(self, inicio: date, fim: date) -> pd.Series:
+        """Entradas esperadas por dia (parcelas já vencidas contam no dia inicial)"""
+        responsavel, familia = _expressao_familia()
+        restante = (
+            ParcelaPropina.valor_com_desconto
+            + func.coalesce(ParcelaPropina.juros_mora, 0)
+            + func.coalesce(ParcelaPropina.multa_atraso, 0)
+            - ParcelaPropina.valor_pago
+        )
+        linhas = self.session.execute(
+            select(familia, ParcelaPropina.data_vencimento, restante)
+            .select_from(ParcelaPropina)
+            .join(Matricula, Matricula.id == ParcelaPropina.matricula_id)
+            .join(Aluno, Aluno.id == Matricula.aluno_id)
+            .outerjoin(responsavel, responsavel.c.aluno_id == Aluno.id)
+            .where(
+                Matricula.ativa == True,
+                ParcelaPropina.status.in_(STATUS_EM_ABERTO),
+                ParcelaPropina.data_vencimento <= fim,
+                restante > 0,
+            )
+        ).all()
+        df = pd.DataFrame.from_records(linhas, columns=['familia', 'data', 'valor'])
+        if df.empty:
+            return pd.Series(dtype=float)
+
+        taxas = self.taxas()
+        peso = df['familia'].map(taxas).fillna(self.taxa_global).to_numpy(dtype=float)
+        datas = np.maximum(df['data'].to_numpy(dtype='datetime64[D]'), np.datetime64(inicio, 'D'))
+        return pd.Series(df['valor'].to_numpy(dtype=float) * peso, index=datas).groupby(level=0).sum()
+
+    def _saidas(self, inicio: date, fim: date) -> pd.Series:
+        """Saídas previstas por dia: pagamentos a fornecedores e mensalidades de contratos"""
+        pendentes = self.session.execute(
+            select(
+                PagamentoFornecedor.contrato_id,
+                PagamentoFornecedor.data_vencimento,
+                PagamentoFornecedor.valor - func.coalesce(PagamentoFornecedor.valor_pago, 0),
+            ).where(
+                PagamentoFornecedor.status.in_(STATUS_EM_ABERTO),
+                PagamentoFornecedor.data_vencimento <= fim,
+            )
+        ).all()
+        lancados = set()
+        datas, valores = [], []
+        for contrato_id, vencimento, valor in pendentes:
+            datas.append(max(vencimento, inicio))
+            valores.append(float(valor))
+            if contrato_id is not None:
+                lancados.add((contrato_id, vencimento.year, vencimento.month))
+
+        contratos = self.session.execute(
+            select(
+                ContratoFornecedor.id, ContratoFornecedor.valor_mensal,
+                ContratoFornecedor.dia_vencimento, ContratoFornecedor.data_inicio,
+                ContratoFornecedor.data_fim,
+            ).where(
+                ContratoFornecedor.status == 'ativo',
+                ContratoFornecedor.valor_mensal != None,
+                ContratoFornecedor.data_fim >= inicio,
+                ContratoFornecedor.data_inicio <= fim,
+            )
+        ).all()
+        for mes in pd.period_range(inicio, fim, freq='M'):
+            for contrato_id, valor_mensal, dia, data_inicio, data_fim in contratos:
+                if (contrato_id, mes.year, mes.month) in lancados:
+                    continue
+                vencimento = date(mes.year, mes.month, min(dia or 10, mes.days_in_month))
+                if inicio <= vencimento <= fim and data_inicio <= vencimento <= data_fim:
+                    datas.append(vencimento)
+                    valores.append(float(valor_mensal))
+
+        if not datas:
+            return pd.Series(dtype=float)
+        return pd.Series(valores, index=np.array(datas, dtype='datetime64[D]')).groupby(level=0).sum()
+
+    def projetar(self, inicio: Optional[date] = None, dias: int = HORIZONTE_DIAS) -> pd.DataFrame:
+        """Série temporal diária com entradas, saídas, saldo do dia e acumulado"""
+        inicio = inicio or date.today()
+        fim = inicio + timedelta(days=dias - 1)
+        if self.propensao.empty:
+            self.carregar_propensao()
+        else:
+            self.atualizar_propensao()
+
+        indice = pd.date_range(inicio, fim, freq='D')
+        serie = pd.DataFrame({
+            'entradas': self._entradas(inicio, fim).reindex(indice, fill_value=0.0),
+            'saidas': self._saidas(inicio, fim).reindex(indice, fill_value=0.0),
+        }, index=indice)
+        serie['saldo'] = serie['entradas'] - serie['saidas']
+        serie['acumulado'] = serie['saldo'].cumsum()
+        return serie
+
+    def renderizar(self, chart, inicio: Optional[date] = None, frequencia: str = 'W'):
+        """Desenha o saldo acumulado previsto num ChartWidget"""
+        serie = self.projetar(inicio)['acumulado'].resample(frequencia).last()
+        chart.plotLineChart(
+            [d.strftime('%d/%m') for d in serie.index],
+            serie.tolist(),
+            f"Fluxo de Caixa Previsto ({HORIZONTE_DIAS} dias)",
+            "Data",
+            "Saldo acumulado (Kz)"
+        )
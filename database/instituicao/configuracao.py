@@ -0,0 +1,134 @@
+"""
+Cache de definições por instituição (Instituicao + ConfiguracaoSistema).
+
+Cada instituição é lida uma vez para um `Definicoes` imutável (namedtuples
+com os valores das colunas), que pode ser partilhado entre threads. A
+validade é confirmada no máximo a cada `intervalo_verificacao` segundos
+com uma única consulta às colunas `data_atualizacao`; alterações feitas
+pelo ORM neste processo invalidam o cache de imediato.
+"""
+
+import threading
+import time
+from collections import namedtuple
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import select, event
+from sqlalchemy.orm import Session
+
+from .instituicao import Instituicao, ConfiguracaoSistema
+
+
+INTERVALO_VERIFICACAO = 30   # segundos
+
+DadosInstituicao = namedtuple(
+    'DadosInstituicao', [c.name for c in Instituicao.__table__.columns] + ['endereco_completo']
+)
+Configuracao = namedtuple('Configuracao', [c.name for c in ConfiguracaoSistema.__table__.columns])
+
+Definicoes = namedtuple('Definicoes', 'instituicao configuracao carregado_em')
+
+
+def _valor_omissao(coluna):
+    padrao = coluna.default
+    if padrao is None or not padrao.is_scalar:
+        return None
+    return padrao.arg
+
+
+# Valores por omissão para instituições ainda sem linha em configuracoes_sistema
+CONFIGURACAO_OMISSAO = Configuracao(**{c.name: _valor_omissao(c) for c in ConfiguracaoSistema.__table__.columns})
+
+
+def _instantaneo(obj, tipo):
+    return tipo(**{campo: getattr(obj, campo) for campo in tipo._fields})
+
+
+def carregar_definicoes(session: Session, instituicao_id: Optional[int] = None) -> Optional[Definicoes]:
+    """Lê a instituição (a primeira activa se não indicada) e a sua configuração"""
+    consulta = select(Instituicao)
+    if instituicao_id is None:
+        consulta = consulta.where(Instituicao.ativa.is_(True)).order_by(Instituicao.id).limit(1)
+    else:
+        consulta = consulta.where(Instituicao.id == instituicao_id)
+    instituicao = session.execute(consulta).scalar_one_or_none()
+    if instituicao is None:
+        return None
+
+    configuracao = session.execute(
+        select(ConfiguracaoSistema).where(ConfiguracaoSistema.instituicao_id == instituicao.id)
+    ).scalar_one_or_none()
+    return Definicoes(
+        instituicao=_instantaneo(instituicao, DadosInstituicao),
+        configuracao=(_instantaneo(configuracao, Configuracao) if configuracao is not None
+                      else CONFIGURACAO_OMISSAO._replace(instituicao_id=instituicao.id)),
+        carregado_em=time.monotonic(),
+    )
+
+
+class CacheDefinicoes:
+    """Definições por instituição, carregadas uma vez e partilhadas entre threads"""
+
+    def __init__(self, fabrica_sessoes: Callable[[], Session],
+                 intervalo_verificacao: float = INTERVALO_VERIFICACAO):
+        self.fabrica_sessoes = fabrica_sessoes
+        self.intervalo_verificacao = intervalo_verificacao
+        self._cache: Dict[Optional[int], Definicoes] = {}
+        self._verificado: Dict[Optional[int], float] = {}
+        self._bloqueio = threading.RLock()
+
+        event.listen(Instituicao, 'after_update', self._alterado)
+        event.listen(ConfiguracaoSistema, 'after_insert', self._alterado)
+        event.listen(ConfiguracaoSistema, 'after_update', self._alterado)
+        event.listen(ConfiguracaoSistema, 'after_delete', self._alterado)
+
+    def _alterado(self, mapper, connection, alvo):
+        self.invalidar(getattr(alvo, 'instituicao_id', None) or alvo.id)
+
+    def invalidar(self, instituicao_id: Optional[int] = None):
+        """Descarta uma instituição (e a entrada por omissão) ou todo o cache"""
+        with self._bloqueio:
+            if instituicao_id is None:
+                self._cache.clear()
+                self._verificado.clear()
+                return
+            for chave, definicoes in list(self._cache.items()):
+                if chave == instituicao_id or definicoes.instituicao.id == instituicao_id:
+                    del self._cache[chave]
+
+    def _actual(self, session: Session, definicoes: Definicoes) -> bool:
+        """Compara os data_atualizacao gravados com os do instantâneo"""
+        instituicao = definicoes.instituicao
+        linha = session.execute(
+            select(Instituicao.data_atualizacao, ConfiguracaoSistema.data_atualizacao)
+            .outerjoin(ConfiguracaoSistema, ConfiguracaoSistema.instituicao_id == Instituicao.id)
+            .where(Instituicao.id == instituicao.id)
+        ).first()
+        if linha is None:
+            return False
+        return (linha[0] == instituicao.data_atualizacao
+                and linha[1] == definicoes.configuracao.data_atualizacao)
+
+    def obter(self, instituicao_id: Optional[int] = None) -> Optional[Definicoes]:
+        """Definições da instituição (None = instituição por omissão)"""
+        with self._bloqueio:
+            definicoes = self._cache.get(instituicao_id)
+            agora = time.monotonic()
+            if definicoes is not None and agora - self._verificado.get(instituicao_id, 0) < self.intervalo_verificacao:
+                return definicoes
+
+            session = self.fabrica_sessoes()
+            try:
+                if definicoes is None or not self._actual(session, definicoes):
+                    definicoes = carregar_definicoes(session, instituicao_id)
+            finally:
+                session.close()
+            if definicoes is not None:
+                self._cache[instituicao_id] = definicoes
+                self._verificado[instituicao_id] = agora
+            return definicoes
+
+    def configuracao(self, instituicao_id: Optional[int] = None) -> Configuracao:
+        """Só a configuração; valores por omissão se a instituição não existir"""
+        definicoes = self.obter(instituicao_id)
+        return definicoes.configuracao if definicoes else CONFIGURACAO_OMISSAO
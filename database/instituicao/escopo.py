@@ -0,0 +1,213 @@
+"""
+Separação dos dados por instituição.
+
+As tabelas principais (alunos, matrículas, turmas, pessoal, finanças e
+loja) têm a coluna `instituicao_id`, com índices compostos que começam por
+ela. Com `definir_instituicao(session, id)`:
+
+- todas as consultas ORM (SELECT, UPDATE e DELETE em massa) recebem o
+  filtro `instituicao_id = id` para esses modelos através de
+  `do_orm_execute` + `with_loader_criteria`;
+- novos registos recebem a instituição da sessão no `before_flush`.
+
+As tabelas dependentes não repetem a coluna: são filtradas pela chave
+estrangeira para o registo pai (`MODELOS_POR_PAI`), com uma subconsulta
+`chave IN (SELECT id FROM pai WHERE instituicao_id = id)`:
+
+- salas e blocos pelo campus;
+- professor_disciplina pelo professor;
+- horarios_aula pela turma e presencas_aula pelo aluno;
+- notas pela matrícula;
+- movimentos_caixa pela caixa;
+- contratos e pagamentos de fornecedores pelo fornecedor;
+- itens_venda pela venda.
+
+Consultas que precisam de ver todas as instituições usam
+`.execution_options(todas_instituicoes=True)`. Instruções Core sobre
+`Modelo.__table__` não são filtradas e devem incluir a coluna.
+"""
+
+from typing import Optional
+
+from sqlalchemy import event, inspect, select, text
+from sqlalchemy.orm import Session, ORMExecuteState, with_loader_criteria
+
+from ..Academico.alunomodels import Aluno, Matricula
+from ..Academico.academico import Turma, Sala, Bloco, HorarioAula, PresencaAula
+from ..instituicao.instituicao import Campus
+from ..pedagogico.pedagogico import ProfessorDisciplina, Nota
+from ..recursoshumanos.recursoshumanos import Funcionario, Professor
+from ..finanacas.financas import (
+    PlanoPagamento, ParcelaPropina, Pagamento, Caixa, Fornecedor, Produto, Venda,
+    MovimentoCaixa, ContratoFornecedor, PagamentoFornecedor, ItemVenda
+)
+
+
+CHAVE = 'instituicao_id'
+TODAS = 'todas_instituicoes'
+
+MODELOS_POR_INSTITUICAO = (
+    Campus, Aluno, Matricula, Turma, Professor, Funcionario,
+    PlanoPagamento, ParcelaPropina, Pagamento, Caixa, Fornecedor, Produto, Venda,
+)
+
+# Modelo dependente: (chave estrangeira, modelo pai com instituicao_id)
+MODELOS_POR_PAI = {
+    Sala: (Sala.campus_id, Campus),
+    Bloco: (Bloco.campus_id, Campus),
+    ProfessorDisciplina: (ProfessorDisciplina.professor_id, Professor),
+    HorarioAula: (HorarioAula.turma_id, Turma),
+    PresencaAula: (PresencaAula.aluno_id, Aluno),
+    Nota: (Nota.matricula_id, Matricula),
+    MovimentoCaixa: (MovimentoCaixa.caixa_id, Caixa),
+    ContratoFornecedor: (ContratoFornecedor.fornecedor_id, Fornecedor),
+    PagamentoFornecedor: (PagamentoFornecedor.fornecedor_id, Fornecedor),
+    ItemVenda: (ItemVenda.venda_id, Venda),
+}
+
+
+def definir_instituicao(session: Session, instituicao_id: Optional[int]):
+    """Limita a sessão a uma instituição (None remove o filtro)"""
+    if instituicao_id is None:
+        session.info.pop(CHAVE, None)
+    else:
+        session.info[CHAVE] = instituicao_id
+
+
+def instituicao_atual(session: Session) -> Optional[int]:
+    return session.info.get(CHAVE)
+
+
+def instituicao_do_usuario(session: Session, usuario) -> Optional[int]:
+    """
+    Instituição de um utilizador: `Usuario.instituicao_id` ou, sem ela, a do
+    funcionário/professor da mesma pessoa. None se não houver nenhuma ou se
+    a pessoa trabalhar em mais do que uma.
+    """
+    if usuario.instituicao_id is not None:
+        return usuario.instituicao_id
+    instituicoes = set()
+    for modelo in (Funcionario, Professor):
+        instituicoes.update(session.execute(
+            select(modelo.instituicao_id).where(modelo.pessoa_id == usuario.pessoa_id)
+            .execution_options(**{TODAS: True})
+        ).scalars())
+    return instituicoes.pop() if len(instituicoes) == 1 else None
+
+
+# ============================================================================
+# EVENTOS DA SESSÃO
+# ============================================================================
+
+def _filtrar(execucao: ORMExecuteState):
+    instituicao_id = execucao.session.info.get(CHAVE)
+    if instituicao_id is None or execucao.execution_options.get(TODAS, False):
+        return
+    if execucao.is_select:
+        # Carregamentos de colunas/relações herdam o critério da consulta original
+        if execucao.is_column_load or execucao.is_relationship_load:
+            return
+    elif not (execucao.is_update or execucao.is_delete):
+        return
+    execucao.statement = execucao.statement.options(*[
+        with_loader_criteria(modelo, lambda cls: cls.instituicao_id == instituicao_id, include_aliases=True)
+        for modelo in MODELOS_POR_INSTITUICAO
+    ], *[
+        with_loader_criteria(
+            modelo, chave.in_(select(pai.id).where(pai.instituicao_id == instituicao_id)),
+            include_aliases=True,
+        )
+        for modelo, (chave, pai) in MODELOS_POR_PAI.items()
+    ])
+
+
+def _preencher(session: Session, contexto, instancias):
+    instituicao_id = session.info.get(CHAVE)
+    if instituicao_id is None:
+        return
+    for obj in session.new:
+        if not isinstance(obj, MODELOS_POR_INSTITUICAO):
+            continue
+        if obj.instituicao_id is None:
+            obj.instituicao_id = instituicao_id
+        elif obj.instituicao_id != instituicao_id:
+            raise ValueError("Registo pertence a outra instituição")
+
+
+def instalar(alvo=Session):
+    """Regista o filtro e o preenchimento automáticos numa Session/sessionmaker"""
+    event.listen(alvo, 'do_orm_execute', _filtrar)
+    event.listen(alvo, 'before_flush', _preencher)
+
+
+# ============================================================================
+# MIGRAÇÃO DE BASES EXISTENTES
+# ============================================================================
+
+# Preenchimento de instituicao_id a partir de registos relacionados (por ordem)
+PREENCHIMENTO = [
+    ('turmas', "SELECT a.instituicao_id FROM anos_letivos a WHERE a.id = turmas.ano_letivo_id"),
+    ('planos_pagamento', "SELECT a.instituicao_id FROM anos_letivos a WHERE a.id = planos_pagamento.ano_letivo_id"),
+    ('matriculas', "SELECT a.instituicao_id FROM anos_letivos a WHERE a.id = matriculas.ano_letivo_id"),
+    ('parcelas_propina', "SELECT m.instituicao_id FROM matriculas m WHERE m.id = parcelas_propina.matricula_id"),
+    ('alunos', "SELECT m.instituicao_id FROM matriculas m WHERE m.aluno_id = alunos.id ORDER BY m.id DESC LIMIT 1"),
+    ('pagamentos', "SELECT al.instituicao_id FROM alunos al WHERE al.id = pagamentos.aluno_id"),
+    ('vendas', "SELECT al.instituicao_id FROM alunos al WHERE al.id = vendas.aluno_id"),
+]
+
+# Utilizadores: a instituição do funcionário/professor da mesma pessoa, quando única
+INSTITUICAO_USUARIOS = """
+UPDATE usuarios SET instituicao_id = (
+    SELECT CASE WHEN COUNT(DISTINCT p.instituicao_id) = 1 THEN MIN(p.instituicao_id) END
+    FROM (
+        SELECT instituicao_id, pessoa_id FROM funcionarios
+        UNION SELECT instituicao_id, pessoa_id FROM professores
+    ) p WHERE p.pessoa_id = usuarios.pessoa_id
+)
+WHERE instituicao_id IS NULL
+"""
+
+
+def preparar_instituicoes(conexao) -> dict:
+    """
+    Acrescenta instituicao_id às tabelas existentes que ainda não a têm e
+    preenche-a (relações e, no resto, a primeira instituição). Os índices
+    compostos ficam para o passo de índices de database.migracoes.
+    Devolve as tabelas alteradas.
+    """
+    inspector = inspect(conexao)
+    existentes = set(inspector.get_table_names())
+    alteradas = {}
+    for modelo in MODELOS_POR_INSTITUICAO:
+        tabela = modelo.__table__
+        if tabela.name not in existentes:
+            continue
+        if CHAVE not in {c['name'] for c in inspector.get_columns(tabela.name)}:
+            conexao.execute(text(
+                f"ALTER TABLE {tabela.name} ADD COLUMN instituicao_id INTEGER "
+                f"REFERENCES instituicoes (id) ON DELETE CASCADE"
+            ))
+            alteradas[tabela.name] = 0
+
+    if not alteradas:
+        return alteradas
+
+    for nome, origem in PREENCHIMENTO:
+        if nome in alteradas:
+            conexao.execute(text(
+                f"UPDATE {nome} SET instituicao_id = ({origem}) WHERE instituicao_id IS NULL"
+            ))
+    for nome in alteradas:
+        resultado = conexao.execute(text(
+            f"UPDATE {nome} SET instituicao_id = (SELECT MIN(id) FROM instituicoes) WHERE instituicao_id IS NULL"
+        ))
+        alteradas[nome] = resultado.rowcount
+
+    if conexao.dialect.name == 'postgresql':
+        for nome in alteradas:
+            sem_instituicao = conexao.execute(
+                text(f"SELECT 1 FROM {nome} WHERE instituicao_id IS NULL LIMIT 1")
+            ).first()
+            if sem_instituicao is None:
+                conexao.execute(text(f"ALTER TABLE {nome} ALTER COLUMN instituicao_id SET NOT NULL"))
+    return alteradas
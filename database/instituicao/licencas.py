@@ -0,0 +1,276 @@
+"""
+Aplicação dos limites de LicencaSoftware.
+
+Cada instituição tem a sua licença e os seus contadores de utilizadores,
+alunos e funcionários activos. São lidos uma vez (uma contagem agrupada
+por instituicao_id por recurso) e depois mantidos pelos eventos da
+sessão: as variações de cada flush ficam pendentes e só são aplicadas no
+commit (um rollback descarta-as). Uma reconciliação periódica volta a
+contar, corrigindo inserções feitas fora do ORM. As verificações são
+O(1): comparação do contador em memória com o limite da licença, feita no
+`before_flush` para os registos novos e reactivados.
+"""
+
+import threading
+from collections import namedtuple
+from datetime import date
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import select, func, event, inspect
+from sqlalchemy.orm import Session
+
+from .instituicao import LicencaSoftware
+from .escopo import TODAS, instituicao_atual
+from ..modelsGeral import Usuario
+from ..Academico.alunomodels import Aluno
+from ..recursoshumanos.recursoshumanos import Funcionario
+from ..enums import StatusAluno
+
+
+INTERVALO_RECONCILIACAO = 300   # segundos
+
+_CHAVE_VARIACOES = 'licenca_variacoes'
+
+
+class Recurso(namedtuple('Recurso', 'nome modelo atributo valor_ativo limite descricao')):
+    """Entidade limitada pela licença"""
+    __slots__ = ()
+
+    def ativo(self, obj) -> bool:
+        valor = getattr(obj, self.atributo)
+        if valor is None:
+            # Antes do flush os registos novos ainda não têm o valor por omissão da coluna
+            padrao = getattr(self.modelo, self.atributo).property.columns[0].default
+            if padrao is not None and padrao.is_scalar:
+                valor = padrao.arg
+        return valor == self.valor_ativo
+
+    def filtro(self):
+        return getattr(self.modelo, self.atributo) == self.valor_ativo
+
+    def instituicao(self, session: Session, obj) -> Optional[int]:
+        # Registos novos só recebem a instituição da sessão no before_flush do escopo
+        return getattr(obj, 'instituicao_id', None) or instituicao_atual(session)
+
+
+RECURSOS = {
+    r.nome: r for r in (
+        Recurso('usuarios', Usuario, 'ativo', True, 'max_usuarios', 'utilizadores'),
+        Recurso('alunos', Aluno, 'status', StatusAluno.ATIVO, 'max_alunos', 'alunos'),
+        Recurso('funcionarios', Funcionario, 'ativo', True, 'max_funcionarios', 'funcionários'),
+    )
+}
+_POR_MODELO = {r.modelo: r for r in RECURSOS.values()}
+
+
+class EstadoLicenca(namedtuple(
+        'EstadoLicenca', 'id codigo_licenca ativa data_expiracao max_usuarios max_alunos max_funcionarios modulos')):
+    """Instantâneo imutável da licença em vigor"""
+    __slots__ = ()
+
+    # Mesmas regras do modelo, sobre os valores em cache
+    dias_restantes = property(LicencaSoftware.dias_restantes.fget)
+    status_detalhado = property(LicencaSoftware.status_detalhado.fget)
+
+    @property
+    def valida(self) -> bool:
+        return self.ativa and date.today() <= self.data_expiracao
+
+
+class ServicoLicencas:
+    """Contadores em cache e verificações O(1) dos limites da licença"""
+
+    def __init__(self, fabrica_sessoes: Callable[[], Session],
+                 intervalo_reconciliacao: float = INTERVALO_RECONCILIACAO):
+        self.fabrica_sessoes = fabrica_sessoes
+        self.intervalo_reconciliacao = intervalo_reconciliacao
+        self._licencas: Dict[int, EstadoLicenca] = {}
+        self._contadores: Dict[Optional[int], Dict[str, int]] = {}
+        self._carregado = False
+        self._bloqueio = threading.RLock()
+        self._parar = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ========================================================================
+    # CARREGAMENTO E RECONCILIAÇÃO
+    # ========================================================================
+
+    def reconciliar(self) -> Dict[Optional[int], Dict[str, int]]:
+        """Relê as licenças em vigor e volta a contar os registos activos, por instituição"""
+        session = self.fabrica_sessoes()
+        try:
+            # A licença activa que expira mais tarde, em cada instituição
+            licencas = session.execute(
+                select(LicencaSoftware)
+                .where(LicencaSoftware.ativa.is_(True))
+                .order_by(LicencaSoftware.instituicao_id, LicencaSoftware.data_expiracao.desc())
+                .execution_options(**{TODAS: True})
+            ).scalars().all()
+            contadores: Dict[Optional[int], Dict[str, int]] = {}
+            for nome, r in RECURSOS.items():
+                instituicao = r.modelo.instituicao_id
+                for instituicao_id, total in session.execute(
+                    select(instituicao, func.count()).where(r.filtro()).group_by(instituicao)
+                    .execution_options(**{TODAS: True})
+                ):
+                    contadores.setdefault(instituicao_id, {})[nome] = total
+        finally:
+            session.close()
+
+        estados = {}
+        for licenca in licencas:
+            if licenca.instituicao_id in estados:
+                continue
+            estados[licenca.instituicao_id] = EstadoLicenca(
+                id=licenca.id, codigo_licenca=licenca.codigo_licenca, ativa=licenca.ativa,
+                data_expiracao=licenca.data_expiracao, max_usuarios=licenca.max_usuarios,
+                max_alunos=licenca.max_alunos, max_funcionarios=licenca.max_funcionarios,
+                # Lista vazia = todos os módulos
+                modulos=frozenset(licenca.modulos_ativos) if licenca.modulos_ativos else None,
+            )
+        with self._bloqueio:
+            self._licencas = estados
+            self._contadores = contadores
+            self._carregado = True
+        return {i: dict(c) for i, c in contadores.items()}
+
+    def _garantir(self):
+        if not self._carregado:
+            self.reconciliar()
+
+    def iniciar(self):
+        """Carrega e inicia a reconciliação periódica em segundo plano"""
+        self.reconciliar()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._ciclo, name='licencas', daemon=True)
+            self._thread.start()
+
+    def _ciclo(self):
+        while not self._parar.wait(self.intervalo_reconciliacao):
+            try:
+                self.reconciliar()
+            except Exception:
+                # Mantém os valores actuais até à próxima tentativa
+                pass
+
+    def parar(self):
+        self._parar.set()
+
+    # ========================================================================
+    # CONSULTAS O(1)
+    # ========================================================================
+
+    def estado(self, instituicao_id: Optional[int]) -> Optional[EstadoLicenca]:
+        self._garantir()
+        return self._licencas.get(instituicao_id)
+
+    def contador(self, recurso: str, instituicao_id: Optional[int]) -> int:
+        self._garantir()
+        return self._contadores.get(instituicao_id, {}).get(recurso, 0)
+
+    def disponiveis(self, recurso: str, instituicao_id: Optional[int]) -> Optional[int]:
+        """Vagas restantes (None = sem licença registada, sem limite)"""
+        licenca = self.estado(instituicao_id)
+        if licenca is None:
+            return None
+        limite = getattr(licenca, RECURSOS[recurso].limite)
+        if limite is None:
+            return None
+        return max(limite - self.contador(recurso, instituicao_id), 0)
+
+    def pode_criar(self, recurso: str, instituicao_id: Optional[int], quantidade: int = 1) -> bool:
+        licenca = self.estado(instituicao_id)
+        if licenca is None:
+            return True
+        if not licenca.valida:
+            return False
+        disponiveis = self.disponiveis(recurso, instituicao_id)
+        return disponiveis is None or quantidade <= disponiveis
+
+    def exigir(self, recurso: str, instituicao_id: Optional[int], quantidade: int = 1):
+        """Levanta ValueError se a licença da instituição não permitir criar `quantidade` registos"""
+        if self.pode_criar(recurso, instituicao_id, quantidade):
+            return
+        licenca = self._licencas[instituicao_id]
+        if not licenca.valida:
+            raise ValueError(f"Licença {licenca.status_detalhado.lower()}: não é possível criar {RECURSOS[recurso].descricao}")
+        raise ValueError(
+            f"Limite da licença atingido para {RECURSOS[recurso].descricao} "
+            f"({getattr(licenca, RECURSOS[recurso].limite)})"
+        )
+
+    def registar(self, session: Session, recurso: str, instituicao_id: Optional[int], quantidade: int):
+        """Conta registos activos inseridos fora do ORM (aplicado no commit da sessão)"""
+        variacoes = session.info.setdefault(_CHAVE_VARIACOES, {})
+        chave = (instituicao_id, recurso)
+        variacoes[chave] = variacoes.get(chave, 0) + quantidade
+
+    def modulo_ativo(self, modulo: str, instituicao_id: Optional[int]) -> bool:
+        licenca = self.estado(instituicao_id)
+        if licenca is None or licenca.modulos is None:
+            return True
+        return licenca.valida and modulo in licenca.modulos
+
+    # ========================================================================
+    # EVENTOS DA SESSÃO
+    # ========================================================================
+
+    def instalar(self, alvo=Session):
+        """Regista a verificação e a manutenção dos contadores numa Session/sessionmaker"""
+        event.listen(alvo, 'before_flush', self._antes_flush)
+        event.listen(alvo, 'after_flush', self._apos_flush)
+        event.listen(alvo, 'after_commit', self._apos_commit)
+        event.listen(alvo, 'after_rollback', self._apos_rollback)
+
+    def _variacoes(self, session: Session) -> Dict[tuple, int]:
+        """Variação dos activos, por (instituição, recurso), dos registos pendentes"""
+        variacoes: Dict[tuple, int] = {}
+
+        def somar(recurso, obj, n):
+            chave = (recurso.instituicao(session, obj), recurso.nome)
+            variacoes[chave] = variacoes.get(chave, 0) + n
+
+        for obj in session.new:
+            recurso = _POR_MODELO.get(type(obj))
+            if recurso is not None and recurso.ativo(obj):
+                somar(recurso, obj, 1)
+        for obj in session.deleted:
+            recurso = _POR_MODELO.get(type(obj))
+            if recurso is not None and recurso.ativo(obj):
+                somar(recurso, obj, -1)
+        for obj in session.dirty:
+            recurso = _POR_MODELO.get(type(obj))
+            if recurso is None:
+                continue
+            # Reactivações (ex.: aluno INATIVO -> ATIVO) ocupam uma vaga
+            historico = inspect(obj).attrs[recurso.atributo].history
+            if historico.deleted and historico.added:
+                antes = historico.deleted[0] == recurso.valor_ativo
+                depois = historico.added[0] == recurso.valor_ativo
+                if antes != depois:
+                    somar(recurso, obj, 1 if depois else -1)
+        return variacoes
+
+    def _antes_flush(self, session: Session, contexto, instancias):
+        pendentes = session.info.get(_CHAVE_VARIACOES, {})
+        for (instituicao_id, nome), quantidade in self._variacoes(session).items():
+            if quantidade > 0:
+                self.exigir(nome, instituicao_id, quantidade + max(pendentes.get((instituicao_id, nome), 0), 0))
+
+    def _apos_flush(self, session: Session, contexto):
+        # Em after_flush new/dirty/deleted ainda descrevem o estado anterior ao flush
+        variacoes = session.info.setdefault(_CHAVE_VARIACOES, {})
+        for chave, n in self._variacoes(session).items():
+            variacoes[chave] = variacoes.get(chave, 0) + n
+
+    def _apos_commit(self, session: Session):
+        variacoes = session.info.pop(_CHAVE_VARIACOES, None)
+        if not variacoes or not self._carregado:
+            return
+        with self._bloqueio:
+            for (instituicao_id, nome), n in variacoes.items():
+                contadores = self._contadores.setdefault(instituicao_id, {})
+                contadores[nome] = max(contadores.get(nome, 0) + n, 0)
+
+    def _apos_rollback(self, session: Session):
+        session.info.pop(_CHAVE_VARIACOES, None)
@@ -0,0 +1,549 @@
+"""
+Criação e actualização do esquema (o motor por trás de `create_schemas`).
+
+Os passos correm por ordem de dependência e cada um é idempotente:
+
+1. extensões do PostgreSQL (pg_trgm, btree_gist);
+2. tabelas em falta (`create_all`, sem as views mapeadas);
+3. colunas em falta nas tabelas existentes (`ALTER TABLE ... ADD COLUMN`),
+   com o preenchimento dos contadores de faltas e de `saldo_apos`;
+4. coluna instituicao_id nas bases antigas e dados derivados;
+5. logs_sistema existente convertida em tabela particionada (PostgreSQL);
+6. sequências alinhadas com o maior id (após importações com id explícito);
+7. restrições de exclusão dos horários;
+8. índices em falta, incluindo os parciais e os de pesquisa; no PostgreSQL
+   com `CREATE INDEX CONCURRENTLY`, fora de transacção, para não bloquear
+   escritas durante o dia lectivo;
+9. triggers de data_atualizacao;
+10. views (ViewAlunosAtivos, ViewFinanceiroMensal).
+
+Os passos com versão só voltam a correr quando a versão sobe; o registo
+fica na tabela versoes_esquema. Cada execução devolve o tempo por passo.
+
+Uso: python -m database.migracoes
+"""
+
+import re
+import time
+from collections import namedtuple
+from datetime import datetime
+from typing import List
+
+from sqlalchemy import (
+    MetaData, Table, Column, Integer, String, DateTime, Numeric, Enum,
+    select, insert, update, func, case, and_, or_, extract, text, inspect, literal
+)
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.schema import CreateIndex
+
+from .base_database import Base
+from .modelsGeral import LogSistema, ViewAlunosAtivos, ViewFinanceiroMensal, PARTICIONAMENTO_LOGS
+from .Academico.academico import Turma, Classe, AnoLetivo, RESTRICOES_EXCLUSAO_HORARIO
+from .Academico.transicao_ano import desativar_horarios_anos
+from .Academico.presencas import recalcular_contadores
+from .Academico.alunomodels import Aluno, Matricula, EncarregadoEducacao, INDICES_PESQUISA_ALUNO
+from .recursoshumanos.recursoshumanos import (
+    Pessoa, TelefonePessoa, INDICES_PESQUISA_PESSOA, INDICES_PESQUISA_TELEFONE
+)
+from .recursoshumanos.pesquisa import preencher_nome_pesquisa
+from .finanacas.financas import ParcelaPropina
+from .finanacas.caixa import preencher_saldo_apos
+from .instituicao.escopo import preparar_instituicoes, MODELOS_POR_INSTITUICAO, CHAVE, INSTITUICAO_USUARIOS
+from .enums import StatusAluno, StatusPagamento
+
+
+_META = MetaData()
+
+VERSOES = Table(
+    'versoes_esquema', _META,
+    Column('passo', String(50), primary_key=True),
+    Column('versao', Integer, nullable=False),
+    Column('aplicado_em', DateTime, nullable=False),
+    Column('duracao_ms', Numeric(12, 2)),
+)
+
+# Índices de pesquisa do PostgreSQL que só existem como DDL
+DDL_INDICES = INDICES_PESQUISA_PESSOA + INDICES_PESQUISA_TELEFONE + INDICES_PESQUISA_ALUNO
+
+STATUS_EM_ABERTO = (StatusPagamento.PENDENTE, StatusPagamento.PAGO_PARCIAL, StatusPagamento.ATRASADO)
+
+MESES = ['Janeiro', 'Fevereiro', 'Março', 'Abril', 'Maio', 'Junho', 'Julho',
+         'Agosto', 'Setembro', 'Outubro', 'Novembro', 'Dezembro']
+
+
+class Passo(namedtuple('Passo', 'nome executar versao transacional')):
+    """Passo da migração: `executar(conexao)` devolve um resumo do que fez"""
+    __slots__ = ()
+
+    def __new__(cls, nome, executar, versao=None, transacional=True):
+        return super().__new__(cls, nome, executar, versao, transacional)
+
+
+PassoExecutado = namedtuple('PassoExecutado', 'nome estado segundos detalhe')
+
+
+def _postgresql(conexao) -> bool:
+    return conexao.dialect.name == 'postgresql'
+
+
+def _sql(ddl) -> str:
+    return str(ddl.statement).strip()
+
+
+def _tabelas():
+    return [t for t in Base.metadata.sorted_tables if not t.info.get('is_view')]
+
+
+# ============================================================================
+# PASSOS
+# ============================================================================
+
+def criar_extensoes(conexao):
+    if not _postgresql(conexao):
+        return None
+    extensoes = {_sql(d) for d in DDL_INDICES + RESTRICOES_EXCLUSAO_HORARIO
+                 if _sql(d).upper().startswith('CREATE EXTENSION')}
+    for sql in sorted(extensoes):
+        conexao.exec_driver_sql(sql)
+    return f"{len(extensoes)} extensões"
+
+
+def criar_tabelas(conexao):
+    existentes = set(inspect(conexao).get_table_names())
+    novas = [t for t in _tabelas() if t.name not in existentes]
+    # Os DDL 'after_create' (partições, restrições, índices) correm com as tabelas novas
+    Base.metadata.create_all(conexao, tables=novas)
+    return f"{len(novas)} tabelas criadas"
+
+
+def _definicao_coluna(conexao, coluna) -> str:
+    dialeto = conexao.dialect
+    if isinstance(coluna.type, Enum) and _postgresql(conexao):
+        coluna.type.create(conexao, checkfirst=True)
+    sql = f"{coluna.name} {coluna.type.compile(dialect=dialeto)}"
+    padrao = coluna.default.arg if coluna.default is not None and coluna.default.is_scalar else None
+    if padrao is not None:
+        valor = literal(padrao, coluna.type).compile(dialect=dialeto, compile_kwargs={'literal_binds': True})
+        sql += f" DEFAULT {valor}"
+        # Sem valor por omissão as linhas existentes ficariam a NULL
+        if not coluna.nullable:
+            sql += " NOT NULL"
+    chaves = list(coluna.foreign_keys)
+    if len(chaves) == 1:
+        referida = chaves[0].column
+        sql += f" REFERENCES {referida.table.name} ({referida.name})"
+        if chaves[0].ondelete:
+            sql += f" ON DELETE {chaves[0].ondelete}"
+    return sql
+
+
+def _preencher_faltas(conexao):
+    session = Session(bind=conexao)
+    anos = session.execute(select(Matricula.ano_letivo_id).distinct()).scalars().all()
+    return sum(recalcular_contadores(session, ano_letivo_id) for ano_letivo_id in anos)
+
+
+def _preencher_saldos(conexao):
+    session = Session(bind=conexao)
+    return preencher_saldo_apos(session)
+
+
+def _preencher_instituicao_usuarios(conexao):
+    return conexao.execute(text(INSTITUICAO_USUARIOS)).rowcount
+
+
+# Preenchimento das colunas acrescentadas a tabelas que já tinham dados
+PREENCHIMENTO_COLUNAS = {
+    ('matriculas', 'faltas_injustificadas'): _preencher_faltas,
+    ('matriculas', 'faltas_justificadas'): _preencher_faltas,
+    ('movimentos_caixa', 'saldo_apos'): _preencher_saldos,
+    ('usuarios', 'instituicao_id'): _preencher_instituicao_usuarios,
+}
+
+
+def criar_colunas(conexao):
+    """Acrescenta às tabelas existentes as colunas do modelo que lhes faltam"""
+    inspector = inspect(conexao)
+    existentes = set(inspector.get_table_names())
+    # instituicao_id é acrescentada (e preenchida) por preparar_instituicoes
+    por_instituicao = {m.__table__.name for m in MODELOS_POR_INSTITUICAO}
+    acrescentadas = []
+    for tabela in _tabelas():
+        if tabela.name not in existentes:
+            continue
+        colunas = {c['name'] for c in inspector.get_columns(tabela.name)}
+        for coluna in tabela.columns:
+            if coluna.name in colunas or (coluna.name == CHAVE and tabela.name in por_instituicao):
+                continue
+            conexao.exec_driver_sql(f"ALTER TABLE {tabela.name} ADD COLUMN {_definicao_coluna(conexao, coluna)}")
+            acrescentadas.append((tabela.name, coluna.name))
+
+    preenchidas = []
+    for preencher in dict.fromkeys(PREENCHIMENTO_COLUNAS[c] for c in acrescentadas if c in PREENCHIMENTO_COLUNAS):
+        preenchidas.append(f"{preencher.__name__.lstrip('_')}: {preencher(conexao)}")
+    detalhe = f"{len(acrescentadas)} colunas acrescentadas"
+    return f"{detalhe} ({', '.join(preenchidas)})" if preenchidas else detalhe
+
+
+def preparar_dados(conexao):
+    alteradas = preparar_instituicoes(conexao)
+    session = Session(bind=conexao)
+    nomes = preencher_nome_pesquisa(session)
+    # Horários de anos já encerrados (transições anteriores não os desactivavam)
+    horarios = conexao.execute(desativar_horarios_anos(
+        select(Turma.id).join(AnoLetivo, AnoLetivo.id == Turma.ano_letivo_id).where(AnoLetivo.concluido == True)
+    )).rowcount
+    return (f"instituicao_id em {len(alteradas)} tabelas, nome_pesquisa em {nomes} pessoas, "
+            f"{horarios} horários de anos encerrados desactivados")
+
+
+def particionar_logs(conexao):
+    """Converte uma logs_sistema simples (anterior ao particionamento) em
+    tabela particionada, com uma partição por cada mês do histórico"""
+    if not _postgresql(conexao):
+        return None
+    tipo = conexao.exec_driver_sql(
+        "SELECT relkind FROM pg_class WHERE relname = 'logs_sistema' AND relnamespace = current_schema()::regnamespace"
+    ).scalar()
+    if tipo != 'r':
+        return "já particionada" if tipo == 'p' else None
+
+    antiga = 'logs_sistema_antiga'
+    sequencia = conexao.exec_driver_sql("SELECT pg_get_serial_sequence('logs_sistema', 'id')").scalar()
+    conexao.exec_driver_sql(f"ALTER TABLE logs_sistema RENAME TO {antiga}")
+    # Os nomes dos índices são globais: libertam-se para a tabela nova
+    conexao.exec_driver_sql(f"ALTER INDEX IF EXISTS logs_sistema_pkey RENAME TO {antiga}_pkey")
+    for indice in LogSistema.__table__.indexes:
+        conexao.exec_driver_sql(f"DROP INDEX IF EXISTS {indice.name}")
+
+    ddl = [_sql(d) for d in PARTICIONAMENTO_LOGS]
+    criar = next(sql for sql in ddl if sql.startswith('CREATE TABLE logs_sistema ('))
+    conexao.exec_driver_sql(criar.replace('logs_sistema_modelo', antiga))
+    if sequencia:
+        conexao.exec_driver_sql(f"ALTER SEQUENCE {sequencia} OWNED BY logs_sistema.id")
+    for sql in ddl:
+        if sql.startswith('CREATE TABLE logs_sistema_padrao') or sql.startswith('CREATE INDEX'):
+            conexao.exec_driver_sql(sql)
+
+    meses = conexao.exec_driver_sql(
+        f"SELECT DISTINCT date_trunc('month', data_log) FROM {antiga} ORDER BY 1"
+    ).scalars().all()
+    for inicio in meses:
+        fim = datetime(inicio.year + inicio.month // 12, inicio.month % 12 + 1, 1)
+        conexao.exec_driver_sql(
+            f"CREATE TABLE logs_sistema_{inicio:%Y%m} PARTITION OF logs_sistema "
+            f"FOR VALUES FROM ('{inicio.isoformat()}') TO ('{fim.isoformat()}')"
+        )
+    colunas = ', '.join(c.name for c in LogSistema.__table__.columns)
+    copiadas = conexao.exec_driver_sql(
+        f"INSERT INTO logs_sistema ({colunas}) SELECT {colunas} FROM {antiga}"
+    ).rowcount
+    conexao.exec_driver_sql(f"DROP TABLE {antiga}")
+    return f"{copiadas} registos em {len(meses)} partições mensais"
+
+
+def alinhar_sequencias(conexao):
+    """Garante que o próximo id de cada sequência fica acima do maior id gravado"""
+    if not _postgresql(conexao):
+        return None
+    alinhadas = 0
+    for tabela in _tabelas():
+        if 'id' not in tabela.c or not tabela.c.id.autoincrement:
+            continue
+        sequencia = conexao.execute(
+            text("SELECT pg_get_serial_sequence(:tabela, 'id')"), {'tabela': tabela.name}
+        ).scalar()
+        if sequencia is None:
+            continue
+        maior = conexao.execute(select(func.max(tabela.c.id))).scalar()
+        ultimo = conexao.exec_driver_sql(f"SELECT last_value FROM {sequencia}").scalar()
+        if maior is not None and maior >= ultimo:
+            conexao.execute(text("SELECT setval(:sequencia, :valor)"), {'sequencia': sequencia, 'valor': maior})
+            alinhadas += 1
+    return f"{alinhadas} sequências alinhadas"
+
+
+def criar_restricoes(conexao):
+    if not _postgresql(conexao):
+        return None
+    existentes = set(conexao.exec_driver_sql("SELECT conname FROM pg_constraint").scalars())
+    criadas = 0
+    for ddl in RESTRICOES_EXCLUSAO_HORARIO:
+        nome = re.search(r'ADD CONSTRAINT (\w+)', _sql(ddl))
+        if nome and nome.group(1) not in existentes:
+            conexao.exec_driver_sql(_sql(ddl))
+            criadas += 1
+    return f"{criadas} restrições criadas"
+
+
+def _concorrente(sql: str) -> str:
+    return re.sub(r'^CREATE (UNIQUE )?INDEX (IF NOT EXISTS )?',
+                  r'CREATE \1INDEX CONCURRENTLY IF NOT EXISTS ', sql, count=1, flags=re.IGNORECASE)
+
+
+def criar_indices(conexao):
+    """Cria os índices do modelo e dos DDL de pesquisa que ainda não existem"""
+    if not _postgresql(conexao):
+        inspector = inspect(conexao)
+        criados = 0
+        for tabela in _tabelas():
+            existentes = {i['name'] for i in inspector.get_indexes(tabela.name)}
+            for indice in tabela.indexes:
+                if indice.name not in existentes:
+                    indice.create(conexao)
+                    criados += 1
+        return f"{criados} índices criados"
+
+    # Uma construção concorrente interrompida deixa o índice inválido: recomeça
+    invalidos = conexao.exec_driver_sql(
+        "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE NOT i.indisvalid"
+    ).scalars().all()
+    for nome in invalidos:
+        conexao.exec_driver_sql(f"DROP INDEX CONCURRENTLY IF EXISTS {nome}")
+
+    existentes = set(conexao.exec_driver_sql(
+        "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema()"
+    ).scalars())
+    # CONCURRENTLY não é suportado em tabelas particionadas (logs_sistema)
+    particionadas = set(conexao.exec_driver_sql("SELECT relname FROM pg_class WHERE relkind = 'p'").scalars())
+
+    instrucoes = []
+    for tabela in _tabelas():
+        for indice in tabela.indexes:
+            if indice.name in existentes:
+                continue
+            sql = str(CreateIndex(indice).compile(dialect=conexao.dialect))
+            if tabela.name in particionadas:
+                sql = re.sub(r'^CREATE (UNIQUE )?INDEX ', r'CREATE \1INDEX IF NOT EXISTS ', sql, count=1)
+            else:
+                sql = _concorrente(sql)
+            instrucoes.append(sql)
+    for ddl in DDL_INDICES:
+        nome = re.search(r'INDEX (?:IF NOT EXISTS )?(\w+)', _sql(ddl))
+        if nome and nome.group(1) not in existentes:
+            instrucoes.append(_concorrente(_sql(ddl)))
+
+    for sql in instrucoes:
+        conexao.exec_driver_sql(sql)
+    return f"{len(instrucoes)} índices criados, {len(invalidos)} inválidos reconstruídos"
+
+
+FUNCAO_DATA_ATUALIZACAO = """
+    CREATE OR REPLACE FUNCTION atualizar_data_atualizacao() RETURNS trigger AS $$
+    BEGIN
+        IF NEW.data_atualizacao IS NOT DISTINCT FROM OLD.data_atualizacao THEN
+            NEW.data_atualizacao := timezone('utc', now());
+        END IF;
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+"""
+
+
+def criar_triggers(conexao):
+    """data_atualizacao também muda em UPDATEs feitos fora do ORM (invalida caches)"""
+    tabelas = [t for t in _tabelas() if 'data_atualizacao' in t.c and 'id' in t.c]
+    if _postgresql(conexao):
+        conexao.exec_driver_sql(FUNCAO_DATA_ATUALIZACAO)
+    for tabela in tabelas:
+        nome = f"trg_{tabela.name}_data_atualizacao"
+        if _postgresql(conexao):
+            conexao.exec_driver_sql(f"DROP TRIGGER IF EXISTS {nome} ON {tabela.name}")
+            conexao.exec_driver_sql(
+                f"CREATE TRIGGER {nome} BEFORE UPDATE ON {tabela.name} "
+                f"FOR EACH ROW EXECUTE FUNCTION atualizar_data_atualizacao()"
+            )
+        else:
+            conexao.exec_driver_sql(
+                f"CREATE TRIGGER IF NOT EXISTS {nome} AFTER UPDATE ON {tabela.name} "
+                f"FOR EACH ROW WHEN NEW.data_atualizacao IS OLD.data_atualizacao "
+                f"BEGIN UPDATE {tabela.name} SET data_atualizacao = CURRENT_TIMESTAMP WHERE id = NEW.id; END"
+            )
+    return f"{len(tabelas)} triggers"
+
+
+# ============================================================================
+# VIEWS
+# ============================================================================
+
+def _idade(data_nascimento):
+    hoje = func.current_date()
+    antes_aniversario = or_(
+        extract('month', hoje) < extract('month', data_nascimento),
+        and_(extract('month', hoje) == extract('month', data_nascimento),
+             extract('day', hoje) < extract('day', data_nascimento)),
+    )
+    return extract('year', hoje) - extract('year', data_nascimento) - case((antes_aniversario, 1), else_=0)
+
+
+def consulta_alunos_ativos():
+    """Alunos activos com a matrícula em curso, o encarregado principal e a dívida vencida"""
+    encarregado = aliased(Pessoa)
+    outra = aliased(Matricula)
+    matricula_atual = (
+        select(func.max(outra.id))
+        .where(outra.aluno_id == Aluno.id, outra.ativa.is_(True))
+        .scalar_subquery()
+    )
+    encarregado_id = (
+        select(EncarregadoEducacao.pessoa_id)
+        .where(EncarregadoEducacao.aluno_id == Aluno.id)
+        .order_by(EncarregadoEducacao.principal.desc(), EncarregadoEducacao.id)
+        .limit(1)
+        .scalar_subquery()
+    )
+    telefone = (
+        select(TelefonePessoa.numero)
+        .where(TelefonePessoa.pessoa_id == encarregado.id)
+        .order_by(TelefonePessoa.principal.desc(), TelefonePessoa.id)
+        .limit(1)
+        .scalar_subquery()
+    )
+    vencidas = and_(
+        ParcelaPropina.matricula_id == Matricula.id,
+        ParcelaPropina.status.in_(STATUS_EM_ABERTO),
+        ParcelaPropina.data_vencimento < func.current_date(),
+    )
+    meses_atraso = select(func.count(ParcelaPropina.id)).where(vencidas).scalar_subquery()
+    valor_devido = select(
+        func.coalesce(func.sum(ParcelaPropina.valor_com_desconto - ParcelaPropina.valor_pago), 0)
+    ).where(vencidas).scalar_subquery()
+
+    return (
+        select(
+            Aluno.id.label('aluno_id'),
+            Aluno.codigo_aluno,
+            Pessoa.nome_completo,
+            Pessoa.data_nascimento,
+            _idade(Pessoa.data_nascimento).label('idade'),
+            Pessoa.genero,
+            Turma.nome.label('turma_atual'),
+            Classe.nome.label('classe_atual'),
+            Turma.turno,
+            encarregado.nome_completo.label('encarregado_principal'),
+            telefone.label('telefone_encarregado'),
+            case((meses_atraso > 0, 'EM_ATRASO'), else_='EM_DIA').label('status_pagamento'),
+            meses_atraso.label('meses_atraso'),
+            valor_devido.label('valor_devido'),
+        )
+        .join(Pessoa, Pessoa.id == Aluno.pessoa_id)
+        .join(Matricula, Matricula.id == matricula_atual)
+        .join(Turma, Turma.id == Matricula.turma_id)
+        .join(Classe, Classe.id == Turma.classe_id)
+        .outerjoin(encarregado, encarregado.id == encarregado_id)
+        .where(Aluno.status == StatusAluno.ATIVO)
+    )
+
+
+def consulta_financeiro_mensal():
+    """Previsto, recebido e inadimplência por mês de referência das parcelas"""
+    em_falta = ParcelaPropina.valor_com_desconto - ParcelaPropina.valor_pago
+    vencida = and_(ParcelaPropina.status.in_(STATUS_EM_ABERTO),
+                   ParcelaPropina.data_vencimento < func.current_date())
+    previsto = func.sum(ParcelaPropina.valor_com_desconto)
+    recebido = func.sum(ParcelaPropina.valor_pago)
+    mes = ParcelaPropina.mes_referencia
+
+    return (
+        select(
+            (ParcelaPropina.ano_referencia * 100 + mes).label('id'),
+            ParcelaPropina.ano_referencia.label('ano'),
+            mes.label('mes'),
+            case(*[(mes == n, nome) for n, nome in enumerate(MESES, 1)]).label('mes_nome'),
+            previsto.label('total_previsto'),
+            recebido.label('total_recebido'),
+            (previsto - recebido).label('total_pendente'),
+            func.round(
+                100 * func.sum(case((vencida, em_falta), else_=0)) / func.nullif(previsto, 0), 2
+            ).label('inadimplencia_percentual'),
+            func.coalesce(func.sum(ParcelaPropina.desconto_valor), 0).label('total_descontos'),
+            func.coalesce(func.sum(ParcelaPropina.juros_mora + ParcelaPropina.multa_atraso), 0).label('total_juros'),
+            func.count(func.distinct(Matricula.aluno_id)).label('alunos_ativos'),
+            func.count(func.distinct(case((vencida, Matricula.aluno_id)))).label('alunos_inadimplentes'),
+        )
+        .join(Matricula, Matricula.id == ParcelaPropina.matricula_id)
+        .where(ParcelaPropina.status != StatusPagamento.CANCELADO)
+        .group_by(ParcelaPropina.ano_referencia, mes)
+    )
+
+
+VIEWS = [
+    (ViewAlunosAtivos, consulta_alunos_ativos),
+    (ViewFinanceiroMensal, consulta_financeiro_mensal),
+]
+
+
+def criar_views(conexao):
+    inspector = inspect(conexao)
+    tabelas = set(inspector.get_table_names())
+    for modelo, consulta in VIEWS:
+        nome = modelo.__tablename__
+        if nome in tabelas:
+            # Versões anteriores criavam as views como tabelas vazias
+            if conexao.exec_driver_sql(f"SELECT 1 FROM {nome} LIMIT 1").first() is not None:
+                raise ValueError(f"A tabela {nome} tem dados e não pode ser substituída pela view")
+            conexao.exec_driver_sql(f"DROP TABLE {nome}")
+        sql = consulta().compile(dialect=conexao.dialect, compile_kwargs={'literal_binds': True})
+        conexao.exec_driver_sql(f"DROP VIEW IF EXISTS {nome}")
+        conexao.exec_driver_sql(f"CREATE VIEW {nome} AS {sql}")
+    return f"{len(VIEWS)} views"
+
+
+# Ordem de dependência; subir a versão de um passo volta a aplicá-lo
+PASSOS = [
+    Passo('extensoes', criar_extensoes),
+    Passo('tabelas', criar_tabelas),
+    Passo('colunas', criar_colunas),
+    Passo('dados', preparar_dados, versao=2),
+    Passo('particoes_logs', particionar_logs, versao=1),
+    Passo('sequencias', alinhar_sequencias),
+    Passo('restricoes', criar_restricoes),
+    Passo('indices', criar_indices, transacional=False),
+    Passo('triggers', criar_triggers, versao=1),
+    Passo('views', criar_views, versao=1),
+]
+
+
+# ============================================================================
+# EXECUÇÃO
+# ============================================================================
+
+def migrar(engine, passos: List[Passo] = PASSOS) -> List[PassoExecutado]:
+    """Aplica os passos pendentes e devolve o tempo gasto em cada um"""
+    _META.create_all(engine)
+    with engine.connect() as conexao:
+        aplicadas = dict(conexao.execute(select(VERSOES.c.passo, VERSOES.c.versao)).tuples())
+
+    relatorio = []
+    for passo in passos:
+        if passo.versao is not None and aplicadas.get(passo.nome, 0) >= passo.versao:
+            relatorio.append(PassoExecutado(passo.nome, 'em dia', 0.0, None))
+            continue
+
+        inicio = time.perf_counter()
+        if passo.transacional or engine.dialect.name != 'postgresql':
+            with engine.begin() as conexao:
+                detalhe = passo.executar(conexao)
+        else:
+            with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conexao:
+                detalhe = passo.executar(conexao)
+        segundos = time.perf_counter() - inicio
+
+        if passo.versao is not None:
+            with engine.begin() as conexao:
+                valores = {'versao': passo.versao, 'aplicado_em': datetime.utcnow(),
+                           'duracao_ms': round(segundos * 1000, 2)}
+                if passo.nome in aplicadas:
+                    conexao.execute(update(VERSOES).where(VERSOES.c.passo == passo.nome).values(**valores))
+                else:
+                    conexao.execute(insert(VERSOES).values(passo=passo.nome, **valores))
+        relatorio.append(PassoExecutado(passo.nome, 'ignorado' if detalhe is None else 'aplicado',
+                                        round(segundos, 3), detalhe))
+    return relatorio
+
+
+if __name__ == '__main__':
+    from .db import engine
+
+    for executado in migrar(engine):
+        print(f"{executado.nome:>12}: {executado.estado:<9} {executado.segundos:>8.3f}s  {executado.detalhe or ''}")
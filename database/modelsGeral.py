@@ -337,6 +337,8 @@ class Usuario(Base):
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     pessoa_id = Column(Integer, ForeignKey('pessoas.id', ondelete='CASCADE'), nullable=False)
+    # Instituição em que o utilizador trabalha (sem ela, a do funcionário/professor)
+    instituicao_id = Column(Integer, ForeignKey('instituicoes.id', ondelete='CASCADE'))
     
     # Credenciais
     username = Column(String(50), unique=True, nullable=False)
@@ -384,18 +386,20 @@ class Usuario(Base):
         Index('idx_usuario_nivel', 'nivel_acesso'),
     )
     
+    @staticmethod
+    def verificar_hash(senha: str, senha_hash: str, salt: str) -> bool:
+        """Compara a senha com um hash gravado (sem carregar o objecto)"""
+        from .senhas import verificar
+        return verificar(senha, senha_hash, salt)
+    
     def verificar_senha(self, senha: str) -> bool:
         """Verifica se a senha está correta"""
-        import hashlib
-        senha_hash = hashlib.sha256((senha + self.salt).encode()).hexdigest()
-        return senha_hash == self.senha_hash
+        return Usuario.verificar_hash(senha, self.senha_hash, self.salt)
     
     def atualizar_senha(self, nova_senha: str):
         """Atualiza a senha do usuário"""
-        import hashlib
-        import secrets
-        self.salt = secrets.token_hex(16)
-        self.senha_hash = hashlib.sha256((nova_senha + self.salt).encode()).hexdigest()
+        from .senhas import gerar_hash
+        self.senha_hash, self.salt = gerar_hash(nova_senha)
         self.data_ultima_troca_senha = datetime.utcnow()
         self.tentativas_login_falhas = 0
         self.data_bloqueio = None
@@ -472,8 +476,36 @@ class LogSistema(Base):
         Index('idx_log_acao', 'acao'),
         Index('idx_log_modulo', 'modulo'),
         Index('idx_log_data', 'data_log'),
+        Index('idx_log_data_id', 'data_log', 'id'),
+        # SQLite: ids nunca reutilizados depois de a tabela ser esvaziada por `rodar`
+        {'sqlite_autoincrement': True},
     )
 
+# PostgreSQL: logs_sistema passa a tabela particionada por mês em data_log.
+# A chave primária inclui data_log (exigência das partições); as partições
+# mensais são criadas por database.arquivo_logs.garantir_particoes.
+PARTICIONAMENTO_LOGS = [
+    DDL("ALTER TABLE logs_sistema RENAME TO logs_sistema_modelo"),
+    DDL("""
+        CREATE TABLE logs_sistema (
+            LIKE logs_sistema_modelo INCLUDING DEFAULTS,
+            PRIMARY KEY (id, data_log),
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
+        ) PARTITION BY RANGE (data_log)
+    """),
+    DDL("ALTER SEQUENCE logs_sistema_id_seq OWNED BY logs_sistema.id"),
+    DDL("DROP TABLE logs_sistema_modelo"),
+    DDL("CREATE TABLE logs_sistema_padrao PARTITION OF logs_sistema DEFAULT"),
+    DDL("CREATE INDEX idx_log_usuario ON logs_sistema (usuario_id)"),
+    DDL("CREATE INDEX idx_log_acao ON logs_sistema (acao)"),
+    DDL("CREATE INDEX idx_log_modulo ON logs_sistema (modulo)"),
+    DDL("CREATE INDEX idx_log_data ON logs_sistema (data_log)"),
+    DDL("CREATE INDEX idx_log_data_id ON logs_sistema (data_log, id)"),
+]
+
+for _ddl in PARTICIONAMENTO_LOGS:
+    event.listen(LogSistema.__table__, 'after_create', _ddl.execute_if(dialect='postgresql'))
+
 # ============================================================================
 # VIEWS E FUNÇÕES AUXILIARES
 # ============================================================================
@@ -0,0 +1,325 @@
+"""
+Emissão de boletins e certificados em lote.
+
+Os documentos são gerados a partir de modelos HTML (`string.Template`) e
+convertidos em PDF com `QTextDocument` / `QPdfWriter` em vários processos
+(`ProcessPoolExecutor`). Cada processo carrega uma única vez os recursos
+estáticos da instituição (logótipo, carimbo, assinatura do director).
+
+Cada PDF é escrito num ficheiro temporário e renomeado no fim, e o
+`DocumentoAluno` correspondente (com o SHA-256 em `arquivo_hash`) é gravado
+em lotes à medida que os trabalhos terminam. Ao relançar a emissão, os
+documentos já registados cujo ficheiro continua íntegro são saltados.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+from html import escape
+from string import Template
+from typing import Dict, List, Optional, Any, Tuple
+
+from sqlalchemy import select, func, update
+from sqlalchemy.orm import Session
+
+from .pedagogico import Nota
+from ..Academico.academico import AnoLetivo, Turma, Disciplina
+from ..Academico.alunomodels import Aluno, Matricula
+from ..instituicao.instituicao import Instituicao
+from ..recursoshumanos.recursoshumanos import Pessoa
+from ..modelsGeral import HistoricoAcademico, DocumentoAluno
+from ..enums import ResultadoAvaliacao
+from .integridade import hash_arquivo
+
+
+LOTE_GRAVACAO = 200
+
+RECURSOS = {
+    'logo': 'logo_path',
+    'carimbo': 'carimbo_path',
+    'assinatura': 'assinatura_diretor_path',
+}
+
+MODELOS = {
+    'boletim': Template("""
+<table width="100%"><tr>
+  <td width="80"><img src="recurso://logo" width="70"></td>
+  <td align="center"><h2>$instituicao</h2><h3>Boletim de Notas - Ano Letivo $ano_letivo</h3></td>
+</tr></table>
+<p><b>Aluno:</b> $nome &nbsp; <b>Código:</b> $codigo_aluno &nbsp; <b>Turma:</b> $turma</p>
+<table width="100%" border="1" cellspacing="0" cellpadding="4">
+  <tr><th>Disciplina</th><th>1º Trim.</th><th>2º Trim.</th><th>3º Trim.</th><th>Média</th></tr>
+  $linhas
+</table>
+<p><b>Média final:</b> $media_final &nbsp; <b>Resultado:</b> $resultado &nbsp;
+   <b>Posição:</b> $posicao &nbsp; <b>Faltas:</b> $faltas</p>
+<table width="100%"><tr>
+  <td>Emitido em $data_emissao<br>N.º $numero_documento</td>
+  <td align="right"><img src="recurso://assinatura" height="50"><img src="recurso://carimbo" height="70"></td>
+</tr></table>
+"""),
+    'certificado': Template("""
+<p align="center"><img src="recurso://logo" width="90"></p>
+<h1 align="center">$instituicao</h1>
+<h2 align="center">Certificado</h2>
+<p>Certifica-se que <b>$nome</b>, portador(a) do documento n.º $numero_identificacao,
+concluiu com aproveitamento a $classe no ano letivo $ano_letivo, com a média final de
+<b>$media_final</b> valores.</p>
+<p>Emitido em $data_emissao. N.º $numero_documento</p>
+<p align="right"><img src="recurso://assinatura" height="60"><br><img src="recurso://carimbo" height="90"></p>
+"""),
+}
+
+PREFIXOS = {'boletim': 'BOL', 'certificado': 'CERT'}
+
+
+def numero_documento(tipo: str, ano_letivo_id: int, aluno_id: int) -> str:
+    """Número determinístico do documento (chave de retoma)"""
+    return f"{PREFIXOS[tipo]}-{ano_letivo_id}-{aluno_id:06d}"
+
+
+# ============================================================================
+# PROCESSOS DE TRABALHO
+# ============================================================================
+
+# Estado de cada processo, preenchido por _iniciar_trabalhador
+_APLICACAO = None
+_RECURSOS: Dict[str, Any] = {}
+
+
+def _iniciar_trabalhador(caminhos_recursos: Dict[str, Optional[str]]):
+    """Cria a aplicação Qt sem ecrã e carrega os recursos estáticos uma vez por processo"""
+    global _APLICACAO
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PySide6.QtGui import QGuiApplication, QImage
+
+    _APLICACAO = QGuiApplication.instance() or QGuiApplication([])
+    _RECURSOS.clear()
+    for nome, caminho in caminhos_recursos.items():
+        imagem = QImage(caminho) if caminho and os.path.exists(caminho) else QImage()
+        _RECURSOS[nome] = imagem
+
+
+def _renderizar(trabalho: Dict[str, Any]) -> Tuple[int, str, str]:
+    """Gera um PDF. Retorna (aluno_id, caminho, sha256)."""
+    from PySide6.QtCore import QUrl, QMarginsF
+    from PySide6.QtGui import QTextDocument, QPdfWriter, QPageSize, QPageLayout
+
+    html = MODELOS[trabalho['tipo']].safe_substitute(trabalho['contexto'])
+    documento = QTextDocument()
+    for nome, imagem in _RECURSOS.items():
+        documento.addResource(QTextDocument.ImageResource, QUrl(f'recurso://{nome}'), imagem)
+    documento.setHtml(html)
+
+    destino = trabalho['caminho']
+    temporario = destino + '.parcial'
+    escritor = QPdfWriter(temporario)
+    escritor.setPageSize(QPageSize(QPageSize.A4))
+    escritor.setPageMargins(QMarginsF(15, 15, 15, 15), QPageLayout.Millimeter)
+    escritor.setResolution(150)
+    documento.print_(escritor)
+    del escritor  # fecha o ficheiro
+
+    os.replace(temporario, destino)
+    return trabalho['aluno_id'], destino, hash_arquivo(destino)
+
+
+# ============================================================================
+# PREPARAÇÃO DOS TRABALHOS
+# ============================================================================
+
+def _formatar(valor) -> str:
+    return '-' if valor is None else f"{float(valor):.1f}"
+
+
+def _medias_trimestrais(session: Session, ano_letivo_id: int) -> Dict[int, Dict[str, Dict[int, float]]]:
+    """aluno_id -> disciplina -> trimestre -> média ponderada, numa consulta agregada"""
+    linhas = session.execute(
+        select(
+            Matricula.aluno_id, Disciplina.nome, Nota.trimestre,
+            (func.sum(Nota.valor * Nota.peso) / func.sum(Nota.peso)).label('media'),
+        )
+        .join(Matricula, Matricula.id == Nota.matricula_id)
+        .join(Disciplina, Disciplina.id == Nota.disciplina_id)
+        .where(Matricula.ano_letivo_id == ano_letivo_id, Matricula.ativa == True)
+        .group_by(Matricula.aluno_id, Disciplina.nome, Nota.trimestre)
+    ).all()
+    medias: Dict[int, Dict[str, Dict[int, float]]] = {}
+    for aluno_id, disciplina, trimestre, media in linhas:
+        medias.setdefault(aluno_id, {}).setdefault(disciplina, {})[trimestre] = media
+    return medias
+
+
+def _linhas_boletim(disciplinas: Dict[str, Dict[int, float]]) -> str:
+    linhas = []
+    for nome in sorted(disciplinas):
+        trimestres = disciplinas[nome]
+        valores = [v for v in trimestres.values() if v is not None]
+        media = sum(float(v) for v in valores) / len(valores) if valores else None
+        celulas = ''.join(f'<td align="center">{_formatar(trimestres.get(t))}</td>' for t in (1, 2, 3))
+        linhas.append(f'<tr><td>{escape(nome)}</td>{celulas}<td align="center">{_formatar(media)}</td></tr>')
+    return '\n'.join(linhas)
+
+
+def preparar_trabalhos(session: Session, ano_letivo_id: int, tipo: str, pasta_destino: str,
+                       data_emissao: Optional[date] = None) -> Tuple[List[Dict[str, Any]], Dict[str, Optional[str]]]:
+    """Lista de trabalhos pendentes e caminhos dos recursos da instituição.
+
+    Salta os alunos cujo documento já está registado e cujo ficheiro
+    existe com o mesmo hash.
+    """
+    if tipo not in MODELOS:
+        raise ValueError(f"Tipo de documento desconhecido: {tipo}")
+    data_emissao = data_emissao or date.today()
+
+    instituicao = session.execute(
+        select(Instituicao, AnoLetivo.codigo)
+        .join(AnoLetivo, AnoLetivo.instituicao_id == Instituicao.id)
+        .where(AnoLetivo.id == ano_letivo_id)
+    ).first()
+    if instituicao is None:
+        raise ValueError("Ano letivo não encontrado")
+    instituicao, codigo_ano = instituicao
+    recursos = {nome: getattr(instituicao, campo) for nome, campo in RECURSOS.items()}
+
+    consulta = (
+        select(
+            HistoricoAcademico.aluno_id, HistoricoAcademico.classe_nome, HistoricoAcademico.resultado,
+            HistoricoAcademico.media_final, HistoricoAcademico.posicao_turma,
+            HistoricoAcademico.total_alunos_turma, HistoricoAcademico.faltas_totais,
+            Aluno.codigo_aluno, Pessoa.nome_completo, Pessoa.numero_documento, Turma.nome.label('turma'),
+        )
+        .join(Aluno, Aluno.id == HistoricoAcademico.aluno_id)
+        .join(Pessoa, Pessoa.id == Aluno.pessoa_id)
+        .join(Turma, Turma.id == HistoricoAcademico.turma_id)
+        .where(HistoricoAcademico.ano_letivo_id == ano_letivo_id)
+        .order_by(HistoricoAcademico.aluno_id)
+    )
+    if tipo == 'certificado':
+        consulta = consulta.where(HistoricoAcademico.resultado == ResultadoAvaliacao.APROVADO)
+    alunos = session.execute(consulta).mappings().all()
+
+    # Documentos já emitidos nesta série (retoma)
+    prefixo = f"{PREFIXOS[tipo]}-{ano_letivo_id}-"
+    emitidos = {
+        numero: (caminho, hash_registado)
+        for numero, caminho, hash_registado in session.execute(
+            select(DocumentoAluno.numero_documento, DocumentoAluno.arquivo_path, DocumentoAluno.arquivo_hash)
+            .where(DocumentoAluno.tipo == tipo, DocumentoAluno.numero_documento.like(prefixo + '%'),
+                   DocumentoAluno.valido == True)
+        )
+    }
+
+    medias = _medias_trimestrais(session, ano_letivo_id) if tipo == 'boletim' else {}
+    os.makedirs(pasta_destino, exist_ok=True)
+
+    trabalhos = []
+    for aluno in alunos:
+        numero = numero_documento(tipo, ano_letivo_id, aluno['aluno_id'])
+        if numero in emitidos:
+            caminho, hash_registado = emitidos[numero]
+            if os.path.exists(caminho) and hash_arquivo(caminho) == hash_registado:
+                continue
+
+        contexto = {
+            'instituicao': escape(instituicao.nome_oficial),
+            'ano_letivo': escape(codigo_ano),
+            'nome': escape(aluno['nome_completo']),
+            'codigo_aluno': escape(aluno['codigo_aluno']),
+            'numero_identificacao': escape(aluno['numero_documento']),
+            'turma': escape(aluno['turma']),
+            'classe': escape(aluno['classe_nome']),
+            'media_final': _formatar(aluno['media_final']),
+            'resultado': aluno['resultado'].value.replace('_', ' ').capitalize(),
+            'posicao': f"{aluno['posicao_turma'] or '-'}/{aluno['total_alunos_turma'] or '-'}",
+            'faltas': aluno['faltas_totais'] or 0,
+            'data_emissao': data_emissao.strftime('%d/%m/%Y'),
+            'numero_documento': numero,
+        }
+        if tipo == 'boletim':
+            contexto['linhas'] = _linhas_boletim(medias.get(aluno['aluno_id'], {}))
+
+        trabalhos.append({
+            'tipo': tipo,
+            'aluno_id': aluno['aluno_id'],
+            'numero_documento': numero,
+            'caminho': os.path.join(pasta_destino, f"{numero}.pdf"),
+            'contexto': contexto,
+        })
+    return trabalhos, recursos
+
+
+# ============================================================================
+# REGISTO
+# ============================================================================
+
+def _registar(session: Session, tipo: str, ano_letivo_id: int, emitido_por_id: int,
+              data_emissao: date, resultados: List[Tuple[int, str, str, str]]):
+    """Grava (ou substitui) os DocumentoAluno de um lote e actualiza o boletim_path"""
+    try:
+        numeros = [numero for _, numero, _, _ in resultados]
+        session.execute(
+            DocumentoAluno.__table__.delete().where(
+                DocumentoAluno.tipo == tipo, DocumentoAluno.numero_documento.in_(numeros)
+            )
+        )
+        session.add_all([
+            DocumentoAluno(
+                aluno_id=aluno_id, tipo=tipo, numero_documento=numero,
+                descricao=f"{tipo.capitalize()} do ano letivo {ano_letivo_id}",
+                data_emissao=data_emissao, arquivo_path=caminho, arquivo_hash=sha256,
+                emitido_por_id=emitido_por_id,
+            )
+            for aluno_id, numero, caminho, sha256 in resultados
+        ])
+        if tipo == 'boletim':
+            ids = session.execute(
+                select(HistoricoAcademico.id, HistoricoAcademico.aluno_id).where(
+                    HistoricoAcademico.ano_letivo_id == ano_letivo_id,
+                    HistoricoAcademico.aluno_id.in_([r[0] for r in resultados]),
+                )
+            ).all()
+            caminhos = {aluno_id: caminho for aluno_id, _, caminho, _ in resultados}
+            if ids:
+                session.execute(update(HistoricoAcademico), [
+                    {'id': historico_id, 'boletim_path': caminhos[aluno_id]} for historico_id, aluno_id in ids
+                ])
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+
+def emitir_documentos(session: Session, ano_letivo_id: int, tipo: str, pasta_destino: str,
+                      emitido_por_id: int, processos: Optional[int] = None,
+                      data_emissao: Optional[date] = None) -> Dict[str, Any]:
+    """Gera em paralelo os documentos pendentes do ano letivo.
+
+    Pode ser relançada após uma interrupção: só os documentos em falta (ou
+    com ficheiro alterado) são gerados de novo.
+    """
+    data_emissao = data_emissao or date.today()
+    trabalhos, recursos = preparar_trabalhos(session, ano_letivo_id, tipo, pasta_destino, data_emissao)
+    numeros = {t['aluno_id']: t['numero_documento'] for t in trabalhos}
+
+    gerados, falhas, pendentes = 0, [], []
+    with ProcessPoolExecutor(max_workers=processos, initializer=_iniciar_trabalhador,
+                             initargs=(recursos,)) as executor:
+        futuros = {executor.submit(_renderizar, trabalho): trabalho for trabalho in trabalhos}
+        for futuro in as_completed(futuros):
+            trabalho = futuros[futuro]
+            try:
+                aluno_id, caminho, sha256 = futuro.result()
+            except Exception as erro:
+                falhas.append({'aluno_id': trabalho['aluno_id'], 'erro': str(erro)})
+                continue
+            pendentes.append((aluno_id, numeros[aluno_id], caminho, sha256))
+            if len(pendentes) >= LOTE_GRAVACAO:
+                _registar(session, tipo, ano_letivo_id, emitido_por_id, data_emissao, pendentes)
+                gerados += len(pendentes)
+                pendentes = []
+    if pendentes:
+        _registar(session, tipo, ano_letivo_id, emitido_por_id, data_emissao, pendentes)
+        gerados += len(pendentes)
+
+    return {'gerados': gerados, 'falhas': falhas, 'total': len(trabalhos)}
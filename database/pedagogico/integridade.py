@@ -0,0 +1,183 @@
+"""
+Verificação de integridade dos ficheiros de documentos.
+
+Percorre os ficheiros referenciados em `DocumentoAluno.arquivo_path`,
+`HistoricoAcademico.boletim_path` e `PagamentoFornecedor.comprovante_path`,
+calcula o SHA-256 em blocos de tamanho fixo (com `mmap` nos ficheiros
+grandes) num conjunto de threads e compara-o, lote a lote, com o
+`arquivo_hash` registado.
+
+Uma cache (caminho -> mtime, tamanho, hash) gravada em JSON evita recalcular
+o hash dos ficheiros que não mudaram desde a última verificação.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Any, Tuple, Iterable
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ..modelsGeral import HistoricoAcademico, DocumentoAluno
+from ..finanacas.financas import PagamentoFornecedor
+
+
+TAMANHO_BLOCO = 1024 * 1024
+LIMIAR_MMAP = 64 * 1024 * 1024
+LOTE_VERIFICACAO = 1000
+
+
+def hash_arquivo(caminho: str) -> str:
+    """SHA-256 de um ficheiro, lido em blocos (mmap acima de LIMIAR_MMAP)"""
+    resumo = hashlib.sha256()
+    with open(caminho, 'rb') as arquivo:
+        tamanho = os.fstat(arquivo.fileno()).st_size
+        if tamanho >= LIMIAR_MMAP:
+            with mmap.mmap(arquivo.fileno(), 0, access=mmap.ACCESS_READ) as mapa:
+                vista = memoryview(mapa)
+                try:
+                    for inicio in range(0, tamanho, TAMANHO_BLOCO):
+                        resumo.update(vista[inicio:inicio + TAMANHO_BLOCO])
+                finally:
+                    vista.release()
+        else:
+            for bloco in iter(lambda: arquivo.read(TAMANHO_BLOCO), b''):
+                resumo.update(bloco)
+    return resumo.hexdigest()
+
+
+# ============================================================================
+# CACHE DE HASHES
+# ============================================================================
+
+class CacheHashes:
+    """Cache (caminho -> mtime, tamanho, hash) persistida em JSON"""
+
+    def __init__(self, caminho: Optional[str] = None):
+        self.caminho = caminho
+        self._entradas: Dict[str, Tuple[int, int, str]] = {}
+        if caminho and os.path.exists(caminho):
+            with open(caminho, 'r', encoding='utf-8') as arquivo:
+                self._entradas = {k: tuple(v) for k, v in json.load(arquivo).items()}
+
+    def obter(self, caminho: str, estado: os.stat_result) -> Optional[str]:
+        entrada = self._entradas.get(caminho)
+        if entrada and entrada[0] == estado.st_mtime_ns and entrada[1] == estado.st_size:
+            return entrada[2]
+        return None
+
+    def guardar(self, caminho: str, estado: os.stat_result, sha256: str):
+        self._entradas[caminho] = (estado.st_mtime_ns, estado.st_size, sha256)
+
+    def gravar(self):
+        if not self.caminho:
+            return
+        temporario = self.caminho + '.tmp'
+        with open(temporario, 'w', encoding='utf-8') as arquivo:
+            json.dump(self._entradas, arquivo)
+        os.replace(temporario, self.caminho)
+
+
+def _calcular(caminho: str, cache: CacheHashes) -> Tuple[Optional[os.stat_result], Optional[str], bool]:
+    """(estado, hash, veio_da_cache). Estado None se o ficheiro não existe."""
+    try:
+        estado = os.stat(caminho)
+    except OSError:
+        return None, None, False
+    sha256 = cache.obter(caminho, estado)
+    if sha256 is not None:
+        return estado, sha256, True
+    return estado, hash_arquivo(caminho), False
+
+
+# ============================================================================
+# VERIFICAÇÃO
+# ============================================================================
+
+def _referencias(session: Session) -> Iterable[Dict[str, Any]]:
+    """Todos os ficheiros referenciados, com o hash esperado quando existe"""
+    documentos = session.execute(
+        select(DocumentoAluno.id, DocumentoAluno.aluno_id, DocumentoAluno.arquivo_path,
+               DocumentoAluno.arquivo_hash)
+        .where(DocumentoAluno.valido == True)
+        .order_by(DocumentoAluno.id)
+        .execution_options(yield_per=LOTE_VERIFICACAO)
+    )
+    for id_, aluno_id, caminho, sha256 in documentos:
+        yield {'origem': 'documento_aluno', 'id': id_, 'aluno_id': aluno_id,
+               'caminho': caminho, 'hash_esperado': sha256}
+
+    # Os boletins gerados também têm DocumentoAluno; aqui só se confirma que existem
+    boletins = session.execute(
+        select(HistoricoAcademico.id, HistoricoAcademico.aluno_id, HistoricoAcademico.boletim_path)
+        .where(HistoricoAcademico.boletim_path != None)
+        .order_by(HistoricoAcademico.id)
+        .execution_options(yield_per=LOTE_VERIFICACAO)
+    )
+    for id_, aluno_id, caminho in boletins:
+        yield {'origem': 'boletim', 'id': id_, 'aluno_id': aluno_id,
+               'caminho': caminho, 'hash_esperado': None}
+
+    comprovantes = session.execute(
+        select(PagamentoFornecedor.id, PagamentoFornecedor.comprovante_path)
+        .where(PagamentoFornecedor.comprovante_path != None)
+        .order_by(PagamentoFornecedor.id)
+        .execution_options(yield_per=LOTE_VERIFICACAO)
+    )
+    for id_, caminho in comprovantes:
+        yield {'origem': 'comprovante_fornecedor', 'id': id_, 'aluno_id': None,
+               'caminho': caminho, 'hash_esperado': None}
+
+
+def _lotes(itens: Iterable, tamanho: int) -> Iterable[List]:
+    lote = []
+    for item in itens:
+        lote.append(item)
+        if len(lote) >= tamanho:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def verificar_documentos(session: Session, caminho_cache: Optional[str] = None,
+                         threads: Optional[int] = None) -> Dict[str, Any]:
+    """Verifica todos os ficheiros referenciados na base de dados.
+
+    Retorna as contagens e as listas de ficheiros em falta e adulterados
+    (hash diferente do registado).
+    """
+    cache = CacheHashes(caminho_cache)
+    em_falta, adulterados = [], []
+    total = calculados = 0
+
+    with ThreadPoolExecutor(max_workers=threads or min(32, (os.cpu_count() or 1) * 2)) as executor:
+        for lote in _lotes(_referencias(session), LOTE_VERIFICACAO):
+            # Cada caminho é calculado uma vez por lote, mesmo que referenciado várias vezes
+            caminhos = list(dict.fromkeys(r['caminho'] for r in lote))
+            resultados = dict(zip(caminhos, executor.map(lambda c: _calcular(c, cache), caminhos)))
+
+            for referencia in lote:
+                total += 1
+                estado, sha256, da_cache = resultados[referencia['caminho']]
+                if estado is None:
+                    em_falta.append(referencia)
+                    continue
+                esperado = referencia['hash_esperado']
+                if esperado and sha256 != esperado.lower():
+                    adulterados.append({**referencia, 'hash_atual': sha256})
+            for caminho, (estado, sha256, da_cache) in resultados.items():
+                if estado is not None and not da_cache:
+                    calculados += 1
+                    cache.guardar(caminho, estado, sha256)
+
+    cache.gravar()
+    return {
+        'total': total,
+        'hashes_calculados': calculados,
+        'em_falta': em_falta,
+        'adulterados': adulterados,
+    }
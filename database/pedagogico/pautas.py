@@ -0,0 +1,195 @@
+"""
+Cálculo de resultados de fim de ano (pautas).
+
+Carrega todas as notas de um ano letivo como arrays NumPy e calcula, sem
+ciclos por aluno:
+  - a média ponderada de cada disciplina (peso de cada `Nota`);
+  - a média final (peso `DisciplinaClasse.peso_avaliacao`, só disciplinas
+    com `incluir_media_final`);
+  - disciplinas aprovadas/reprovadas face a `nota_minima_aprovacao`, contadas
+    só sobre as disciplinas da grade da classe;
+  - o `ResultadoAvaliacao` e a posição na turma. Matrículas a que falta a nota
+    de alguma disciplina da grade ficam `EM_ANDAMENTO`, sem média final.
+Os `HistoricoAcademico` são escritos com upserts em lote.
+"""
+
+from datetime import date
+from typing import Dict, Any, Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .pedagogico import Nota
+from ..Academico.academico import AnoLetivo, Turma, Classe, DisciplinaClasse
+from ..Academico.alunomodels import Matricula
+from ..instituicao.instituicao import ConfiguracaoSistema
+from ..modelsGeral import HistoricoAcademico
+from ..enums import ResultadoAvaliacao
+from ..base_database import upsert
+
+
+# Até este número de disciplinas reprovadas o aluno vai a recuperação
+MAX_DISCIPLINAS_RECUPERACAO = 2
+TAMANHO_LOTE = 2000
+
+
+def _configuracao(session: Session, ano_letivo_id: int) -> Dict[str, float]:
+    linha = session.execute(
+        select(ConfiguracaoSistema.nota_minima_aprovacao)
+        .join(AnoLetivo, AnoLetivo.instituicao_id == ConfiguracaoSistema.instituicao_id)
+        .where(AnoLetivo.id == ano_letivo_id)
+    ).first()
+    return {'nota_minima': float(linha[0]) if linha else 10.0}
+
+
+def calcular_resultados(session: Session, ano_letivo_id: int) -> pd.DataFrame:
+    """Calcula médias, resultados e posições de todas as matrículas do ano"""
+    nota_minima = _configuracao(session, ano_letivo_id)['nota_minima']
+
+    matriculas = pd.DataFrame.from_records(session.execute(
+        select(Matricula.id, Matricula.aluno_id, Matricula.turma_id, Turma.classe_id, Classe.nome,
+               Matricula.faltas_injustificadas, Matricula.faltas_justificadas)
+        .join(Turma, Turma.id == Matricula.turma_id)
+        .join(Classe, Classe.id == Turma.classe_id)
+        .where(Matricula.ano_letivo_id == ano_letivo_id, Matricula.ativa == True)
+        .order_by(Matricula.id)
+    ).all(), columns=['matricula_id', 'aluno_id', 'turma_id', 'classe_id', 'classe_nome',
+                      'faltas_injustificadas', 'faltas_justificadas'])
+    if matriculas.empty:
+        return matriculas
+
+    notas = session.execute(
+        select(Nota.matricula_id, Nota.disciplina_id, Nota.valor, Nota.peso)
+        .join(Matricula, Matricula.id == Nota.matricula_id)
+        .where(Matricula.ano_letivo_id == ano_letivo_id, Matricula.ativa == True)
+    ).all()
+    pesos_disciplina = session.execute(
+        select(DisciplinaClasse.classe_id, DisciplinaClasse.disciplina_id,
+               DisciplinaClasse.peso_avaliacao, DisciplinaClasse.incluir_media_final)
+        .where(DisciplinaClasse.classe_id.in_(matriculas['classe_id'].unique().tolist()))
+    ).all()
+
+    n_matriculas = len(matriculas)
+    ids_matricula = matriculas['matricula_id'].to_numpy()
+
+    if notas:
+        n_mat = np.fromiter((n[0] for n in notas), dtype=np.int64, count=len(notas))
+        n_disc = np.fromiter((n[1] for n in notas), dtype=np.int64, count=len(notas))
+        n_valor = np.fromiter((float(n[2]) for n in notas), dtype=np.float64, count=len(notas))
+        n_peso = np.fromiter((float(n[3] or 1) for n in notas), dtype=np.float64, count=len(notas))
+    else:
+        n_mat = n_disc = np.empty(0, dtype=np.int64)
+        n_valor = n_peso = np.empty(0, dtype=np.float64)
+
+    # Índices densos: linha da matrícula e coluna da disciplina. As colunas
+    # incluem as disciplinas da grade ainda sem nenhuma nota.
+    linha = np.searchsorted(ids_matricula, n_mat)
+    disciplinas = np.unique(np.concatenate([
+        n_disc, np.array([p[1] for p in pesos_disciplina], dtype=np.int64)
+    ]))
+    coluna = np.searchsorted(disciplinas, n_disc)
+    n_disciplinas = max(len(disciplinas), 1)
+    chave = linha * n_disciplinas + coluna
+    tamanho = n_matriculas * n_disciplinas
+
+    # Média ponderada por (matrícula, disciplina)
+    soma = np.bincount(chave, weights=n_valor * n_peso, minlength=tamanho)
+    peso_total = np.bincount(chave, weights=n_peso, minlength=tamanho)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        media_disciplina = (soma / peso_total).reshape(n_matriculas, n_disciplinas)
+    tem_nota = (peso_total > 0).reshape(n_matriculas, n_disciplinas)
+
+    # Peso de cada disciplina na média final, por classe
+    classes, linha_classe = np.unique(matriculas['classe_id'].to_numpy(), return_inverse=True)
+    # Classes sem grade configurada contam todas as disciplinas com peso 1
+    peso_classe = np.ones((len(classes), n_disciplinas))
+    posicao_disciplina = {d: i for i, d in enumerate(disciplinas.tolist())}
+    posicao_classe = {c: i for i, c in enumerate(classes.tolist())}
+    com_grade = np.zeros(len(classes), dtype=bool)
+    for classe_id in {p[0] for p in pesos_disciplina}:
+        peso_classe[posicao_classe[classe_id]] = 0.0
+        com_grade[posicao_classe[classe_id]] = True
+    for classe_id, disciplina_id, peso, incluir in pesos_disciplina:
+        if incluir:
+            peso_classe[posicao_classe[classe_id], posicao_disciplina[disciplina_id]] = float(peso)
+
+    # Disciplinas que contam para o resultado: as da grade (peso > 0) ou,
+    # sem grade configurada, as que têm nota
+    curricular = np.where(com_grade[linha_classe][:, None],
+                          peso_classe[linha_classe] > 0, tem_nota)
+    avaliada = curricular & tem_nota
+    incompleta = (curricular & ~tem_nota).any(axis=1)
+    pesos = peso_classe[linha_classe] * avaliada
+
+    medias_validas = np.where(tem_nota, media_disciplina, 0.0)
+    soma_pesos = pesos.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        media_final = np.where((soma_pesos > 0) & ~incompleta,
+                               (medias_validas * pesos).sum(axis=1) / soma_pesos, np.nan)
+
+    aprovadas = (avaliada & (medias_validas >= nota_minima)).sum(axis=1)
+    reprovadas = (avaliada & (medias_validas < nota_minima)).sum(axis=1)
+
+    resultado = np.select(
+        [~avaliada.any(axis=1) | incompleta, reprovadas == 0, reprovadas <= MAX_DISCIPLINAS_RECUPERACAO],
+        [ResultadoAvaliacao.EM_ANDAMENTO.value, ResultadoAvaliacao.APROVADO.value,
+         ResultadoAvaliacao.RECUPERACAO.value],
+        default=ResultadoAvaliacao.REPROVADO.value,
+    )
+
+    matriculas['media_final'] = np.round(media_final, 2)
+    matriculas['disciplinas_aprovadas'] = aprovadas
+    matriculas['disciplinas_reprovadas'] = reprovadas
+    matriculas['resultado'] = resultado
+    matriculas['posicao_turma'] = (
+        matriculas.groupby('turma_id')['media_final'].rank(method='min', ascending=False)
+    )
+    matriculas['total_alunos_turma'] = matriculas.groupby('turma_id')['matricula_id'].transform('size')
+    return matriculas
+
+
+def gravar_historicos(session: Session, ano_letivo_id: int, resultados: pd.DataFrame,
+                      data_conclusao: Optional[date] = None) -> int:
+    """Escreve (ou actualiza) os HistoricoAcademico do ano com upserts em lote"""
+    linhas = []
+    for r in resultados.itertuples(index=False):
+        injustificadas = int(r.faltas_injustificadas or 0)
+        justificadas = int(r.faltas_justificadas or 0)
+        linhas.append({
+            'aluno_id': int(r.aluno_id),
+            'ano_letivo_id': ano_letivo_id,
+            'turma_id': int(r.turma_id),
+            'classe_nome': r.classe_nome,
+            'resultado': ResultadoAvaliacao(r.resultado),
+            'media_final': None if pd.isna(r.media_final) else float(r.media_final),
+            'faltas_totais': injustificadas + justificadas,
+            'faltas_justificadas': justificadas,
+            'disciplinas_aprovadas': int(r.disciplinas_aprovadas),
+            'disciplinas_reprovadas': int(r.disciplinas_reprovadas),
+            'disciplinas_em_recuperacao': int(r.disciplinas_reprovadas)
+                if r.resultado == ResultadoAvaliacao.RECUPERACAO.value else 0,
+            'posicao_turma': None if pd.isna(r.posicao_turma) else int(r.posicao_turma),
+            'total_alunos_turma': int(r.total_alunos_turma),
+            'data_conclusao': data_conclusao,
+        })
+
+    atualizar = [c for c in linhas[0] if c not in ('aluno_id', 'ano_letivo_id')] if linhas else []
+    try:
+        for i in range(0, len(linhas), TAMANHO_LOTE):
+            upsert(session, HistoricoAcademico, linhas[i:i + TAMANHO_LOTE],
+                   chaves=('aluno_id', 'ano_letivo_id'), atualizar=atualizar)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    return len(linhas)
+
+
+def fechar_ano(session: Session, ano_letivo_id: int, data_conclusao: Optional[date] = None) -> Dict[str, Any]:
+    """Calcula e grava os resultados do ano letivo. Retorna um resumo por resultado."""
+    resultados = calcular_resultados(session, ano_letivo_id)
+    gravados = gravar_historicos(session, ano_letivo_id, resultados, data_conclusao)
+    resumo = resultados['resultado'].value_counts().to_dict() if gravados else {}
+    return {'historicos': gravados, 'por_resultado': resumo}
@@ -26,3 +26,36 @@ class ProfessorDisciplina(Base):
         Index('idx_prof_disc_ativa', 'ativo'),
     )
 
+
+class Nota(Base):
+    """Notas lançadas por matrícula, disciplina e trimestre"""
+    __tablename__ = 'notas'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    matricula_id = Column(Integer, ForeignKey('matriculas.id', ondelete='CASCADE'), nullable=False)
+    disciplina_id = Column(Integer, ForeignKey('disciplinas.id', ondelete='CASCADE'), nullable=False)
+    professor_id = Column(Integer, ForeignKey('professores.id'))
+    
+    # Avaliação
+    trimestre = Column(Integer, nullable=False)
+    tipo = Column(SQLEnum(TipoAvaliacao), nullable=False)
+    valor = Column(Numeric(5, 2), nullable=False)
+    peso = Column(Numeric(5, 2), default=1.0, nullable=False)  # Peso dentro da disciplina
+    
+    # Registo
+    data_avaliacao = Column(Date)
+    data_lancamento = Column(DateTime, default=datetime.utcnow, nullable=False)
+    observacoes = Column(String(500))
+    
+    # Relacionamentos
+    matricula = relationship("Matricula", back_populates="notas")
+    disciplina = relationship("Disciplina")
+    professor = relationship("Professor")
+    
+    __table_args__ = (
+        Index('idx_nota_matricula', 'matricula_id'),
+        Index('idx_nota_disciplina', 'disciplina_id'),
+        CheckConstraint('valor BETWEEN 0 AND 20', name='ck_nota_valor'),
+        CheckConstraint('trimestre BETWEEN 1 AND 3', name='ck_nota_trimestre'),
+        CheckConstraint('peso > 0', name='ck_nota_peso'),
+    )
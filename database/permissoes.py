@@ -0,0 +1,253 @@
+"""
+Motor de permissões.
+
+As linhas de `PermissaoUsuario` de um utilizador são compiladas uma vez (no
+login) numa estrutura imutável:
+
+- uma máscara de bits por módulo com as acções permitidas (`Acao`);
+- frozensets com as turmas e disciplinas permitidas por módulo
+  (`None` = sem restrição);
+- só entram as linhas válidas hoje (`data_inicio`/`data_fim`).
+
+Cada compilação leva um número de versão. Alterações feitas pelo ORM a
+`PermissaoUsuario` ou ao nível de acesso de um utilizador incrementam a
+versão desse utilizador, e o motor recompila na próxima consulta; o mesmo
+acontece quando muda o dia para lá de uma data de validade ou passa o
+intervalo de revalidação (alterações feitas noutros postos).
+"""
+
+import enum
+import threading
+import time
+from collections import namedtuple
+from datetime import date, timedelta
+from types import MappingProxyType
+from typing import Callable, Dict, Optional, FrozenSet
+
+from sqlalchemy import select, event, false
+from sqlalchemy.orm import Session
+
+from .modelsGeral import Usuario, PermissaoUsuario
+from .enums import NivelAcesso
+
+
+REVALIDAR_APOS = 300   # segundos
+
+
+class Acao(enum.IntFlag):
+    """Acções por módulo (bits da máscara)"""
+    CRIAR = 1
+    LER = 2
+    ATUALIZAR = 4
+    DELETAR = 8
+    EXPORTAR = 16
+    APROVAR = 32
+    RELATORIOS = 64
+
+
+TODAS = Acao(sum(Acao))
+
+# Coluna de PermissaoUsuario -> bit
+_COLUNAS_ACOES = (
+    ('criar', Acao.CRIAR), ('ler', Acao.LER), ('atualizar', Acao.ATUALIZAR),
+    ('deletar', Acao.DELETAR), ('exportar', Acao.EXPORTAR), ('aprovar', Acao.APROVAR),
+    ('relatorios', Acao.RELATORIOS),
+)
+
+
+# ============================================================================
+# VERSÕES
+# ============================================================================
+
+_bloqueio = threading.Lock()
+_geracao = 0
+_alteracoes: Dict[int, int] = {}   # usuario_id -> geração da última alteração
+_alteracao_global = 0
+
+
+def invalidar(usuario_id: Optional[int] = None):
+    """
+    Marca as permissões compiladas como desactualizadas.
+    Necessário após UPDATE/DELETE em massa, que não disparam eventos do ORM.
+    """
+    global _geracao, _alteracao_global
+    with _bloqueio:
+        _geracao += 1
+        if usuario_id is None:
+            _alteracao_global = _geracao
+        else:
+            _alteracoes[usuario_id] = _geracao
+
+
+def _versao_atual() -> int:
+    with _bloqueio:
+        return _geracao
+
+
+def _ultima_alteracao(usuario_id: int) -> int:
+    with _bloqueio:
+        return max(_alteracoes.get(usuario_id, 0), _alteracao_global)
+
+
+@event.listens_for(PermissaoUsuario, 'after_insert')
+@event.listens_for(PermissaoUsuario, 'after_update')
+@event.listens_for(PermissaoUsuario, 'after_delete')
+def _permissao_alterada(mapper, connection, alvo):
+    invalidar(alvo.usuario_id)
+
+
+@event.listens_for(Usuario, 'after_update')
+def _usuario_alterado(mapper, connection, alvo):
+    invalidar(alvo.id)
+
+
+# ============================================================================
+# ESTRUTURA COMPILADA
+# ============================================================================
+
+class PermissoesCompiladas(namedtuple(
+        'PermissoesCompiladas', 'usuario_id versao total mascaras turmas disciplinas valido_ate compilado_em')):
+    """Permissões de um utilizador, imutáveis; consultas sem acesso à base"""
+    __slots__ = ()
+
+    def mascara(self, modulo: str) -> Acao:
+        return TODAS if self.total else Acao(self.mascaras.get(modulo, 0))
+
+    def pode(self, modulo: str, acao: Acao = Acao.LER) -> bool:
+        return self.total or (self.mascaras.get(modulo, 0) & acao) == acao
+
+    def turmas_permitidas(self, modulo: str) -> Optional[FrozenSet[int]]:
+        """None = todas as turmas"""
+        return None if self.total else self.turmas.get(modulo)
+
+    def disciplinas_permitidas(self, modulo: str) -> Optional[FrozenSet[int]]:
+        """None = todas as disciplinas"""
+        return None if self.total else self.disciplinas.get(modulo)
+
+    def pode_turma(self, modulo: str, turma_id: int, acao: Acao = Acao.LER) -> bool:
+        turmas = self.turmas_permitidas(modulo)
+        return self.pode(modulo, acao) and (turmas is None or turma_id in turmas)
+
+    def pode_disciplina(self, modulo: str, disciplina_id: int, acao: Acao = Acao.LER) -> bool:
+        disciplinas = self.disciplinas_permitidas(modulo)
+        return self.pode(modulo, acao) and (disciplinas is None or disciplina_id in disciplinas)
+
+
+def _ids(valores) -> Optional[FrozenSet[int]]:
+    # Lista vazia ou nula = sem restrição
+    if not valores:
+        return None
+    return frozenset(int(v) for v in valores)
+
+
+def compilar(session: Session, usuario_id: int, hoje: Optional[date] = None) -> PermissoesCompiladas:
+    """Lê as permissões do utilizador (duas consultas) e compila-as"""
+    hoje = hoje or date.today()
+    versao = _versao_atual()
+
+    nivel = session.execute(
+        select(Usuario.nivel_acesso).where(Usuario.id == usuario_id)
+    ).scalar_one_or_none()
+    if nivel is None:
+        raise ValueError("Usuário não encontrado")
+
+    linhas = session.execute(
+        select(PermissaoUsuario).where(PermissaoUsuario.usuario_id == usuario_id)
+    ).scalars().all()
+
+    mascaras, turmas, disciplinas = {}, {}, {}
+    fronteiras = []
+    for p in linhas:
+        # Próxima data em que o conjunto de linhas válidas muda
+        if p.data_inicio and p.data_inicio > hoje:
+            fronteiras.append(p.data_inicio)
+            continue
+        if p.data_fim is not None:
+            if p.data_fim < hoje:
+                continue
+            fronteiras.append(p.data_fim + timedelta(days=1))
+
+        mascara = 0
+        for coluna, bit in _COLUNAS_ACOES:
+            if getattr(p, coluna):
+                mascara |= bit
+        mascaras[p.modulo] = mascara
+        turmas[p.modulo] = _ids(p.restricao_turmas)
+        disciplinas[p.modulo] = _ids(p.restricao_disciplinas)
+
+    return PermissoesCompiladas(
+        usuario_id=usuario_id,
+        versao=versao,
+        total=nivel == NivelAcesso.SUPER_ADMIN,
+        mascaras=MappingProxyType(mascaras),
+        turmas=MappingProxyType(turmas),
+        disciplinas=MappingProxyType(disciplinas),
+        valido_ate=min(fronteiras) if fronteiras else None,
+        compilado_em=time.monotonic(),
+    )
+
+
+# ============================================================================
+# MOTOR
+# ============================================================================
+
+class MotorPermissoes:
+    """Cache de permissões compiladas por utilizador, segura entre threads"""
+
+    def __init__(self, fabrica_sessoes: Callable[[], Session], revalidar_apos: float = REVALIDAR_APOS):
+        self.fabrica_sessoes = fabrica_sessoes
+        self.revalidar_apos = revalidar_apos
+        self._cache: Dict[int, PermissoesCompiladas] = {}
+        self._bloqueio = threading.Lock()
+
+    def valida(self, permissoes: PermissoesCompiladas) -> bool:
+        """True se a compilação ainda está actual"""
+        if _ultima_alteracao(permissoes.usuario_id) > permissoes.versao:
+            return False
+        if permissoes.valido_ate is not None and date.today() >= permissoes.valido_ate:
+            return False
+        return time.monotonic() - permissoes.compilado_em < self.revalidar_apos
+
+    def obter(self, usuario_id: int) -> PermissoesCompiladas:
+        """Permissões do utilizador, recompiladas só quando desactualizadas"""
+        permissoes = self._cache.get(usuario_id)
+        if permissoes is not None and self.valida(permissoes):
+            return permissoes
+
+        session = self.fabrica_sessoes()
+        try:
+            permissoes = compilar(session, usuario_id)
+        finally:
+            session.close()
+        with self._bloqueio:
+            self._cache[usuario_id] = permissoes
+        return permissoes
+
+    def descartar(self, usuario_id: Optional[int] = None):
+        """Remove do cache (ex.: no logout)"""
+        with self._bloqueio:
+            if usuario_id is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(usuario_id, None)
+
+
+# ============================================================================
+# FILTRO DE CONSULTAS
+# ============================================================================
+
+def filtrar(consulta, permissoes: PermissoesCompiladas, modulo: str,
+            turma=None, disciplina=None, acao: Acao = Acao.LER):
+    """
+    Aplica as permissões a um select()/Query:
+    sem a acção no módulo não devolve linhas; com restrições acrescenta
+    `coluna IN (...)` para as colunas de turma e disciplina indicadas.
+    """
+    if not permissoes.pode(modulo, acao):
+        return consulta.where(false())
+    for coluna, permitidos in ((turma, permissoes.turmas_permitidas(modulo)),
+                               (disciplina, permissoes.disciplinas_permitidas(modulo))):
+        if coluna is None or permitidos is None:
+            continue
+        consulta = consulta.where(coluna.in_(sorted(permitidos)))
+    return consulta
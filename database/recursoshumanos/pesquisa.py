@@ -0,0 +1,318 @@
+"""
+Pesquisa rápida de pessoas (alunos, encarregados, professores, funcionários).
+
+O termo é normalizado com `dobrar_texto` (sem acentos, minúsculas) e
+dividido em palavras: "joao man" encontra "João Manuel". Procura-se ao
+mesmo tempo no nome (`Pessoa.nome_pesquisa`), no documento, nos códigos do
+aluno (`codigo_aluno`, `codigo_med_aluno`) e nos telefones.
+
+- PostgreSQL: uma consulta servida pelos índices de trigramas (`pg_trgm`) e
+  `text_pattern_ops` criados com as tabelas, ordenada por `similarity()`.
+- SQLite / sem ligação: `IndicePessoas`, um índice de trigramas em memória
+  carregado com duas consultas e actualizável pessoa a pessoa.
+
+Os dois caminhos devolvem `Resultado` com a mesma pontuação: identificador
+exacto > prefixo de identificador > telefone > nome.
+"""
+
+import re
+from bisect import bisect_left, insort
+from collections import defaultdict, namedtuple
+from heapq import nlargest
+from typing import Dict, List, Optional, Set, Tuple, Iterable
+
+from sqlalchemy import select, update, func, or_, and_, case, literal, literal_column
+from sqlalchemy.orm import Session
+
+from .recursoshumanos import Pessoa, TelefonePessoa
+from ..Academico.alunomodels import Aluno
+from ..base_database import dobrar_texto
+
+
+Resultado = namedtuple('Resultado', 'pessoa_id nome tipo numero_documento aluno_id codigo_aluno pontuacao')
+
+TAMANHO_NGRAMA = 3
+MIN_DIGITOS_TELEFONE = 4
+PRE_SELECCAO = 10
+
+PONTOS_IDENTIFICADOR = 100
+PONTOS_PREFIXO = 90
+PONTOS_TELEFONE = 80
+PONTOS_NOME = 50
+
+
+def _digitos(termo: str) -> str:
+    return re.sub(r'\D', '', termo)
+
+
+def _ngramas(texto: str) -> Set[str]:
+    texto = f" {texto} "
+    return {texto[i:i + TAMANHO_NGRAMA] for i in range(len(texto) - TAMANHO_NGRAMA + 1)}
+
+
+def _semelhanca(a: str, b: str) -> float:
+    """Semelhança de trigramas (como pg_trgm.similarity)"""
+    ga, gb = _ngramas(a), _ngramas(b)
+    return len(ga & gb) / len(ga | gb) if ga and gb else 0.0
+
+
+# ============================================================================
+# ÍNDICE EM MEMÓRIA
+# ============================================================================
+
+class _IndiceNgramas:
+    """Textos por identificador com listas invertidas de trigramas"""
+
+    def __init__(self):
+        self.textos: Dict[int, str] = {}
+        self._listas: Dict[str, Set[int]] = defaultdict(set)
+
+    def adicionar(self, chave: int, texto: str):
+        self.remover(chave)
+        self.textos[chave] = texto
+        for ngrama in _ngramas(texto):
+            self._listas[ngrama].add(chave)
+
+    def remover(self, chave: int):
+        texto = self.textos.pop(chave, None)
+        if texto is None:
+            return
+        for ngrama in _ngramas(texto):
+            lista = self._listas.get(ngrama)
+            if lista is not None:
+                lista.discard(chave)
+                if not lista:
+                    del self._listas[ngrama]
+
+    def contem(self, fragmento: str, candidatos: Optional[Set[int]] = None) -> Set[int]:
+        """Identificadores cujo texto contém o fragmento"""
+        if len(fragmento) >= TAMANHO_NGRAMA:
+            # Trigramas interiores do fragmento, do mais raro para o mais comum
+            ngramas = {fragmento[i:i + TAMANHO_NGRAMA] for i in range(len(fragmento) - TAMANHO_NGRAMA + 1)}
+            listas = sorted((self._listas.get(n, set()) for n in ngramas), key=len)
+            resultado = set(candidatos) if candidatos is not None else set(listas[0])
+            for lista in listas:
+                resultado &= lista
+                if not resultado:
+                    return resultado
+        else:
+            resultado = set(candidatos) if candidatos is not None else set(self.textos)
+        # Os trigramas não garantem a ordem: confirma a subcadeia
+        return {chave for chave in resultado if fragmento in self.textos[chave]}
+
+
+class IndicePessoas:
+    """Índice de pesquisa de pessoas em memória (alternativa a pg_trgm)"""
+
+    def __init__(self):
+        self._pessoas: Dict[int, Tuple[str, str, str, Optional[str]]] = {}
+        self._nomes = _IndiceNgramas()
+        self._telefones = _IndiceNgramas()
+        self._identificadores: List[Tuple[str, int]] = []   # ordenada, para exactos e prefixos
+
+    @classmethod
+    def carregar(cls, session: Session) -> 'IndicePessoas':
+        """Constrói o índice com duas consultas"""
+        indice = cls()
+        telefones = defaultdict(list)
+        for pessoa_id, numero in session.execute(select(TelefonePessoa.pessoa_id, TelefonePessoa.numero)):
+            telefones[pessoa_id].append(numero)
+        for linha in session.execute(
+            select(Pessoa.id, Pessoa.nome_completo, Pessoa.tipo, Pessoa.numero_documento,
+                   Aluno.codigo_aluno, Aluno.codigo_med_aluno, Aluno.id)
+            .outerjoin(Aluno, Aluno.pessoa_id == Pessoa.id)
+            .where(Pessoa.ativo == True)
+        ):
+            indice.adicionar(linha[0], linha[1], linha[2], linha[3], linha[4], linha[5],
+                             telefones.get(linha[0], ()), aluno_id=linha[6], ordenar=False)
+        indice._identificadores.sort()
+        return indice
+
+    def adicionar(self, pessoa_id: int, nome: str, tipo: str, numero_documento: str,
+                  codigo_aluno: Optional[str] = None, codigo_med_aluno: Optional[str] = None,
+                  telefones: Iterable[str] = (), aluno_id: Optional[int] = None, ordenar: bool = True):
+        """Adiciona ou substitui uma pessoa"""
+        self.remover(pessoa_id)
+        self._pessoas[pessoa_id] = (nome, tipo, numero_documento, aluno_id, codigo_aluno)
+        self._nomes.adicionar(pessoa_id, dobrar_texto(nome))
+        digitos = ' '.join(_digitos(t) for t in telefones if t)
+        if digitos:
+            self._telefones.adicionar(pessoa_id, digitos)
+        for identificador in (numero_documento, codigo_aluno, codigo_med_aluno):
+            if identificador:
+                entrada = (dobrar_texto(identificador).replace(' ', ''), pessoa_id)
+                if ordenar:
+                    insort(self._identificadores, entrada)
+                else:
+                    self._identificadores.append(entrada)
+
+    def remover(self, pessoa_id: int):
+        if self._pessoas.pop(pessoa_id, None) is None:
+            return
+        self._nomes.remover(pessoa_id)
+        self._telefones.remover(pessoa_id)
+        self._identificadores = [e for e in self._identificadores if e[1] != pessoa_id]
+
+    def _por_identificador(self, termo: str) -> Dict[int, int]:
+        chave = termo.replace(' ', '')
+        pontos = {}
+        if not chave:
+            return pontos
+        i = bisect_left(self._identificadores, (chave, -1))
+        while i < len(self._identificadores) and self._identificadores[i][0].startswith(chave):
+            identificador, pessoa_id = self._identificadores[i]
+            pontos[pessoa_id] = max(pontos.get(pessoa_id, 0),
+                                    PONTOS_IDENTIFICADOR if identificador == chave else PONTOS_PREFIXO)
+            i += 1
+        return pontos
+
+    def procurar(self, termo: str, limite: int = 20, tipo: Optional[str] = None) -> List[Resultado]:
+        dobrado = dobrar_texto(termo)
+        if not dobrado:
+            return []
+        pontos = self._por_identificador(dobrado)
+
+        digitos = _digitos(termo)
+        if len(digitos) >= MIN_DIGITOS_TELEFONE:
+            for pessoa_id in self._telefones.contem(digitos):
+                pontos[pessoa_id] = max(pontos.get(pessoa_id, 0), PONTOS_TELEFONE)
+
+        # Nome: todas as palavras têm de aparecer; as mais longas filtram primeiro
+        candidatos = None
+        for palavra in sorted(dobrado.split(), key=len, reverse=True):
+            candidatos = self._nomes.contem(palavra, candidatos)
+            if not candidatos:
+                break
+        candidatos = candidatos or set()
+        textos = self._nomes.textos
+        if len(candidatos) > limite * PRE_SELECCAO:
+            # Termos muito comuns: só os nomes mais curtos / com o prefixo são pontuados
+            candidatos = nlargest(limite * PRE_SELECCAO, candidatos,
+                                  key=lambda p: (textos[p].startswith(dobrado), -len(textos[p])))
+        for pessoa_id in candidatos:
+            nome = textos[pessoa_id]
+            pontuacao = PONTOS_NOME + 30 * _semelhanca(dobrado, nome) + (10 if nome.startswith(dobrado) else 0)
+            pontos[pessoa_id] = max(pontos.get(pessoa_id, 0), pontuacao)
+
+        resultados = []
+        for pessoa_id, pontuacao in pontos.items():
+            nome, tipo_pessoa, documento, aluno_id, codigo = self._pessoas[pessoa_id]
+            if tipo is None or tipo_pessoa == tipo:
+                resultados.append(Resultado(pessoa_id, nome, tipo_pessoa, documento, aluno_id, codigo,
+                                            round(pontuacao, 2)))
+        resultados.sort(key=lambda r: (-r.pontuacao, r.nome))
+        return resultados[:limite]
+
+
+# ============================================================================
+# PESQUISA NA BASE DE DADOS
+# ============================================================================
+
+def _escapar_like(texto: str) -> str:
+    return texto.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _numero_digitos():
+    """Mesma expressão de idx_telefone_digitos_trgm (constantes literais para o índice ser usado)"""
+    return func.regexp_replace(TelefonePessoa.numero, literal_column(r"'\D'"),
+                               literal_column("''"), literal_column("'g'"))
+
+
+def _procurar_sql(session: Session, termo: str, limite: int, tipo: Optional[str]) -> List[Resultado]:
+    """Pesquisa servida pelos índices de trigramas do PostgreSQL"""
+    dobrado = dobrar_texto(termo)
+    if not dobrado:
+        return []
+    identificador = termo.strip().replace(' ', '')
+    prefixo = identificador.replace('%', '').replace('_', '') + '%'
+    digitos = _digitos(termo)
+
+    condicao_nome = and_(*[Pessoa.nome_pesquisa.like(f"%{_escapar_like(palavra)}%", escape='\\')
+                           for palavra in dobrado.split()])
+    exacto = or_(func.upper(Pessoa.numero_documento) == identificador.upper(),
+                 Aluno.codigo_aluno == identificador, Aluno.codigo_med_aluno == identificador)
+    prefixo_id = or_(Pessoa.numero_documento.like(prefixo.upper()),
+                     Aluno.codigo_aluno.like(prefixo), Aluno.codigo_med_aluno.like(prefixo))
+    condicoes = [condicao_nome, exacto, prefixo_id]
+    pontos_telefone = literal(0)
+    if len(digitos) >= MIN_DIGITOS_TELEFONE:
+        com_telefone = Pessoa.id.in_(
+            select(TelefonePessoa.pessoa_id).where(_numero_digitos().like(f"%{digitos}%"))
+        )
+        condicoes.append(com_telefone)
+        pontos_telefone = case((com_telefone, PONTOS_TELEFONE), else_=0)
+
+    pontos_nome = case(
+        (condicao_nome, PONTOS_NOME + 30 * func.similarity(Pessoa.nome_pesquisa, dobrado)
+         + case((Pessoa.nome_pesquisa.like(f"{_escapar_like(dobrado)}%", escape='\\'), 10), else_=0)),
+        else_=0,
+    )
+    pontuacao = func.greatest(
+        case((exacto, PONTOS_IDENTIFICADOR), else_=0),
+        case((prefixo_id, PONTOS_PREFIXO), else_=0),
+        pontos_telefone,
+        pontos_nome,
+    ).label('pontuacao')
+
+    consulta = (
+        select(Pessoa.id, Pessoa.nome_completo, Pessoa.tipo, Pessoa.numero_documento,
+               Aluno.id, Aluno.codigo_aluno, pontuacao)
+        .outerjoin(Aluno, Aluno.pessoa_id == Pessoa.id)
+        .where(Pessoa.ativo == True, or_(*condicoes))
+        .order_by(pontuacao.desc(), Pessoa.nome_completo)
+        .limit(limite)
+    )
+    if tipo is not None:
+        consulta = consulta.where(Pessoa.tipo == tipo)
+    return [Resultado(*linha[:6], round(float(linha[6]), 2)) for linha in session.execute(consulta)]
+
+
+class PesquisaPessoas:
+    """Ponto de entrada: PostgreSQL usa pg_trgm, os restantes o índice em memória"""
+
+    def __init__(self, session: Session):
+        self.session = session
+        self.usar_sql = session.bind is not None and session.bind.dialect.name == 'postgresql'
+        self._indice: Optional[IndicePessoas] = None
+
+    @property
+    def indice(self) -> IndicePessoas:
+        if self._indice is None:
+            self._indice = IndicePessoas.carregar(self.session)
+        return self._indice
+
+    def procurar(self, termo: str, limite: int = 20, tipo: Optional[str] = None) -> List[Resultado]:
+        if self.usar_sql:
+            return _procurar_sql(self.session, termo, limite, tipo)
+        return self.indice.procurar(termo, limite, tipo)
+
+    def atualizar_pessoa(self, pessoa_id: int):
+        """Reflecte no índice em memória as alterações de uma pessoa"""
+        if self._indice is None:
+            return
+        pessoa = self.session.execute(
+            select(Pessoa.id, Pessoa.nome_completo, Pessoa.tipo, Pessoa.numero_documento,
+                   Aluno.codigo_aluno, Aluno.codigo_med_aluno, Aluno.id.label('aluno_id'), Pessoa.ativo)
+            .outerjoin(Aluno, Aluno.pessoa_id == Pessoa.id)
+            .where(Pessoa.id == pessoa_id)
+        ).first()
+        if pessoa is None or not pessoa.ativo:
+            self._indice.remover(pessoa_id)
+            return
+        telefones = self.session.execute(
+            select(TelefonePessoa.numero).where(TelefonePessoa.pessoa_id == pessoa_id)
+        ).scalars().all()
+        self._indice.adicionar(*pessoa[:6], telefones=telefones, aluno_id=pessoa.aluno_id)
+
+
+def preencher_nome_pesquisa(session: Session, lote: int = 5000) -> int:
+    """Preenche nome_pesquisa nas pessoas gravadas antes da coluna existir"""
+    pendentes = session.execute(
+        select(Pessoa.id, Pessoa.nome_completo).where(Pessoa.nome_pesquisa == None)
+    ).all()
+    for i in range(0, len(pendentes), lote):
+        session.execute(update(Pessoa), [
+            {'id': pessoa_id, 'nome_pesquisa': dobrar_texto(nome)} for pessoa_id, nome in pendentes[i:i + lote]
+        ])
+    session.commit()
+    return len(pendentes)
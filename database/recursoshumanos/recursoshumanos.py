@@ -4,6 +4,7 @@ class Funcionario(Base):
     __tablename__ = 'funcionarios'
     
     id = Column(Integer, primary_key=True, autoincrement=True)
+    instituicao_id = Column(Integer, ForeignKey('instituicoes.id', ondelete='CASCADE'), nullable=False)
     pessoa_id = Column(Integer, ForeignKey('pessoas.id', ondelete='CASCADE'), nullable=False)
     codigo_funcionario = Column(String(50), unique=True, nullable=False)
     
@@ -42,6 +43,7 @@ class Funcionario(Base):
     frequencias = relationship("FrequenciaFuncionario", back_populates="funcionario", cascade="all, delete-orphan")
     
     __table_args__ = (
+        Index('idx_funcionario_instituicao_status', 'instituicao_id', 'status'),
         Index('idx_funcionario_codigo', 'codigo_funcionario'),
         Index('idx_funcionario_cargo', 'cargo'),
         Index('idx_funcionario_status', 'status'),
@@ -55,6 +57,7 @@ class Professor(Base):
     __tablename__ = 'professores'
     
     id = Column(Integer, primary_key=True, autoincrement=True)
+    instituicao_id = Column(Integer, ForeignKey('instituicoes.id', ondelete='CASCADE'), nullable=False)
     pessoa_id = Column(Integer, ForeignKey('pessoas.id', ondelete='CASCADE'), nullable=False)
     codigo_professor = Column(String(50), unique=True, nullable=False)
     
@@ -102,6 +105,7 @@ class Professor(Base):
     avaliacoes = relationship("Avaliacao", back_populates="professor", cascade="all, delete-orphan")
     
     __table_args__ = (
+        Index('idx_professor_instituicao_status', 'instituicao_id', 'status'),
         Index('idx_professor_codigo', 'codigo_professor'),
         Index('idx_professor_status', 'status'),
         Index('idx_professor_contrato', 'tipo_contrato'),
@@ -140,6 +144,11 @@ class Pessoa(Base):
     # Dados pessoais
     nome_completo = Column(String(200), nullable=False)
     nome_preferido = Column(String(100))
+    nome_pesquisa = Column(
+        String(200),
+        default=lambda contexto: dobrar_texto(contexto.get_current_parameters().get('nome_completo')),
+        comment='Nome sem acentos e em minúsculas, para pesquisa'
+    )
     data_nascimento = Column(Date, nullable=False)
     genero = Column(SQLEnum(Genero), nullable=False)
     estado_civil = Column(SQLEnum(EstadoCivil))
@@ -218,6 +227,31 @@ class Pessoa(Base):
             partes.append(f"({self.complemento_residencia})")
         return ", ".join(partes)
 
+@event.listens_for(Pessoa.nome_completo, 'set')
+def _atualizar_nome_pesquisa(pessoa, valor, anterior, iniciador):
+    """Mantém nome_pesquisa nas alterações feitas pelo ORM"""
+    pessoa.nome_pesquisa = dobrar_texto(valor)
+
+# Índices de pesquisa (PostgreSQL): trigramas para correspondências parciais
+# no nome e no telefone, text_pattern_ops para prefixos de documentos
+INDICES_PESQUISA_PESSOA = [
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm"),
+    DDL("CREATE INDEX IF NOT EXISTS idx_pessoa_nome_trgm ON pessoas USING gin (nome_pesquisa gin_trgm_ops)"),
+    DDL("CREATE INDEX IF NOT EXISTS idx_pessoa_documento_prefixo ON pessoas (numero_documento text_pattern_ops)"),
+]
+
+# Pesquisa por dígitos: o número sem espaços, '+', '-' ou parênteses
+INDICES_PESQUISA_TELEFONE = [
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm"),
+    DDL("CREATE INDEX IF NOT EXISTS idx_telefone_digitos_trgm ON telefones_pessoas "
+        "USING gin ((regexp_replace(numero, '\\D', '', 'g')) gin_trgm_ops)"),
+]
+
+for _ddl in INDICES_PESQUISA_PESSOA:
+    event.listen(Pessoa.__table__, 'after_create', _ddl.execute_if(dialect='postgresql'))
+for _ddl in INDICES_PESQUISA_TELEFONE:
+    event.listen(TelefonePessoa.__table__, 'after_create', _ddl.execute_if(dialect='postgresql'))
+
 
 class Estagio(Base):
     """Estágios dos cursos técnicos"""
@@ -0,0 +1,203 @@
+"""
+Hash de senhas com custo configurável.
+
+O hash gravado em `Usuario.senha_hash` identifica o algoritmo e o custo:
+
+    scrypt$n=16384,r=8,p=1$<hex>
+    pbkdf2_sha256$i=600000$<hex>
+
+Hashes antigos (SHA-256 simples, 64 caracteres hex sem prefixo) continuam a
+ser aceites e são marcados para actualização no próximo login com sucesso.
+O custo é escolhido por instalação com `configurar('scrypt$n=32768,r=8,p=1')`;
+`calibrar` mede o custo que cabe numa latência alvo.
+"""
+
+import hashlib
+import hmac
+import secrets
+import statistics
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+TAMANHO_SALT = 16          # bytes (32 caracteres hex, tamanho da coluna salt)
+TAMANHO_HASH = 32          # bytes derivados
+
+
+# ============================================================================
+# ALGORITMOS
+# ============================================================================
+
+class HasherLegado:
+    """SHA-256 simples com salt (apenas verificação)"""
+    nome = 'sha256'
+
+    def parametros(self) -> str:
+        return ''
+
+    def derivar(self, senha: str, salt: str) -> str:
+        return hashlib.sha256((senha + salt).encode()).hexdigest()
+
+
+class HasherScrypt:
+    """scrypt (hashlib); o custo é n = 2^k, com memória ~128·n·r bytes"""
+    nome = 'scrypt'
+
+    def __init__(self, n: int = 2 ** 14, r: int = 8, p: int = 1):
+        if n < 2 or n & (n - 1):
+            raise ValueError("O parâmetro n do scrypt deve ser uma potência de 2")
+        self.n, self.r, self.p = n, r, p
+
+    def parametros(self) -> str:
+        return f"n={self.n},r={self.r},p={self.p}"
+
+    def derivar(self, senha: str, salt: str) -> str:
+        return hashlib.scrypt(
+            senha.encode(), salt=salt.encode(), n=self.n, r=self.r, p=self.p,
+            maxmem=256 * self.n * self.r + (1 << 20), dklen=TAMANHO_HASH
+        ).hex()
+
+    def mais_forte(self) -> 'HasherScrypt':
+        return HasherScrypt(self.n * 2, self.r, self.p)
+
+
+class HasherPBKDF2:
+    """PBKDF2-HMAC-SHA256 (hashlib); o custo é o número de iterações"""
+    nome = 'pbkdf2_sha256'
+
+    def __init__(self, i: int = 600_000):
+        if i < 1:
+            raise ValueError("O número de iterações deve ser positivo")
+        self.i = i
+
+    def parametros(self) -> str:
+        return f"i={self.i}"
+
+    def derivar(self, senha: str, salt: str) -> str:
+        return hashlib.pbkdf2_hmac('sha256', senha.encode(), salt.encode(), self.i, TAMANHO_HASH).hex()
+
+    def mais_forte(self) -> 'HasherPBKDF2':
+        return HasherPBKDF2(self.i * 2)
+
+
+ALGORITMOS = {
+    HasherScrypt.nome: HasherScrypt,
+    HasherPBKDF2.nome: HasherPBKDF2,
+}
+
+
+def criar_hasher(especificacao: str):
+    """Cria um hasher a partir de 'algoritmo$k=v,...' (ex.: 'scrypt$n=16384,r=8,p=1')"""
+    nome, _, parametros = especificacao.partition('$')
+    if nome not in ALGORITMOS:
+        raise ValueError(f"Algoritmo de senha desconhecido: {nome}")
+    argumentos = {}
+    for par in filter(None, parametros.split(',')):
+        chave, _, valor = par.partition('=')
+        argumentos[chave.strip()] = int(valor)
+    return ALGORITMOS[nome](**argumentos)
+
+
+def especificacao(hasher) -> str:
+    return f"{hasher.nome}${hasher.parametros()}"
+
+
+# ============================================================================
+# CONFIGURAÇÃO
+# ============================================================================
+
+_hasher = HasherScrypt()
+_legado = HasherLegado()
+
+
+def configurar(hasher_ou_especificacao):
+    """Define o algoritmo e custo usados para novos hashes"""
+    global _hasher
+    if isinstance(hasher_ou_especificacao, str):
+        hasher_ou_especificacao = criar_hasher(hasher_ou_especificacao)
+    _hasher = hasher_ou_especificacao
+
+
+def hasher_ativo():
+    return _hasher
+
+
+def _separar(senha_hash: str) -> Tuple[object, str]:
+    """Devolve (hasher, digest) para um hash gravado"""
+    if '$' not in senha_hash:
+        return _legado, senha_hash
+    prefixo, _, digest = senha_hash.rpartition('$')
+    return criar_hasher(prefixo), digest
+
+
+# ============================================================================
+# API
+# ============================================================================
+
+def gerar_hash(senha: str, hasher=None) -> Tuple[str, str]:
+    """Devolve (senha_hash, salt) com o hasher activo"""
+    hasher = hasher or _hasher
+    salt = secrets.token_hex(TAMANHO_SALT)
+    return f"{especificacao(hasher)}${hasher.derivar(senha, salt)}", salt
+
+
+def verificar(senha: str, senha_hash: str, salt: str) -> bool:
+    """Compara a senha com um hash gravado em qualquer formato suportado"""
+    try:
+        hasher, digest = _separar(senha_hash)
+        derivado = hasher.derivar(senha, salt)
+    except (ValueError, TypeError):
+        # Algoritmo ou parâmetros desconhecidos/inválidos no hash gravado
+        return False
+    return hmac.compare_digest(derivado, digest)
+
+
+def precisa_atualizar(senha_hash: str) -> bool:
+    """True se o hash não usa o algoritmo e custo configurados"""
+    if '$' not in senha_hash:
+        return True
+    return senha_hash.rpartition('$')[0] != especificacao(_hasher)
+
+
+# ============================================================================
+# CALIBRAÇÃO
+# ============================================================================
+
+def _medir(hasher, repeticoes: int) -> float:
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        hasher.derivar('calibracao-senha', 'calibracao-salt')
+        tempos.append(time.perf_counter() - inicio)
+    return statistics.median(tempos)
+
+
+def calibrar(alvo_ms: float = 250.0, algoritmo: str = HasherScrypt.nome,
+             repeticoes: int = 3, inicial: Optional[str] = None) -> Dict:
+    """
+    Duplica o custo até exceder `alvo_ms` e devolve o mais forte que cabe no alvo.
+    Resultado: {'especificacao', 'ms', 'medicoes': [(especificacao, ms), ...]}
+    """
+    hasher = criar_hasher(inicial) if inicial else ALGORITMOS[algoritmo](
+        **({'n': 2 ** 12} if algoritmo == HasherScrypt.nome else {'i': 50_000}))
+    medicoes: List[Tuple[str, float]] = []
+    escolhido = None
+    while True:
+        try:
+            ms = _medir(hasher, repeticoes) * 1000
+        except (ValueError, MemoryError):
+            # Custo acima da memória disponível
+            break
+        medicoes.append((especificacao(hasher), round(ms, 2)))
+        if ms > alvo_ms:
+            break
+        escolhido = (especificacao(hasher), round(ms, 2))
+        try:
+            hasher = hasher.mais_forte()
+        except ValueError:
+            break
+    if escolhido is None:
+        if not medicoes:
+            raise ValueError("Não foi possível medir o custo inicial")
+        escolhido = medicoes[0]
+    return {'especificacao': escolhido[0], 'ms': escolhido[1], 'medicoes': medicoes}
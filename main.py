@@ -54,8 +54,21 @@ from database_model import (
     Base, Session, engine, Instituicao, Aluno, Professor, Funcionario,
     Turma, Matricula, Pagamento, ParcelaPropina, Disciplina, Nota,
     PresencaAula, CursoTecnico, Estagio, Usuario, ConfiguracaoSistema,
-    StatusPagamento, TipoPagamento, Turno, StatusAluno, NivelAcesso
+    StatusPagamento, TipoPagamento, Turno, StatusAluno, NivelAcesso,
+    AnoLetivo
 )
+from database.finanacas.inadimplencia import RelatorioInadimplencia
+from database.finanacas.previsao import PrevisaoFluxoCaixa
+from database.recursoshumanos.pesquisa import PesquisaPessoas
+from database.autenticacao import ServicoAutenticacao, NAO_ENCONTRADO, DESATIVADO, BLOQUEADO
+from database.senhas import configurar as configurar_hash_senhas
+from database.permissoes import MotorPermissoes
+from database.auditoria import GravadorAuditoria
+from database.arquivo_logs import manter_logs
+from database.atividades import FeedAtividades
+from database.instituicao.configuracao import CacheDefinicoes
+from database.instituicao.licencas import ServicoLicencas
+from database.instituicao import escopo
 
 # ============================================================================
 # CONSTANTES E CONFIGURAÇÕES
@@ -72,6 +85,26 @@ class AppConfig:
     APP_VERSION = "3.0.0"
     COMPANY_NAME = "SomaBemSchool"
     
+    # Hash de senhas (ajustável por instalação em QSettings "password_hash";
+    # calibrar com: python -m database.benchmarks custo_senha)
+    PASSWORD_HASH = "scrypt$n=16384,r=8,p=1"
+    
+    # Logs do sistema: meses mantidos na base antes de irem para o arquivo
+    LOG_ARCHIVE_DIR = "arquivo_logs"
+    LOG_ACTIVE_MONTHS = 12
+    ACTIVITY_FEED_SIZE = 200
+    
+    # Pesquisa de clientes no POS: espera após a última tecla e resultados listados
+    CLIENT_SEARCH_DELAY_MS = 300
+    CLIENT_SEARCH_RESULTS = 5
+    
+    # Itens da navegação que dependem de módulos da licença
+    LICENSED_MODULES = {
+        "finance": "financeiro", "payments": "financeiro", "pos": "financeiro",
+        "hr": "rh", "teachers": "rh",
+        "academic": "academico", "registration": "academico", "grades": "academico",
+    }
+    
     # Cores da bandeira de Angola
     COLORS = {
         Theme.LIGHT: {
@@ -133,6 +166,13 @@ class AppConfig:
     # Animations
     ANIMATION_DURATION = 300
 
+# Instituição e ConfiguracaoSistema em cache (instantâneos imutáveis,
+# seguros para leitura em workers)
+definicoes = CacheDefinicoes(Session)
+
+# Limites da licença com contadores em cache
+licencas = ServicoLicencas(Session)
+
 # ============================================================================
 # CLASSES AUXILIARES E WIDGETS PERSONALIZADOS
 # ============================================================================
@@ -495,9 +535,10 @@ class LoginWindow(QMainWindow):
     """Janela de login"""
     login_success = Signal(object)  # Emite objeto usuário
     
-    def __init__(self):
+    def __init__(self, autenticacao: ServicoAutenticacao):
         super().__init__()
         self.session = Session()
+        self.autenticacao = autenticacao
         self.current_theme = Theme.ANGOLA
         self.setup_ui()
         self.apply_theme()
@@ -544,8 +585,9 @@ class LoginWindow(QMainWindow):
         info_label.setFont(QFont("Segoe UI", 10))
         
         try:
-            instituicao = self.session.query(Instituicao).first()
-            if instituicao:
+            dados = definicoes.obter()
+            if dados:
+                instituicao = dados.instituicao
                 info_text = f"""
                 <b>{instituicao.nome_oficial}</b><br>
                 {instituicao.endereco_completo}<br>
@@ -800,67 +842,53 @@ class LoginWindow(QMainWindow):
         # Mostra overlay de carregamento
         self.overlay = LoadingOverlay(self)
         self.overlay.show()
-        QApplication.processEvents()
         
-        try:
-            # Busca usuário
-            user = self.session.query(Usuario).filter(
-                (Usuario.username == username) | (Usuario.email == username)
-            ).first()
-            
-            if not user:
-                self.overlay.hide()
-                QMessageBox.warning(self, "Erro", 
-                                   "Usuário não encontrado.")
-                return
-            
-            if not user.ativo:
-                self.overlay.hide()
-                QMessageBox.warning(self, "Erro", 
-                                   "Usuário desativado.")
-                return
-            
-            # Verifica senha
-            if not user.verificar_senha(password):
-                user.tentativas_login_falhas += 1
-                
-                if user.tentativas_login_falhas >= 5:
-                    user.data_bloqueio = datetime.utcnow()
-                    user.ativo = False
-                    self.session.commit()
-                    
-                    self.overlay.hide()
-                    QMessageBox.critical(self, "Erro", 
-                                        "Conta bloqueada por tentativas falhas.")
-                    return
-                
-                self.session.commit()
-                self.overlay.hide()
-                QMessageBox.warning(self, "Erro", 
-                                   f"Senha incorreta. Tentativas restantes: {5 - user.tentativas_login_falhas}")
-                return
-            
-            # Login bem-sucedido
-            user.data_ultimo_login = datetime.utcnow()
-            user.tentativas_login_falhas = 0
-            user.data_bloqueio = None
-            
-            if user.trocar_senha_proximo_login:
-                # Força troca de senha
-                self.overlay.hide()
-                self.show_change_password(user)
-                return
-            
-            self.session.commit()
-            self.save_credentials()
-            
-            self.overlay.hide()
-            self.login_success.emit(user)
-            
-        except Exception as e:
-            self.overlay.hide()
+        # Consulta e verificação da senha fora da thread da interface
+        worker = DatabaseWorker(self.autenticacao.autenticar, username, password)
+        worker.signals.result.connect(self.on_authenticated)
+        worker.signals.error.connect(self.on_authentication_error)
+        QThreadPool.globalInstance().start(worker)
+    
+    def on_authenticated(self, resultado):
+        """Trata o resultado da autenticação (thread da interface)"""
+        self.overlay.hide()
+        
+        if resultado.motivo == NAO_ENCONTRADO:
+            QMessageBox.warning(self, "Erro", 
+                               "Usuário não encontrado.")
+            return
+        
+        if resultado.motivo == DESATIVADO:
+            QMessageBox.warning(self, "Erro", 
+                               "Usuário desativado.")
+            return
+        
+        if resultado.motivo == BLOQUEADO:
             QMessageBox.critical(self, "Erro", 
-                               f"Erro ao autenticar: {str(e)}")
+                                "Conta bloqueada por tentativas falhas.")
+            return
+        
+        if not resultado.sucesso:
+            QMessageBox.warning(self, "Erro", 
+                               f"Senha incorreta. Tentativas restantes: {resultado.tentativas_restantes}")
+            return
+        
+        # Login bem-sucedido (data_ultimo_login é gravada em lote pelo serviço)
+        user = self.session.get(Usuario, resultado.usuario_id)
+        
+        if resultado.trocar_senha:
+            # Força troca de senha
+            self.show_change_password(user)
+            return
+        
+        self.save_credentials()
+        self.login_success.emit(user)
+    
+    def on_authentication_error(self, mensagem):
+        """Erro inesperado durante a autenticação"""
+        self.overlay.hide()
+        QMessageBox.critical(self, "Erro", 
+                           f"Erro ao autenticar: {mensagem}")
     
     def show_change_password(self, user):
         """Mostra diálogo para troca de senha"""
@@ -1039,6 +1067,10 @@ class MainWindow(QMainWindow):
         self.current_theme = Theme.ANGOLA
         self.dashboard_widget = None
         
+        # Permissões compiladas no login; os widgets consultam self.permissoes
+        self.motor_permissoes = MotorPermissoes(Session)
+        self.permissoes = self.motor_permissoes.obter(self.usuario.id)
+        
         # Configura baseado no nível de acesso
         if self.usuario.nivel_acesso == NivelAcesso.SUPER_ADMIN:
             self.dashboard_widget = SuperAdminDashboard(self.usuario, self)
@@ -1354,6 +1386,9 @@ class MainWindow(QMainWindow):
         
         # Adiciona itens à lista
         for item_id, text, icon_name in items:
+            modulo = AppConfig.LICENSED_MODULES.get(item_id)
+            if modulo and not licencas.modulo_ativo(modulo, escopo.instituicao_atual(self.session)):
+                continue
             item = QListWidgetItem(text)
             item.setData(Qt.UserRole, item_id)
             item.setIcon(QIcon.fromTheme(icon_name))
@@ -1399,6 +1434,11 @@ class MainWindow(QMainWindow):
         self.connection_status = QLabel("🟢 Conectado")
         status_bar.addPermanentWidget(self.connection_status)
         
+        # Licença
+        self.license_status = QLabel()
+        self.update_license_status()
+        status_bar.addPermanentWidget(self.license_status)
+        
         # Data e hora
         self.datetime_label = QLabel()
         self.update_datetime()
@@ -1409,6 +1449,17 @@ class MainWindow(QMainWindow):
         self.datetime_timer.timeout.connect(self.update_datetime)
         self.datetime_timer.start(1000)  # 1 segundo
     
+    def update_license_status(self):
+        """Mostra o estado da licença (valores em cache)"""
+        licenca = licencas.estado(escopo.instituicao_atual(self.session))
+        if licenca is None:
+            self.license_status.setText("Licença: não registada")
+            return
+        texto = f"Licença: {licenca.status_detalhado}"
+        if licenca.valida:
+            texto += f" ({licenca.dias_restantes} dias)"
+        self.license_status.setText(texto)
+    
     def update_datetime(self):
         """Atualiza data e hora na status bar"""
         now = QDateTime.currentDateTime()
@@ -1586,6 +1637,9 @@ Todos os direitos reservados.
     
     def update_dashboard(self):
         """Atualiza dados do dashboard periodicamente"""
+        # Só recompila se as permissões mudaram
+        self.permissoes = self.motor_permissoes.obter(self.usuario.id)
+        self.update_license_status()
         self.dashboard_widget.update_data()
     
     def logout(self):
@@ -1595,6 +1649,7 @@ Todos os direitos reservados.
                                     QMessageBox.Yes | QMessageBox.No)
         
         if reply == QMessageBox.Yes:
+            self.motor_permissoes.descartar(self.usuario.id)
             self.session.close()
             self.close()
 
@@ -1657,6 +1712,7 @@ class SuperAdminDashboard(BaseDashboard):
     """Dashboard para Super Admin"""
     
     def __init__(self, usuario, parent=None):
+        self.feed = FeedAtividades(AppConfig.ACTIVITY_FEED_SIZE)
         super().__init__(usuario, parent)
         self.setup_dashboard()
     
@@ -1824,23 +1880,29 @@ class SuperAdminDashboard(BaseDashboard):
     
     def load_activities(self):
         """Carrega atividades recentes"""
-        self.activities_table.setRowCount(0)
-        
-        # Exemplo de dados
-        activities = [
-            ["10:30", "admin", "Login", "Acesso ao sistema"],
-            ["10:25", "prof.maria", "Atualização", "Lançou notas da turma 7A"],
-            ["09:45", "secretaria", "Cadastro", "Nova matrícula #12345"],
-            ["09:20", "admin", "Backup", "Backup automático realizado"],
-            ["08:50", "diretor", "Relatório", "Gerou relatório financeiro"]
-        ]
+        # Só lê da base as entradas novas; a tabela é preenchida pelo buffer
+        self.feed.atualizar(self.session)
+        activities = self.feed.recentes(50)
         
+        self.activities_table.setRowCount(len(activities))
         for i, activity in enumerate(activities):
-            self.activities_table.insertRow(i)
-            for j, data in enumerate(activity):
+            values = [
+                activity.data_log.strftime("%d/%m %H:%M"),
+                activity.usuario or "sistema",
+                activity.acao.title(),
+                activity.descricao,
+            ]
+            for j, data in enumerate(values):
                 item = QTableWidgetItem(str(data))
                 self.activities_table.setItem(i, j, item)
     
+    def update_data(self):
+        """Atualiza atividades (consulta incremental)"""
+        try:
+            self.load_activities()
+        except Exception as e:
+            print(f"Erro ao atualizar atividades: {e}")
+    
     def show_system(self):
         """Mostra configurações do sistema"""
         dialog = SystemConfigDialog(self)
@@ -1871,8 +1933,37 @@ class DirecaoGeralDashboard(BaseDashboard):
     def setup_dashboard(self):
         """Configura dashboard específico"""
         # Similar ao SuperAdmin, mas focado em gestão institucional
-        # Implementação similar com métricas institucionais
-        pass
+        self.relatorio_inadimplencia = RelatorioInadimplencia(self.session)
+        
+        aging_label = QLabel("Inadimplência por Antiguidade")
+        aging_label.setFont(QFont("Segoe UI", 14, QFont.Bold))
+        self.layout.addWidget(aging_label)
+        
+        self.aging_chart = ChartWidget()
+        
+        # Previsão de fluxo de caixa
+        self.previsao_fluxo = PrevisaoFluxoCaixa(self.session)
+        self.forecast_chart = ChartWidget()
+        
+        charts_layout = QHBoxLayout()
+        charts_layout.addWidget(self.aging_chart, 1)
+        charts_layout.addWidget(self.forecast_chart, 1)
+        self.layout.addLayout(charts_layout)
+    
+    def load_data(self):
+        """Carrega dados do dashboard"""
+        try:
+            ano_letivo = self.session.query(AnoLetivo).filter(
+                AnoLetivo.ativo == True
+            ).order_by(AnoLetivo.ano.desc()).first()
+            
+            if ano_letivo:
+                self.relatorio_inadimplencia.renderizar(self.aging_chart, ano_letivo.id)
+            
+            self.previsao_fluxo.renderizar(self.forecast_chart)
+                
+        except Exception as e:
+            print(f"Erro ao carregar dados: {e}")
 
 class DirecaoPedagogicaDashboard(BaseDashboard):
     """Dashboard para Direção Pedagógica"""
@@ -1958,6 +2049,13 @@ class POSWindow(QDialog):
         self.usuario = usuario
         self.session = Session()
         self.cart = []  # Carrinho de compras
+        self.pesquisa = PesquisaPessoas(self.session)
+        self.cliente_id = None
+        # A pesquisa só corre quando o utilizador pára de escrever
+        self.client_search_timer = QTimer(self)
+        self.client_search_timer.setSingleShot(True)
+        self.client_search_timer.setInterval(AppConfig.CLIENT_SEARCH_DELAY_MS)
+        self.client_search_timer.timeout.connect(self.search_client)
         self.setup_ui()
     
     def setup_ui(self):
@@ -2031,11 +2129,16 @@ class POSWindow(QDialog):
         self.client_search = QLineEdit()
         self.client_search.setPlaceholderText("Buscar aluno por nome ou código...")
         
+        self.client_results = QListWidget()
+        self.client_results.setMaximumHeight(120)
+        self.client_results.hide()
+        
         self.client_info = QLabel("Nenhum cliente selecionado")
         self.client_info.setWordWrap(True)
         self.client_info.setStyleSheet("color: gray; padding: 10px;")
         
         client_layout.addWidget(self.client_search)
+        client_layout.addWidget(self.client_results)
         client_layout.addWidget(self.client_info)
         client_group.setLayout(client_layout)
         
@@ -2099,6 +2202,9 @@ class POSWindow(QDialog):
         
         # Conecta sinais
         self.paid_input.textChanged.connect(self.calculate_change)
+        self.client_search.textChanged.connect(self.on_client_search_changed)
+        self.client_results.itemClicked.connect(self.select_client)
+        self.client_results.itemActivated.connect(self.select_client)
     
     def load_products(self):
         """Carrega produtos do banco de dados"""
@@ -2168,6 +2274,38 @@ class POSWindow(QDialog):
         # Implementar filtragem
         pass
     
+    def on_client_search_changed(self, texto):
+        """Cada tecla anula o cliente escolhido e reinicia a espera da pesquisa"""
+        self.cliente_id = None
+        self.client_info.setText("Nenhum cliente selecionado")
+        self.client_results.clear()
+        self.client_results.hide()
+        if len(texto.strip()) < 2:
+            self.client_search_timer.stop()
+            return
+        self.client_search_timer.start()
+    
+    def search_client(self):
+        """Procura alunos pelo nome, documento, código ou telefone e lista os melhores"""
+        resultados = self.pesquisa.procurar(self.client_search.text(), limite=AppConfig.CLIENT_SEARCH_RESULTS,
+                                            tipo='aluno')
+        if not resultados:
+            self.client_info.setText("Nenhum aluno encontrado")
+            return
+        for aluno in resultados:
+            item = QListWidgetItem(f"{aluno.nome} ({aluno.codigo_aluno or aluno.numero_documento})")
+            item.setData(Qt.UserRole, aluno)
+            self.client_results.addItem(item)
+        self.client_results.show()
+        self.client_info.setText("Escolha o aluno na lista")
+    
+    def select_client(self, item):
+        """O cliente só fica definido quando o utilizador escolhe um resultado"""
+        aluno = item.data(Qt.UserRole)
+        self.cliente_id = aluno.aluno_id
+        self.client_results.hide()
+        self.client_info.setText(f"{aluno.nome}\nCódigo: {aluno.codigo_aluno or '-'} | Doc: {aluno.numero_documento}")
+    
     def add_to_cart(self, product):
         """Adiciona produto ao carrinho"""
         # Verifica se já está no carrinho
@@ -2560,6 +2698,15 @@ class Application(QApplication):
         self.setOrganizationName(AppConfig.COMPANY_NAME)
         self.setApplicationVersion(AppConfig.APP_VERSION)
         
+        # Algoritmo e custo do hash de senhas
+        settings = QSettings(AppConfig.COMPANY_NAME, AppConfig.APP_NAME)
+        password_hash = str(settings.value("password_hash", AppConfig.PASSWORD_HASH))
+        try:
+            configurar_hash_senhas(password_hash)
+        except (ValueError, TypeError) as e:
+            print(f"Configuração password_hash inválida ({password_hash!r}): {e}; a usar {AppConfig.PASSWORD_HASH}")
+            configurar_hash_senhas(AppConfig.PASSWORD_HASH)
+        
         # Configura estilo
         self.setStyle(QStyleFactory.create("Fusion"))
         
@@ -2571,14 +2718,56 @@ class Application(QApplication):
         self.thread_pool = QThreadPool()
         self.thread_pool.setMaxThreadCount(4)
         
+        # Auditoria automática das alterações (gravada em segundo plano)
+        self.auditoria = GravadorAuditoria(Session)
+        self.auditoria.instalar(Session)
+        self.aboutToQuit.connect(self.auditoria.fechar)
+        
+        # Limites da licença verificados em cada flush
+        licencas.instalar(Session)
+        self.thread_pool.start(DatabaseWorker(licencas.iniciar))
+        self.aboutToQuit.connect(licencas.parar)
+        
+        # Consultas e novos registos limitados à instituição da sessão
+        escopo.instalar(Session)
+        
+        # Autenticação com gravação em lote (último login, tentativas, rehash)
+        self.autenticacao = ServicoAutenticacao(Session)
+        self.aboutToQuit.connect(self.autenticacao.fechar)
+        
+        # Partições/rotação e arquivo dos logs em segundo plano
+        self.thread_pool.start(DatabaseWorker(self.maintain_logs))
+        
         # Mostra tela de login
-        self.login_window = LoginWindow()
+        self.login_window = LoginWindow(self.autenticacao)
         self.login_window.login_success.connect(self.on_login_success)
         self.login_window.show()
     
+    def maintain_logs(self):
+        """Manutenção de logs_sistema (executada num worker)"""
+        session = Session()
+        try:
+            return manter_logs(session, AppConfig.LOG_ARCHIVE_DIR, AppConfig.LOG_ACTIVE_MONTHS)
+        finally:
+            session.close()
+    
     def on_login_success(self, usuario):
         """Quando login é bem-sucedido"""
+        session = Session()
+        try:
+            instituicao_id = escopo.instituicao_do_usuario(session, usuario)
+        finally:
+            session.close()
+        if instituicao_id is None:
+            QMessageBox.critical(self.login_window, "Erro",
+                                 "O utilizador não está associado a uma instituição.")
+            return
+        
         self.login_window.hide()
+        self.auditoria.usuario_id = usuario.id
+        
+        # Novas sessões ficam limitadas à instituição do utilizador
+        Session.configure(info={escopo.CHAVE: instituicao_id})
         
         # Cria janela principal
         self.main_window = MainWindow(usuario)
@@ -2589,6 +2778,8 @@ class Application(QApplication):
     
     def on_logout(self):
         """Quando usuário faz logout"""
+        self.auditoria.usuario_id = None
+        Session.configure(info={})
         self.login_window.show()
 
 def main():